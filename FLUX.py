@@ -1,134 +1,176 @@
+import argparse
+import array
+import asyncio
+import bisect
+import builtins
+import concurrent.futures
+import functools
+import hashlib
+import io
+import itertools
+import marshal
+import math
+import multiprocessing
+import operator
+import os
+import re
 import sys
+import tempfile
+import threading
+import time
 
 
 class Token:
-    def __init__(self, type_, value=None):
+    __slots__ = ('type', 'value', 'line', 'col')
+    def __init__(self, type_, value=None, line=None, col=None):
         self.type = type_       # e.g. 'NUMBER', 'IDENT', 'KEYWORD', etc.
         self.value = value
+        self.line = line        # 1-based source position
+        self.col = col
     def __repr__(self):
         return f"Token({self.type!r}, {self.value!r})"
 
+class SourceError(Exception):
+    # The lexer or parser stopped at line:col of the source
+    def __init__(self, message, line, col):
+        Exception.__init__(self, message if line is None else
+                           f"{message} at line {line}, column {col}")
+        self.message = message
+        self.line = line
+        self.col = col
+
+# Reserved words -> (token type, value)
+KEYWORDS = {w: ('KEYWORD', w) for w in
+            ('function','end','for','while','if','return','print','input','elif','else','in',
+              'parallel')}
+KEYWORDS.update({w: ('TYPE', w) for w in ('int','float','string','bool','map')})
+KEYWORDS.update(true=('BOOL', True), false=('BOOL', False))
+
+OPERATORS = {
+    '<<': 'LSHIFT', '+=': 'PLUSEQ', '-=': 'MINUSEQ', '*=': 'TIMESEQ', '/=': 'DIVEQ',
+    '==': 'EQEQ', '!=': 'NOTEQ', '+': 'PLUS', '-': 'MINUS', '*': 'TIMES',
+    '/': 'DIVIDE', '=': 'EQ', '<': 'LT', '>': 'GT', '(': 'LPAREN', ')': 'RPAREN',
+    '[': 'LBRACKET', ']': 'RBRACKET', '{': 'LBRACE', '}': 'RBRACE', ':': 'COLON', ',': 'COMMA',
+}
+
+# One master pattern; the group that matched names the token kind. Leading
+# blanks are consumed with the token. Inside strings only \n and \" are
+# escapes, any other backslash is kept as is.
+TOKEN_RE = re.compile(r'''[^\S\n]*(?:
+    (?P<NL>\n)
+  | (?P<SKIP>\#[^\n]*)
+  | (?P<NUMBER>\d[\d.]*)
+  | (?P<NAME>[^\W\d]\w*)
+  | (?P<STRING>"[^"\\]*(?:\\(?:[n"]|(?![n"]))[^"\\]*)*")
+  | (?P<BADSTRING>")
+  | (?P<OP><<|[-+*/=!]=|[-+*/=<>()\[\]{}:,])
+  | (?P<MISMATCH>\S)
+)''', re.VERBOSE)
+ESCAPE_RE = re.compile(r'\\([n"])')
+
+def unescape(m):
+    return '\n' if m.group(1) == 'n' else '"'
+
 class Lexer:
-    def __init__(self, code):
+    def __init__(self, code, line=1):
         self.code = code
-        self.pos = 0
-        self.current_char = code[0] if code else None
-    
-    def advance(self):
-        self.pos += 1
-        self.current_char = self.code[self.pos] if self.pos < len(self.code) else None
-    
-    def peek(self):
-        return self.code[self.pos+1] if self.pos+1 < len(self.code) else None
+        self.line = line   # number of the first line of code
     
     def tokenize(self):
-        tokens = []
-        while self.current_char is not None:
-            c = self.current_char
-            if c.isspace():
-                # Keep newline as a token for statement endings
-                if c == '\n':
-                    tokens.append(Token('NL'))
-                self.advance()
-                continue
-            # Skip comments
-            if c == '#':
-                while self.current_char is not None and self.current_char != '\n':
-                    self.advance()
-                continue
-            # Multi-char operators
-            if c == '<' and self.peek() == '<':
-                tokens.append(Token('LSHIFT','<<')); self.advance(); self.advance(); continue
-            if c == '+' and self.peek() == '=':
-                tokens.append(Token('PLUSEQ','+=')); self.advance(); self.advance(); continue
-            if c == '-' and self.peek() == '=':
-                tokens.append(Token('MINUSEQ','-=')); self.advance(); self.advance(); continue
-            if c == '*' and self.peek() == '=':
-                tokens.append(Token('TIMESEQ','*=')); self.advance(); self.advance(); continue
-            if c == '/' and self.peek() == '=':
-                tokens.append(Token('DIVEQ','/=')); self.advance(); self.advance(); continue
-            if c == '=' and self.peek() == '=':
-                tokens.append(Token('EQEQ','==')); self.advance(); self.advance(); continue
-            if c == '!' and self.peek() == '=':
-                tokens.append(Token('NOTEQ','!=')); self.advance(); self.advance(); continue
-            # Number literal
-            if c.isdigit():
-                num_str = ''
-                has_dot = False
-                while self.current_char and (self.current_char.isdigit() or self.current_char == '.'):
-                    if self.current_char == '.':
-                        if has_dot: raise Exception("Invalid number")
-                        has_dot = True
-                    num_str += self.current_char
-                    self.advance()
-                tokens.append(Token('NUMBER', float(num_str) if has_dot else int(num_str)))
-                continue
-            # Identifier, keyword, or boolean literal
-            if c.isalpha() or c == '_':
-                id_str = ''
-                while self.current_char and (self.current_char.isalnum() or self.current_char == '_'):
-                    id_str += self.current_char
-                    self.advance()
-                if id_str in ('function','end','for','while','if','return','print','input','elif','else'):
-                    tokens.append(Token('KEYWORD', id_str))
-                elif id_str == 'in':
-                    tokens.append(Token('KEYWORD','in'))
-                elif id_str in ('int','float','string','bool'):
-                    tokens.append(Token('TYPE', id_str))
-                elif id_str in ('true','false'):
-                    tokens.append(Token('BOOL', id_str == 'true'))
+        return list(self.tokens())
+
+    def tokens(self):
+        # Yields the tokens one by one, for the parser to consume as they come.
+        # The code is a string, or an iterable of lines (a text file) read
+        # only as far as the tokens taken so far need. Each distinct name and
+        # constant is made once and shared; strings are interned, so map keys
+        # written as literals are found by identity.
+        code = self.code
+        names = {}
+        consts = {}
+        line = self.line
+        line_start = 0   # where the line starts, relative to buf
+        buf = ''         # a string literal left open, then the next line
+        for piece in ((code,) if isinstance(code, str) else code):
+            buf += piece
+            for m in TOKEN_RE.finditer(buf):
+                kind = m.lastgroup
+                if kind == 'SKIP':
+                    continue
+                start = m.start(kind)
+                col = start - line_start + 1
+                if kind == 'NAME':
+                    text = m.group(kind)
+                    tok = KEYWORDS.get(text)
+                    if tok is None: yield Token('IDENT', names.setdefault(text, text), line, col)
+                    else: yield Token(tok[0], tok[1], line, col)
+                elif kind == 'NL':
+                    # Keep newline as a token for statement endings
+                    yield Token('NL', None, line, col)
+                    line += 1
+                    line_start = start + 1
+                elif kind == 'OP':
+                    text = m.group(kind)
+                    yield Token(OPERATORS[text], text, line, col)
+                elif kind == 'NUMBER':
+                    text = m.group(kind)
+                    value = consts.get(text)
+                    if value is None:
+                        dots = text.count('.')
+                        if dots > 1: raise SourceError("Invalid number", line, col)
+                        value = consts[text] = float(text) if dots else int(text)
+                    yield Token('NUMBER', value, line, col)
+                elif kind == 'STRING':
+                    text = m.group(kind)
+                    value = consts.get(text)
+                    if value is None:
+                        value = text[1:-1]
+                        if '\\' in value:
+                            value = ESCAPE_RE.sub(unescape, value)
+                        value = consts[text] = sys.intern(value)
+                    yield Token('STRING', value, line, col)
+                    newlines = m.group(kind).count('\n')
+                    if newlines:
+                        line += newlines
+                        line_start = m.group(kind).rindex('\n') + start + 1
+                elif kind == 'BADSTRING':
+                    # The string may end on a line still to come: keep it
+                    # and lex it again with that line
+                    buf = buf[start:]
+                    line_start -= start
+                    break
                 else:
-                    tokens.append(Token('IDENT', id_str))
-                continue
-            # String literal
-            if c == '"':
-                self.advance()
-                str_val = ''
-                while self.current_char is not None and self.current_char != '"':
-                    if self.current_char == '\\':
-                        # Handle escape sequences \n or \"
-                        if self.peek() == 'n':
-                            str_val += '\n'; self.advance(); self.advance(); continue
-                        if self.peek() == '"':
-                            str_val += '"'; self.advance(); self.advance(); continue
-                        # (Other escapes can be added)
-                    str_val += self.current_char
-                    self.advance()
-                if self.current_char != '"':
-                    raise Exception("Unterminated string")
-                self.advance()
-                tokens.append(Token('STRING', str_val))
-                continue
-            # Single-char tokens
-            if c == '+': tokens.append(Token('PLUS','+')); self.advance(); continue
-            if c == '-': tokens.append(Token('MINUS','-')); self.advance(); continue
-            if c == '*': tokens.append(Token('TIMES','*')); self.advance(); continue
-            if c == '/': tokens.append(Token('DIVIDE','/')); self.advance(); continue
-            if c == '=': tokens.append(Token('EQ','=')); self.advance(); continue
-            if c == '<': tokens.append(Token('LT','<')); self.advance(); continue
-            if c == '>': tokens.append(Token('GT','>')); self.advance(); continue
-            if c == '(': tokens.append(Token('LPAREN','(')); self.advance(); continue
-            if c == ')': tokens.append(Token('RPAREN',')')); self.advance(); continue
-            if c == '[': tokens.append(Token('LBRACKET','[')); self.advance(); continue
-            if c == ']': tokens.append(Token('RBRACKET',']')); self.advance(); continue
-            if c == ':': tokens.append(Token('COLON',':')); self.advance(); continue
-            if c == ',': tokens.append(Token('COMMA',',')); self.advance(); continue
-            raise Exception(f"Unexpected character: {c}")
-        tokens.append(Token('EOF'))
-        return tokens
+                    raise SourceError(f"Unexpected character: {m.group(kind)}", line, col)
+            else:
+                line_start -= len(buf)
+                buf = ''
+        if buf:
+            # buf starts at the opening quote
+            raise SourceError("Unterminated string", line, 1 - line_start)
+        yield Token('EOF', None, line, 1 - line_start)
 
 class Parser:
+    # Takes the tokens as a list or as a stream (Lexer.tokens()), of which it
+    # holds only the current token and the one peek() looked at. Equal leaf
+    # nodes (constants and variables) are built once and shared.
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
-        self.current = tokens[0]
+        self.tokens = iter(tokens)
+        self.ahead = None
+        self.leaves = {}
+        self.current = self.next_token()
     
     def error(self, msg):
-        raise Exception(f"{msg}. Got {self.current}")
+        raise SourceError(f"{msg}. Got {self.current}", self.current.line, self.current.col)
     
+    def next_token(self):
+        tok = self.ahead
+        if tok is not None:
+            self.ahead = None
+            return tok
+        return next(self.tokens, None) or Token('EOF')
+
     def advance(self):
-        self.pos += 1
-        self.current = self.tokens[self.pos] if self.pos < len(self.tokens) else Token('EOF')
+        self.current = self.next_token()
         return self.current
     
     def eat(self, type_, value=None):
@@ -140,27 +182,57 @@ class Parser:
             self.error(f"Expected {type_} {value}")
     
     def peek(self):
-        return self.tokens[self.pos+1] if self.pos+1 < len(self.tokens) else Token('EOF')
+        if self.ahead is None:
+            self.ahead = next(self.tokens, None) or Token('EOF')
+        return self.ahead
+
+    def leaf(self, tag, value):
+        # The type is part of the key: 1, 1.0 and True are equal
+        key = (tag, value, type(value))
+        node = self.leaves.get(key)
+        if node is None:
+            node = self.leaves[key] = (tag, value)
+        return node
     
     def parse_program(self):
-        stmts = []
+        return ('PROGRAM', list(self.top_level()))
+
+    def statements(self):
+        # The top-level statements (function definitions included) one at a
+        # time, to run each as soon as it is parsed. Leaves are shared within
+        # a statement only, so nothing holds on to one the caller is done with.
+        for stmt in self.top_level():
+            yield stmt
+            self.leaves.clear()
+
+    def top_level(self):
         while self.current.type != 'EOF':
             if self.current.type == 'NL':
                 self.advance(); continue
             if self.current.type=='KEYWORD' and self.current.value=='function':
-                stmts.append(self.parse_function())
+                yield self.parse_function()
             else:
-                stmts.append(self.parse_statement())
-        return ('PROGRAM', stmts)
+                yield self.parse_statement()
     
+    def parse_type(self):
+        vtype = self.eat('TYPE').value
+        if self.current.type == 'LBRACKET':
+            # int[] / float[]
+            if vtype not in ('int', 'float'):
+                self.error(f"No array type for {vtype}")
+            self.eat('LBRACKET'); self.eat('RBRACKET')
+            vtype += '[]'
+        return vtype
+
     def parse_function(self):
+        line = self.current.line
         self.eat('KEYWORD','function')
         name = self.eat('IDENT').value
         self.eat('LPAREN')
         params = []
         if self.current.type == 'TYPE':
             while True:
-                ptype = self.eat('TYPE').value
+                ptype = self.parse_type()
                 pname = self.eat('IDENT').value
                 params.append((ptype,pname))
                 if self.current.type=='COMMA': self.eat('COMMA')
@@ -173,18 +245,20 @@ class Parser:
             body.append(self.parse_statement())
         self.eat('KEYWORD','end')
         self.eat('KEYWORD','function')
-        if self.current.type=='NL': self.advance()
-        return ('FUNCDEF', name, params, body)
+        return ('FUNCDEF', name, params, body, line)
     
+    # Every statement node (and CALL) ends with the line it starts on. A
+    # statement stops at the NL after it, which the loop reading statements
+    # skips: a complete statement never waits for the line after it.
     def parse_statement(self):
         if self.current.type == 'TYPE':
             # Variable declaration
-            vtype = self.eat('TYPE').value
+            line = self.current.line
+            vtype = self.parse_type()
             vname = self.eat('IDENT').value
             self.eat('EQ')
             expr = self.parse_expression()
-            if self.current.type=='NL': self.advance()
-            return ('VAR_DECL', vtype, vname, expr)
+            return ('VAR_DECL', vtype, vname, expr, line)
         if self.current.type=='KEYWORD':
             if self.current.value=='print':
                 return self.parse_print()
@@ -194,6 +268,8 @@ class Parser:
                 return self.parse_while()
             if self.current.value=='for':
                 return self.parse_for()
+            if self.current.value=='parallel':
+                return self.parse_parallel_for()
             if self.current.value=='return':
                 return self.parse_return()
         if self.current.type=='IDENT':
@@ -201,13 +277,15 @@ class Parser:
             # Assignment (including += etc) or function call
             if nxt in ('EQ','PLUSEQ','MINUSEQ','TIMESEQ','DIVEQ'):
                 return self.parse_assignment()
+            if nxt=='LBRACKET':
+                return self.parse_setitem()
             if nxt=='LPAREN':
                 call_node = self.parse_call()
-                if self.current.type=='NL': self.advance()
                 return call_node
         self.error("Unknown statement start")
     
     def parse_assignment(self):
+        line = self.current.line
         name = self.eat('IDENT').value
         if self.current.type=='EQ':
             self.eat('EQ'); op='='
@@ -216,19 +294,33 @@ class Parser:
             op = tok.value
             self.advance()
         expr = self.parse_expression()
-        if self.current.type=='NL': self.advance()
-        return ('ASSIGN', name, op, expr)
+        return ('ASSIGN', name, op, expr, line)
     
+    def parse_setitem(self):
+        # Array element or map entry assignment: a[i] = expr (or +=, -=, *=, /=)
+        line = self.current.line
+        name = self.eat('IDENT').value
+        self.eat('LBRACKET')
+        index = self.parse_expression()
+        self.eat('RBRACKET')
+        if self.current.type not in ('EQ','PLUSEQ','MINUSEQ','TIMESEQ','DIVEQ'):
+            self.error("Expected assignment to array element")
+        op = self.current.value
+        self.advance()
+        expr = self.parse_expression()
+        return ('SETITEM', name, index, op, expr, line)
+
     def parse_print(self):
+        line = self.current.line
         self.eat('KEYWORD','print')
         parts = []
         while self.current.type=='LSHIFT':
             self.eat('LSHIFT')
             parts.append(self.parse_expression())
-        if self.current.type=='NL': self.advance()
-        return ('PRINT', parts)
+        return ('PRINT', parts, line)
     
     def parse_if(self):
+        line = self.current.line
         self.eat('KEYWORD','if')
         cond = self.parse_expression()
         if self.current.type=='NL': self.advance()
@@ -264,10 +356,10 @@ class Parser:
         # Consume end if
         self.eat('KEYWORD','end')
         self.eat('KEYWORD','if')
-        if self.current.type=='NL': self.advance()
-        return ('IF', branches, else_branch)
+        return ('IF', branches, else_branch, line)
     
     def parse_while(self):
+        line = self.current.line
         self.eat('KEYWORD','while')
         if self.current.type=='LPAREN':
             self.eat('LPAREN'); cond=self.parse_expression(); self.eat('RPAREN')
@@ -279,30 +371,45 @@ class Parser:
             if self.current.type=='NL': self.advance(); continue
             body.append(self.parse_statement())
         self.eat('KEYWORD','end'); self.eat('KEYWORD','while')
-        if self.current.type=='NL': self.advance()
-        return ('WHILE', cond, body)
+        return ('WHILE', cond, body, line)
     
-    def parse_for(self):
+    def parse_for(self, parallel=False):
+        line = self.current.line
         self.eat('KEYWORD','for')
         var = self.eat('IDENT').value
-        self.eat('EQ')
-        start = self.parse_expression()
-        self.eat('KEYWORD','in')
-        end = self.parse_expression()
+        if self.current.type=='KEYWORD' and self.current.value=='in':
+            if parallel:
+                self.error("parallel for needs a range: for i = a in b")
+            # for k in m: the keys of a map, characters of a string or
+            # elements of an array
+            self.advance()
+            tag, head = 'FOREACH', (self.parse_expression(),)
+        else:
+            self.eat('EQ')
+            start = self.parse_expression(allow_in=False)
+            self.eat('KEYWORD','in')
+            tag, head = 'FOR', (start, self.parse_expression())
         if self.current.type=='NL': self.advance()
         body=[]
         while not (self.current.type=='KEYWORD' and self.current.value=='end'):
             if self.current.type=='NL': self.advance(); continue
             body.append(self.parse_statement())
         self.eat('KEYWORD','end'); self.eat('KEYWORD','for')
-        if self.current.type=='NL': self.advance()
-        return ('FOR', var, start, end, body)
+        return (tag, var) + head + (body, line)
+
+    def parse_parallel_for(self):
+        # parallel for: same shape as FOR, tagged PFOR
+        self.eat('KEYWORD','parallel')
+        if not (self.current.type=='KEYWORD' and self.current.value=='for'):
+            self.error("Expected for after parallel")
+        node = self.parse_for(parallel=True)
+        return ('PFOR',) + node[1:]
     
     def parse_return(self):
+        line = self.current.line
         self.eat('KEYWORD','return')
         expr = self.parse_expression()
-        if self.current.type=='NL': self.advance()
-        return ('RETURN', expr)
+        return ('RETURN', expr, line)
     
     def parse_call(self):
         node = self.parse_primary()
@@ -310,7 +417,8 @@ class Parser:
             self.error("Expected function call")
         return node
     
-    def parse_expression(self):
+    def parse_expression(self, allow_in=True):
+        # allow_in=False leaves `in` for the for loop: for i = 0 in n
         node = self.parse_term()
         while self.current.type in ('PLUS','MINUS'):
             op = self.current.value
@@ -319,7 +427,8 @@ class Parser:
             right = self.parse_term()
             node = ('BINOP', op, node, right)
         # After arithmetic, check for comparison
-        if self.current.type in ('LT','GT','EQEQ','NOTEQ'):
+        if self.current.type in ('LT','GT','EQEQ','NOTEQ') or (
+                allow_in and self.current.type=='KEYWORD' and self.current.value=='in'):
             op = self.current.value
             self.advance()
             right = self.parse_term()
@@ -347,15 +456,9 @@ class Parser:
     
     def parse_primary(self):
         tok = self.current
-        if tok.type=='NUMBER':
-            self.advance()
-            return ('NUMBER', tok.value)
-        if tok.type=='STRING':
+        if tok.type in ('NUMBER', 'STRING', 'BOOL'):
             self.advance()
-            return ('STRING', tok.value)
-        if tok.type=='BOOL':
-            self.advance()
-            return ('BOOL', tok.value)
+            return self.leaf(tok.type, tok.value)
         if tok.type=='IDENT':
             name = tok.value; self.advance()
             # Array slicing or function call or variable
@@ -370,6 +473,10 @@ class Parser:
                     end = None
                     if self.current.type!='RBRACKET':
                         end = self.parse_expression()
+                elif start is not None:
+                    # a[i]: an array element, or s[i:] on a string
+                    self.eat('RBRACKET')
+                    return ('INDEX', name, start)
                 else:
                     end = None
                 self.eat('RBRACKET')
@@ -383,8 +490,8 @@ class Parser:
                         if self.current.type=='COMMA': self.eat('COMMA'); continue
                         break
                 self.eat('RPAREN')
-                return ('CALL', name, args)
-            return ('VAR', name)
+                return ('CALL', name, args, tok.line)
+            return self.leaf('VAR', name)
         if tok.type=='KEYWORD' and tok.value=='input':
             # Input call: input << expr
             self.eat('KEYWORD','input')
@@ -396,49 +503,905 @@ class Parser:
             expr = self.parse_expression()
             self.eat('RPAREN')
             return expr
+        if tok.type=='LBRACKET':
+            # Array literal: [1, 2, 3]
+            self.eat('LBRACKET')
+            items = []
+            if self.current.type!='RBRACKET':
+                while True:
+                    items.append(self.parse_expression())
+                    if self.current.type=='COMMA': self.eat('COMMA'); continue
+                    break
+            self.eat('RBRACKET')
+            return ('ARRAY', items)
+        if tok.type=='LBRACE':
+            # Map literal: {key: value, ...}, items flattened to k1, v1, k2, ...
+            self.eat('LBRACE')
+            items = []
+            if self.current.type!='RBRACE':
+                while True:
+                    items.append(self.parse_expression())
+                    self.eat('COLON')
+                    items.append(self.parse_expression())
+                    if self.current.type=='COMMA': self.eat('COMMA'); continue
+                    break
+            self.eat('RBRACE')
+            return ('MAP', items)
         self.error("Unexpected token in expression")
     
 class ReturnException(Exception):
+    # Raised only for a `return` outside any function
     def __init__(self, value):
         self.value = value
 
-class Interpreter:
+# Status a statement hands back when it executed `return`
+RETURN = object()
+# Why VirtualMachine.execute stopped before HALT: its ticks ran out, or it
+# reached input << with suspend_input set (the prompt is on the stack)
+SUSPENDED = object()
+NEEDS_INPUT = object()
+
+class StringBuilder:
+    # Value of a string variable that is being grown with +=. Appends are
+    # amortized O(1) and the parts are joined, once, when the variable is
+    # next read. A builder only ever sits in a variable slot: every read
+    # hands out the joined str, so FLUX code never sees one.
+    __slots__ = ('parts',)
+    def __init__(self, *parts):
+        self.parts = list(parts)
+    def __str__(self):
+        parts = self.parts
+        if len(parts) != 1:
+            parts[:] = [''.join(parts)]
+            if len(parts[0]) > string_check: check_string(parts[0])
+        return parts[0]
+
+class FluxArray:
+    # Value of an int[] / float[]: a memoryview over an array.array ('q' or
+    # 'd'), 8 bytes per element. Slicing gives a view of the same buffer, so
+    # a[2:5] copies nothing and writes through it show up in a. Arithmetic
+    # with another array or a number runs element-wise as one map() over the
+    # buffers and returns a new array. Unlike int, an int[] element is 64-bit:
+    # storing one outside -2**63 .. 2**63-1 is an error.
+    __slots__ = ('data',)
+    def __init__(self, data):
+        self.data = data
+
+    @staticmethod
+    def of(typecode, values):
+        try:
+            return FluxArray(memoryview(array.array(typecode, values)))
+        except OverflowError:
+            if typecode != 'q':
+                raise
+            raise Exception("int[] element out of 64-bit range") from None
+
+    def __len__(self):
+        return len(self.data)
+    def __str__(self):
+        return '[' + ', '.join(map(str, self.data.tolist())) + ']'
+    def __eq__(self, other):
+        return type(other) is FluxArray and self.data == other.data
+    __hash__ = None
+    def __reduce__(self):
+        # memoryviews do not pickle; a view goes over as a copy
+        return (FluxArray.of, (self.data.format, self.data.tolist()))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return FluxArray(self.data[i])
+        return self.data[i]
+    def __setitem__(self, i, val):
+        data = self.data
+        if data.format != 'q':
+            data[i] = decl_float(val)
+            return
+        val = decl_int(val)
+        try:
+            data[i] = val
+        except ValueError:
+            # memoryview's error for an int that does not fit
+            raise Exception("int[] element out of 64-bit range") from None
+
+    def elementwise(self, other, op, reverse=False):
+        data = self.data
+        if type(other) is FluxArray:
+            if len(other.data) != len(data):
+                raise Exception("Array length mismatch")
+            values = map(op, other.data, data) if reverse else map(op, data, other.data)
+            floats = 'd' in (data.format, other.data.format)
+        elif isinstance(other, (int, float)):
+            rep = itertools.repeat(other)
+            values = map(op, rep, data) if reverse else map(op, data, rep)
+            floats = data.format == 'd' or isinstance(other, float)
+        else:
+            return NotImplemented
+        return FluxArray.of('d' if floats or op is operator.truediv else 'q', values)
+
+    def __add__(self, other): return self.elementwise(other, operator.add)
+    def __radd__(self, other): return self.elementwise(other, operator.add, True)
+    def __sub__(self, other): return self.elementwise(other, operator.sub)
+    def __rsub__(self, other): return self.elementwise(other, operator.sub, True)
+    def __mul__(self, other): return self.elementwise(other, operator.mul)
+    def __rmul__(self, other): return self.elementwise(other, operator.mul, True)
+    def __truediv__(self, other): return self.elementwise(other, operator.truediv)
+    def __rtruediv__(self, other): return self.elementwise(other, operator.truediv, True)
+    def __neg__(self):
+        return FluxArray.of(self.data.format, map(operator.neg, self.data))
+
+class FluxMap(dict):
+    # Value of a map: a dict from numbers, strings or bools to any values,
+    # in insertion order. String keys are interned when stored (and string
+    # literals when lexed), so looking up the same string finds its key by
+    # identity. Keys equal as numbers, like 1, 1.0 and true, are one key.
+    __slots__ = ()
+    def __str__(self):
+        return '{' + ', '.join(f"{map_text(k)}: {map_text(v)}" for k, v in self.items()) + '}'
+
+class Function:
+    # A defined FLUX function. Parameter checks happen once, here, so a call
+    # only compares the argument count. `body` is whatever the backend runs:
+    # AST statements, compiled closures or a Code object.
+    # `memo` is the interpreter's Memo when the function is pure, else None.
+    # The tree walker counts `calls` and, once the function is hot, runs
+    # `native`, the Python function TierCompiler made from the body.
+    __slots__ = ('name', 'params', 'body', 'nlocals', 'arity', 'pnames', 'memo',
+                 'calls', 'native')
+    def __init__(self, name, params, body, nlocals=0, memo=None):
+        pnames = tuple(pname for _, pname in params)
+        for ptype, pname in params:
+            if ptype not in DECL_CONVERT:
+                raise Exception(f"Unknown type {ptype} for parameter '{pname}' in function {name}")
+        if len(set(pnames)) != len(pnames):
+            raise Exception(f"Duplicate parameter name in function {name}")
+        self.name = name
+        self.params = params
+        self.body = body
+        self.nlocals = max(nlocals, len(pnames))
+        self.arity = len(pnames)
+        self.pnames = pnames
+        self.memo = memo
+        self.calls = 0
+        self.native = None
+
+MEMO_SIZE = 1024
+MISSING = object()
+
+class Memo:
+    # Bounded LRU cache of pure function results, shared by all functions of
+    # one interpreter. Keys carry the argument types, so f(1), f(1.0) and
+    # f(true) are cached apart, and the sign of float arguments, so f(0.0)
+    # and f(-0.0) are too. Calls that raise are not cached.
+    def __init__(self, size=MEMO_SIZE):
+        self.size = size
+        self.cache = {}     # dict order is recency order
+        self.hits = self.misses = self.evictions = 0
+
+    def key(self, func, args):
+        # None (never cached) when an argument is a mutable array or map
+        types = tuple(map(type, args))
+        if FluxArray in types or FluxMap in types:
+            return None
+        if float in types:
+            # 0.0 == -0.0, but they print apart
+            args = [(a, math.copysign(1.0, a)) if t is float else a
+                    for a, t in zip(args, types)]
+        return (func, tuple(args), types)
+
+    def get(self, key):
+        if key is None:
+            return MISSING
+        cache = self.cache
+        val = cache.pop(key, MISSING)
+        if val is MISSING:
+            self.misses += 1
+        else:
+            cache[key] = val
+            self.hits += 1
+        return val
+
+    def put(self, key, val):
+        if key is None:
+            return
+        cache = self.cache
+        cache[key] = val
+        if len(cache) > self.size:
+            del cache[next(iter(cache))]
+            self.evictions += 1
+
+    def report(self):
+        return (f"memo: {self.hits} hits, {self.misses} misses, "
+                f"{self.evictions} evictions, {len(self.cache)}/{self.size} entries")
+
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+class Output:
+    # Destination of print <<. Text is collected until `size` characters are
+    # pending, then encoded once and written to the stream's binary buffer in
+    # a single call. size 0 writes through on every print. Pending text is
+    # flushed before every input << prompt, so the two never reorder.
+    def __init__(self, stream=None, size=OUTPUT_BUFFER_SIZE, stdin=None):
+        self.buffer_size = size
+        self.parts = []
+        self.pending = 0
+        self.limit(0)
+        self.redirect(stream or sys.stdout, stdin)
+
+    def limit(self, chars):
+        # Lets `chars` more characters out (0: no limit). Text is flushed
+        # before it can pass the limit, so the print that goes over it is
+        # the one that raises LimitExceeded; what fits is still written.
+        self.max_chars = chars
+        self.room = chars or None
+        self.size = min(self.buffer_size, chars + 1) if chars else self.buffer_size
+        self.over = False
+
+    def redirect(self, stream, stdin=None):
+        # Sends further output to `stream`. input << reads lines from stdin,
+        # or through the input() builtin when it is None.
+        self.stream = stream
+        self.raw = getattr(stream, 'buffer', None)
+        self.encoding = getattr(stream, 'encoding', None) or 'utf-8'
+        self.errors = getattr(stream, 'errors', None) or 'strict'
+        self.stdin = stdin
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+        text = self.take()
+        if self.raw is None:
+            self.stream.write(text)
+            self.stream.flush()
+        else:
+            self.stream.flush()   # anything written through the text layer goes first
+            self.raw.write(text.encode(self.encoding, self.errors))
+            self.raw.flush()
+        self.check()
+
+    def take(self):
+        # Pending text, removed, for callers that write it out themselves
+        # (and then call check()). It is cut off at the limit.
+        text = ''.join(self.parts)
+        self.parts.clear()
+        self.pending = 0
+        if self.room is not None:
+            if len(text) > self.room:
+                text = text[:self.room]
+                self.over = True
+            self.room -= len(text)
+            self.size = min(self.buffer_size, self.room + 1)
+        return text
+
+    def check(self):
+        if self.over:
+            self.over = False
+            raise LimitExceeded('output', f"Output limit of {self.max_chars} characters exceeded")
+
+    def input(self, prompt):
+        if self.stdin is None:
+            self.flush()
+            return input(prompt)
+        # Like input(): the prompt is output, the newline is dropped
+        self.write(prompt)
+        line = self.stdin.readline()
+        if not line:
+            raise EOFError("EOF when reading a line")
+        return line[:-1] if line.endswith('\n') else line
+
+# Loop iterations and calls a metered run makes between two looks at the
+# clock (and at the step limit)
+METER_INTERVAL = 1000
+
+class LimitExceeded(Exception):
+    # A metered run went over one of its limits. `limit` names it: 'steps',
+    # 'timeout', 'depth', 'output' or 'string'; `line` is the source line
+    # the run was at, when known.
+    def __init__(self, limit, message, line=None):
+        Exception.__init__(self, message if line is None else f"{message} at line {line}")
+        self.limit = limit
+        self.message = message
+        self.line = line
+    def __reduce__(self):
+        # Comes back pickled from parallel for workers
+        return LimitExceeded, (self.limit, self.message, self.line)
+
+class MeterLocal(threading.local):
+    max_string = 0   # string length limit of the run on this thread
+
+metered = MeterLocal()
+
+class Meter:
+    # Limits for running untrusted code; 0 is no limit. A step is a loop
+    # iteration or a call. Loops count their steps off `left`, or locally and
+    # spend() them in bulk. A call adds one to `calls` and its return one to
+    # `returns`, so the depth is calls - returns; check() runs when `left` is
+    # used up or `calls` reaches `check_at`, and counts both into `steps`, so
+    # the clock is read once every METER_INTERVAL steps. Depth is only
+    # compared there: check_at never lets more calls run unchecked than there
+    # are levels left (an error ends the run, and start() resets the
+    # counts). Output is limited by the Output, string length wherever a
+    # string is built (check_string).
+    def __init__(self, max_steps=0, timeout=0, max_depth=0, max_output=0, max_string=0):
+        self.limit(max_steps, timeout, max_depth, max_output, max_string)
+        self.start()
+
+    def limit(self, max_steps=0, timeout=0, max_depth=0, max_output=0, max_string=0):
+        # New limits, from the next start() on; compiled code keeps the meter.
+        # Sums are only checked by code compiled while there was a string
+        # limit (string_checked), so set that one before preparing a program.
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.max_depth = max_depth
+        self.max_output = max_output
+        self.max_string = max_string
+        self.depth_limit = max_depth or sys.maxsize
+
+    def start(self, out=None):
+        # Counts a new run from zero
+        self.steps = 0
+        self.calls = self.returns = self.counted = 0
+        self.deadline = time.monotonic() + self.timeout if self.timeout else None
+        self.refill()
+        if out is not None:
+            out.limit(self.max_output)
+
+    def run(self, fn, *args):
+        # fn(*args) with this meter's string limit on this thread
+        global string_check
+        if self.max_string:
+            string_check = min(string_check, self.max_string)
+        saved = metered.max_string
+        metered.max_string = self.max_string
+        try:
+            return fn(*args)
+        finally:
+            metered.max_string = saved
+
+    def chunk(self):
+        if not self.max_steps:
+            return METER_INTERVAL
+        return min(METER_INTERVAL, self.max_steps - self.steps + 1)
+
+    def refill(self):
+        self.given = self.left = self.chunk()
+        # The call that would go one level past the limit is checked
+        depth = self.calls - self.returns
+        self.check_at = self.calls + min(self.given, self.depth_limit - depth + 1)
+
+    def spend(self, n, line=None):
+        self.left -= n
+        if self.left <= 0:
+            self.check(line)
+
+    def check(self, line=None):
+        self.steps += self.given - self.left + self.calls - self.counted
+        self.counted = self.calls
+        if self.max_steps and self.steps > self.max_steps:
+            raise LimitExceeded('steps', f"Step limit of {self.max_steps} exceeded", line)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded('timeout', f"Time limit of {self.timeout:g}s exceeded", line)
+        if self.calls - self.returns > self.depth_limit:
+            raise self.too_deep(line)
+        self.refill()
+
+    def too_deep(self, line=None):
+        return LimitExceeded('depth', f"Call depth limit of {self.max_depth} exceeded", line)
+
+
+class Profiler:
+    # Wall-clock profile of one run: per FLUX function the calls, inclusive
+    # and exclusive time, and per source line the hits and time. A line's
+    # time leaves out nested statements of the same function but includes
+    # the functions it calls. Exclusive time is also kept per call stack, in
+    # the collapsed format flame graph tools read. Memo hits are not calls.
+    def __init__(self):
+        self.functions = {}   # name -> [calls, inclusive, exclusive]
+        self.lines = {}       # (function, line) -> [hits, time]
+        self.stacks = {}      # (function, ...) -> exclusive time
+        self.active = {}      # name or (function, line) -> activations
+        # [name, start, time in callees, stack, open lines]
+        self.frames = []
+        self.enter_call('<program>')
+
+    def enter_call(self, name):
+        stack = self.frames[-1][3] + (name,) if self.frames else (name,)
+        self.active[name] = self.active.get(name, 0) + 1
+        self.frames.append([name, time.perf_counter(), 0.0, stack, []])
+
+    def leave_call(self):
+        name, start, callees, stack, _ = self.frames.pop()
+        total = time.perf_counter() - start
+        rec = self.functions.setdefault(name, [0, 0.0, 0.0])
+        rec[0] += 1
+        rec[2] += total - callees
+        self.active[name] -= 1
+        if not self.active[name]:
+            # Only the outermost activation, so recursion is not counted twice
+            rec[1] += total
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + total - callees
+        if self.frames:
+            self.frames[-1][2] += total
+
+    def enter_line(self, line):
+        key = (self.frames[-1][0], line)
+        self.active[key] = self.active.get(key, 0) + 1
+        self.frames[-1][4].append([time.perf_counter(), 0.0])
+
+    def leave_line(self, line):
+        frame = self.frames[-1]
+        start, nested = frame[4].pop()
+        total = time.perf_counter() - start
+        key = (frame[0], line)
+        rec = self.lines.setdefault(key, [0, 0.0])
+        rec[0] += 1
+        self.active[key] -= 1
+        if not self.active[key]:
+            rec[1] += total - nested
+        if frame[4]:
+            frame[4][-1][1] += total
+
+    def wrap_line(self, fn, line):
+        # Compiled statement closure that reports to the profiler
+        enter, leave = self.enter_line, self.leave_line
+        def profiled(fr):
+            enter(line)
+            try:
+                return fn(fr)
+            finally:
+                leave(line)
+        return profiled
+
+    def wrap_body(self, name, body):
+        # Compiled function body as a single closure that counts the call
+        enter, leave = self.enter_call, self.leave_call
+        def profiled(fr):
+            enter(name)
+            try:
+                for f in body:
+                    if f(fr) is RETURN: return RETURN
+            finally:
+                leave()
+        return [profiled]
+
+    def finish(self):
+        while self.frames:
+            self.leave_call()
+
+    def report(self, out, source=None, limit=20):
+        lines = source.splitlines() if source else []
+        out.write(f"{'function':<24}{'calls':>10}{'incl ms':>12}{'excl ms':>12}\n")
+        for name, (calls, incl, excl) in sorted(self.functions.items(), key=lambda kv: -kv[1][2]):
+            out.write(f"{name:<24}{calls:>10}{incl * 1000:>12.2f}{excl * 1000:>12.2f}\n")
+        out.write(f"\n{'line':>6}  {'function':<20}{'hits':>10}{'ms':>12}  source\n")
+        ranked = sorted(self.lines.items(), key=lambda kv: -kv[1][1])
+        for (name, line), (hits, t) in ranked[:limit]:
+            text = lines[line - 1].strip() if line and line <= len(lines) else ''
+            out.write(f"{line:>6}  {name:<20}{hits:>10}{t * 1000:>12.2f}  {text}\n")
+
+    def write_stacks(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, t in sorted(self.stacks.items()):
+                us = round(t * 1e6)
+                if us:
+                    f.write(f"{';'.join(stack)} {us}\n")
+
+# Worker processes a `parallel for` runs on by default
+PARALLEL_WORKERS = os.cpu_count() or 1
+# Chunks per worker: more chunks even out iterations of uneven cost
+PARALLEL_CHUNKS = 4
+
+class Reduction:
+    # Stands in for a `parallel for` accumulator while a worker runs its
+    # chunk: += only records what was added, in order, for the parent to
+    # apply to the real value.
+    __slots__ = ('values',)
     def __init__(self):
+        self.values = []
+    def __add__(self, val):
+        self.values.append(val)
+        return self
+
+class EnvScope:
+    # Variables a tree walker `parallel for` touches: declarations live in
+    # the current env, other names in the env or the globals.
+    def __init__(self, interp):
+        self.env = interp.current_env()
+        self.globals = interp.global_vars
+    def where(self, name):
+        if name in self.env: return self.env
+        if name in self.globals: return self.globals
+        raise undefined(name)
+    def load(self, name): return self.where(name)[name]
+    def assign(self, name, val): self.where(name)[name] = val
+    def declare(self, name, val): self.env[name] = val
+    def clear(self, name): self.env.pop(name, None)
+    def value(self, name): return self.env.get(name, MISSING)
+
+class SlotScope:
+    # The same for the closure and bytecode backends, where a function's
+    # variables are slots of its frame; `bindings` maps names to bindings.
+    def __init__(self, g, fr, bindings):
+        self.globals = g
+        self.fr = fr
+        self.bindings = bindings
+    def where(self, name):
+        depth, slot, _, _ = self.bindings[name]
+        if depth == LOCAL and self.fr[slot] is not UNSET: return self.fr, slot
+        if name in self.globals: return self.globals, name
+        raise undefined(name)
+    def load(self, name):
+        env, key = self.where(name)
+        return env[key]
+    def assign(self, name, val):
+        env, key = self.where(name)
+        env[key] = val
+    def declare(self, name, val):
+        depth, slot, _, _ = self.bindings[name]
+        if depth == LOCAL: self.fr[slot] = val
+        else: self.globals[name] = val
+    def clear(self, name):
+        depth, slot, _, _ = self.bindings[name]
+        if depth == LOCAL: self.fr[slot] = UNSET
+        else: self.globals.pop(name, None)
+    def value(self, name):
+        depth, slot, _, _ = self.bindings[name]
+        v = self.fr[slot] if depth == LOCAL else self.globals.get(name, MISSING)
+        return MISSING if v is UNSET else v
+
+# The chunk runner of the `parallel for` being executed. Workers are forked,
+# so they inherit it (with the whole interpreter: functions, globals and
+# frame) instead of having it pickled.
+parallel_job = None
+
+def run_parallel_chunk(start, end):
+    return parallel_job(start, end)
+
+def parallel_for(interp, start, end, run_range, scope, reductions, declared):
+    # Runs iterations start..end-1 of a `parallel for`; run_range(a, b) runs
+    # a..b-1 in order. check_parallel_for makes sure iterations only share
+    # += accumulators (`reductions`) and names they declare before use
+    # (`declared`), so chunks may run anywhere. Their print output and
+    # accumulated values are applied in iteration order, which gives exactly
+    # the result of a sequential run. Without fork (or workers) it is one.
+    global parallel_job
+    n = end - start
+    workers = min(interp.workers, n)
+    if (workers < 2 or 'fork' not in multiprocessing.get_all_start_methods()
+            or threading.active_count() > 1):
+        return run_range(start, end)
+    out = interp.out
+    initial = {name: scope.load(name) for name in reductions}
+
+    def job(a, b):
+        # Runs in a worker, on its forked copy of the interpreter
+        out.parts = []
+        out.pending = 0
+        out.size = sys.maxsize
+        for name in declared:
+            scope.clear(name)
+        accs = {name: Reduction() for name in reductions}
+        for name, acc in accs.items():
+            scope.assign(name, acc)
+        error = None
+        try:
+            run_range(a, b)
+        except Exception as e:
+            error = e
+        added = {}
+        for name, acc in accs.items():
+            values = acc.values
+            if isinstance(initial[name], (str, StringBuilder)):
+                # Stays a string: send the appended text
+                added[name] = (True, ''.join(v if isinstance(v,str) else str(v) for v in values))
+            else:
+                added[name] = (False, values)
+        values = {}
+        for name in declared:
+            v = scope.value(name)
+            if v is not MISSING:
+                values[name] = flux_text(v)
+        return ''.join(out.parts), added, values, error
+
+    chunks = min(n, workers * PARALLEL_CHUNKS)
+    bounds = [start + n * k // chunks for k in range(chunks + 1)]
+    totals = dict(initial)
+    finals = {}
+    sys.stdout.flush(); sys.stderr.flush()
+    parallel_job = job
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+            for text, added, values, error in pool.map(run_parallel_chunk, bounds[:-1], bounds[1:]):
+                out.write(text)
+                if error is not None:
+                    raise error
+                for name, (is_text, data) in added.items():
+                    x = totals[name]
+                    if is_text:
+                        if data: x = flux_append(x, data)
+                    elif data and isinstance(x, int) and all(type(v) is int for v in data):
+                        x = x + sum(data)
+                    else:
+                        for v in data:
+                            x = flux_append(x, v)
+                    totals[name] = x
+                finals.update(values)
+    finally:
+        parallel_job = None
+    for name, x in totals.items():
+        scope.assign(name, x)
+    for name, v in finals.items():
+        scope.declare(name, v)
+
+# Calls of a function, or iterations of one run of a loop, after which the
+# tree walker compiles it to Python
+TIER_THRESHOLD = 100
+# Loop iterations and calls an async VM session runs before it yields
+ASYNC_TICKS = 1000
+# Connections serve() lets queue up while it is busy (asyncio's default is 100)
+SERVE_BACKLOG = 4096
+
+class Interpreter:
+    def __init__(self, out=None, memo_size=MEMO_SIZE, tier_threshold=TIER_THRESHOLD):
+        # Without an explicit Output every print is written straight through;
+        # main() passes a buffered one and flushes it at exit.
+        self.out = out if out is not None else Output(size=0)
+        # Results of pure functions are memoized; memo_size 0 turns it off
+        self.memo = Memo(memo_size) if memo_size > 0 else None
+        self.pure = set()
+        self.profiler = None     # set for --profile
+        # Tiering (tree walker only): 0 never compiles. tier_dump is a stream
+        # that gets the generated Python source.
+        self.tier_threshold = tier_threshold
+        self.tier_dump = None
+        self.tiered = {}         # id(loop node) -> (node, compiled loop, guard)
+        self.appended_names = set()  # every variable the program uses += on
+        self.intrinsic_names = ()    # intrinsics no function of the program shadows
+        self.workers = PARALLEL_WORKERS  # processes for `parallel for`
+        self.meter = None        # a Meter limits the runs of prepared programs
         self.global_vars = {}    # global scope
-        self.functions = {}      # function name -> (params, body)
+        self.functions = {}      # function name -> Function
         self.envs = [self.global_vars]  # stack of scopes
+        self.return_value = None
     
     def current_env(self):
         return self.envs[-1]
+
+    def reset(self):
+        # Fresh global state for another run of a prepared program. The
+        # dicts are cleared in place: compiled code holds on to them.
+        self.global_vars.clear()
+        self.functions.clear()
+        del self.envs[1:]
+        self.return_value = None
+        if self.memo is not None:
+            self.memo.cache.clear()
+
+    def call_function(self, name, arg_vals, line=None):
+        func = self.functions.get(name)
+        if func is None:
+            return call_intrinsic(name, arg_vals)
+        if len(arg_vals) != func.arity:
+            raise Exception(f"Argument count mismatch in call to {name}")
+        memo = func.memo
+        if memo is not None:
+            key = memo.key(func, arg_vals)
+            ret_val = memo.get(key)
+            if ret_val is not MISSING:
+                return ret_val
+        ret_val = self.run_function(func, arg_vals, line)
+        if memo is not None:
+            memo.put(key, ret_val)
+        return ret_val
+
+    def run_function(self, func, arg_vals, line=None):
+        meter = self.meter
+        if meter is not None:
+            meter.calls += 1
+            if meter.calls >= meter.check_at: meter.check(line)
+        if func.native is not None:
+            ret_val = func.native(*arg_vals)
+        else:
+            func.calls += 1
+            if func.calls == self.tier_threshold and not contains(func.body, 'PFOR'):
+                func.native = TierCompiler(self).function(func)
+                ret_val = func.native(*arg_vals)
+            else:
+                # Create new local scope
+                self.envs.append(dict(zip(func.pnames, arg_vals)))
+                ret_val = None
+                for stmt in func.body:
+                    if self.exec(stmt) is RETURN:
+                        ret_val = self.return_value
+                        break
+                self.envs.pop()
+        if meter is not None:
+            meter.returns += 1
+        return ret_val
+
+    def tier_loop(self, node):
+        loop, guard = TierCompiler(self).loop(node, self.current_env())
+        self.tiered[id(node)] = (node, loop, guard)
+        return loop
+
+    def compiled_loop(self, node):
+        # The compiled version of a loop, recompiled if the env it was made
+        # for does not fit the current one (top level loops have no guard)
+        entry = self.tiered.get(id(node))
+        if entry is None:
+            return None
+        if entry[2] is None or entry[2](self.current_env()):
+            return entry[1]
+        return self.tier_loop(node)
+
+    def parallel_for(self, node):
+        _, var, start_expr, end_expr, body, _ = node
+        start = self.eval(start_expr); end = self.eval(end_expr)
+        if not (isinstance(start,int) and isinstance(end,int)):
+            raise Exception("Loop bounds must be integers")
+        reductions, declared, _, errors = check_parallel_for(node)
+        if errors:
+            raise Exception(errors[0])
+        env = self.current_env()
+        meter = self.meter
+        def run_range(a, b):
+            for i in range(a, b):
+                env[var] = i
+                for stmt in body:
+                    self.exec(stmt)
+                if meter is not None: meter.spend(1, node[-1])
+        parallel_for(self, start, end, run_range, EnvScope(self), reductions, declared)
+
+    def make_function(self, name, params, body, nlocals=0):
+        memo = self.memo if name in self.pure else None
+        return Function(name, params, body, nlocals, memo)
+    # Scoping is lexical: a function sees its own locals and the globals,
+    # never the locals of whoever called it.
     def get_var(self, name):
-        for env in reversed(self.envs):
-            if name in env:
-                return env[name]
-        raise Exception(f"Variable '{name}' not defined")
+        env = self.envs[-1]
+        if name not in env:
+            env = self.global_vars
+            if name not in env:
+                raise Exception(f"Variable '{name}' not defined")
+        val = env[name]
+        if type(val) is StringBuilder:
+            return str(val)
+        return val
     def set_var(self, name, value):
-        for env in reversed(self.envs):
-            if name in env:
-                env[name] = value
-                return
-        raise Exception(f"Variable '{name}' not defined")
+        env = self.envs[-1]
+        if name not in env:
+            env = self.global_vars
+            if name not in env:
+                raise Exception(f"Variable '{name}' not defined")
+        env[name] = value
     
+    def prepare(self, node):
+        # Analyses a PROGRAM node once and returns a function that runs it
+        if self.memo is not None:
+            self.pure = pure_functions(Resolver(self.global_vars).resolve_program(node))
+        if self.tier_threshold:
+            augmented_names(node[1], self.appended_names)
+            self.intrinsic_names = INTRINSICS.keys() - {s[1] for s in function_defs(node[1], [])}
+        stmts = node[1]
+        def program():
+            for stmt in stmts:
+                if self.exec(stmt) is RETURN:
+                    raise ReturnException(self.return_value)
+        return self.metered(program)
+
+    def metered(self, run):
+        # run, with every call of it counted against self.meter
+        meter = self.meter
+        if meter is None:
+            return run
+        def metered_run():
+            meter.start(self.out)
+            return meter.run(run)
+        return metered_run
+
+    def stream(self, stmts, opt_level=1):
+        # Runs a program as it is parsed: every top-level statement `stmts`
+        # (Parser.statements()) yields is optimized, checked and run, then
+        # dropped; function definitions stay, as their statements ran. The
+        # order of things is that of a whole-program run: a function exists
+        # from when its definition has run, and a call inside a body looks
+        # up its function when it runs. self.meter's limits cover it all.
+        feed = self.streamer(opt_level)
+        if self.meter is not None:
+            self.meter.start(self.out)
+        for node in stmts:
+            feed(node)
+
+    def streamer(self, opt_level=1):
+        # Returns feed(node), which optimizes, checks and runs the next
+        # top-level statement of a program that comes one at a time (see
+        # stream()). What a statement costs depends on it alone, not on the
+        # statements before it. Calls look functions up by name, so when
+        # one is redefined only the memoized results of it and of the
+        # functions calling it go; a definition that is a statement of its
+        # own may be memoized again, under its new Function.
+        optimizer = Optimizer(opt_level)
+        resolver = Resolver(self.global_vars)
+        purity = Purity()
+        self.pure = purity.pure
+        untyped = set()   # globals any function so far may read or write
+        def forget(names):
+            for name in names:
+                func = self.functions.get(name)
+                if func is not None: func.memo = None
+        def feed(node):
+            for node in optimizer.optimize_statement(node):
+                resolved = resolver.resolve_statement(node)
+                defs = function_defs([resolved], [])
+                for d in defs:
+                    binding_names(d[3], untyped)
+                    if self.memo is not None:
+                        forget(purity.define(d, d is resolved))
+                run = self.statement(node, resolved, untyped)
+                try:
+                    if self.meter is None: run()
+                    else: self.meter.run(run)
+                except Exception:
+                    # A function it should have defined may not be
+                    if self.memo is not None:
+                        for d in defs: forget(purity.demote(d[1]))
+                    raise
+        return feed
+
+    def statement(self, node, resolved, untyped):
+        # A function running one top-level statement for stream(): node as
+        # parsed and as resolved. Names += newly grows may be read as plain
+        # values by compiled code, which then goes; so do top-level loops
+        # once they have run.
+        if self.tier_threshold:
+            n = len(self.appended_names)
+            augmented_names([node], self.appended_names)
+            if len(self.appended_names) > n:
+                self.tiered.clear()
+                for func in self.functions.values():
+                    func.native = None
+                    func.calls = 0
+        def run():
+            try:
+                if self.exec(node) is RETURN:
+                    raise ReturnException(self.return_value)
+            finally:
+                if self.tiered:
+                    for key in [k for k, entry in self.tiered.items() if entry[2] is None]:
+                        del self.tiered[key]
+        return run
+
+    def typed_statement(self, resolved, untyped):
+        # A statement resolved for stream(), typed as a program of its own.
+        # The globals functions use count as 'any' (see TierCompiler.function):
+        # what statements still to come write to them is not known yet.
+        preset = [name for name in binding_names(resolved, set())
+                  if name in untyped or name in self.global_vars]
+        program = TypeSpecializer(preset).specialize_program(('PROGRAM', [resolved]))
+        if string_checked(self.meter):
+            program = checked_sums(program)
+        return program
+
     def eval(self, node):
-        typ = node[0]
-        if typ == 'PROGRAM':
-            for stmt in node[1]:
-                self.exec(stmt)
-        else:
-            return self.exec(node)
+        if node[0] == 'PROGRAM':
+            return self.prepare(node)()
+        return self.exec(node)
     
     def exec(self, node):
         typ = node[0]
         # Function definition: store it
         if typ == 'FUNCDEF':
-            _, name, params, body = node
-            self.functions[name] = (params, body)
+            _, name, params, body, _ = node
+            self.functions[name] = self.make_function(name, params, body)
             return
         if typ == 'VAR_DECL':
-            _, vartype, name, expr = node
+            _, vartype, name, expr, _ = node
             val = self.eval(expr)
             # Type enforcement (convert or check)
             if vartype == 'int':
@@ -452,87 +1415,112 @@ class Interpreter:
             if vartype == 'bool':
                 if isinstance(val,(int,float)): val = bool(val)
                 elif not isinstance(val,bool): raise Exception("Type mismatch bool")
+            if vartype in ('int[]', 'float[]', 'map'):
+                val = DECL_CONVERT[vartype](val)
             self.current_env()[name] = val
         elif typ == 'ASSIGN':
-            _, name, op, expr = node
+            _, name, op, expr, _ = node
             val = self.eval(expr)
             if op == '=':
                 self.set_var(name, val)
+            elif op == '+=':
+                env = self.envs[-1]
+                if name not in env:
+                    env = self.global_vars
+                    if name not in env:
+                        raise Exception(f"Variable '{name}' not defined")
+                env[name] = flux_append(env[name], val)
             else:
                 old = self.get_var(name)
-                if op == '+=':
-                    # String concatenation if either side is string
-                    if isinstance(old,str) or isinstance(val,str):
-                        res = str(old) + str(val)
-                    else:
-                        res = old + val
-                elif op == '-=': res = old - val
+                if op == '-=': res = old - val
                 elif op == '*=': res = old * val
                 elif op == '/=': res = old / val
                 self.set_var(name, res)
+        elif typ == 'SETITEM':
+            _, name, index_expr, op, expr, _ = node
+            arr = self.get_var(name)
+            i = self.eval(index_expr)
+            flux_setitem(arr, i, op, self.eval(expr))
         elif typ == 'PRINT':
-            _, parts = node
+            parts = node[1]
             out_str = ''
             for part in parts:
                 v = self.eval(part)
                 out_str += str(v) if v is not None else ''
-            print(out_str, end='')
+            self.out.write(out_str)
         elif typ == 'IF':
-            _, branches, else_branch = node
+            _, branches, else_branch, _ = node
             executed = False
             for cond, body in branches:
                 if self.eval(cond):
                     for stmt in body:
-                        self.exec(stmt)
+                        if self.exec(stmt) is RETURN: return RETURN
                     executed = True
                     break
             
             if not executed:
                 for stmt in else_branch:
-                    self.exec(stmt)
+                    if self.exec(stmt) is RETURN: return RETURN
         elif typ == 'WHILE':
-            _, cond, body = node
+            _, cond, body, _ = node
+            # Iterations left before the rest of this run goes to compiled code
+            n = self.tier_threshold
+            loop = n and self.compiled_loop(node)
+            if loop:
+                return loop(self.current_env())
+            meter = self.meter
             while self.eval(cond):
                 for stmt in body:
-                    self.exec(stmt)
+                    if self.exec(stmt) is RETURN: return RETURN
+                if meter is not None: meter.spend(1, node[-1])
+                n -= 1
+                if n == 0 and not contains(body, 'PFOR'):
+                    return self.tier_loop(node)(self.current_env())
         elif typ == 'FOR':
-            _, var, start_expr, end_expr, body = node
+            _, var, start_expr, end_expr, body, _ = node
             start = self.eval(start_expr); end = self.eval(end_expr)
             if not (isinstance(start,int) and isinstance(end,int)):
                 raise Exception("Loop bounds must be integers")
+            n = self.tier_threshold
+            loop = n and self.compiled_loop(node)
+            if loop:
+                return loop(self.current_env(), start, end)
+            meter = self.meter
             for i in range(start, end):
                 self.current_env()[var] = i
                 for stmt in body:
-                    self.exec(stmt)
+                    if self.exec(stmt) is RETURN: return RETURN
+                if meter is not None: meter.spend(1, node[-1])
+                n -= 1
+                if n == 0 and not contains(body, 'PFOR'):
+                    return self.tier_loop(node)(self.current_env(), i + 1, end)
+        elif typ == 'FOREACH':
+            _, var, expr, body, _ = node
+            items = flux_items(self.eval(expr))
+            n = self.tier_threshold
+            loop = n and self.compiled_loop(node)
+            if loop:
+                return loop(self.current_env(), items)
+            meter = self.meter
+            for k, item in enumerate(items):
+                self.current_env()[var] = item
+                for stmt in body:
+                    if self.exec(stmt) is RETURN: return RETURN
+                if meter is not None: meter.spend(1, node[-1])
+                n -= 1
+                if n == 0 and not contains(body, 'PFOR'):
+                    return self.tier_loop(node)(self.current_env(), items[k + 1:])
+        elif typ == 'PFOR':
+            self.parallel_for(node)
         elif typ == 'RETURN':
-            _, expr = node
-            val = self.eval(expr)
-            raise ReturnException(val)
+            self.return_value = self.eval(node[1])
+            return RETURN
         elif typ == 'CALL':
-            _, name, args = node
-            arg_vals = [self.eval(a) for a in args]
-            if name not in self.functions:
-                raise Exception(f"Function '{name}' not defined")
-            params, body = self.functions[name]
-            if len(arg_vals) != len(params):
-                raise Exception(f"Argument count mismatch in call to {name}")
-            # Create new local scope
-            new_env = {}
-            for (ptype,pname), val in zip(params, arg_vals):
-                new_env[pname] = val
-            self.envs.append(new_env)
-            ret_val = None
-            try:
-                for stmt in body:
-                    self.exec(stmt)
-            except ReturnException as re:
-                ret_val = re.value
-            self.envs.pop()
-            return ret_val
+            return self.call_function(node[1], [self.eval(a) for a in node[2]], node[3])
         elif typ == 'INPUT':
             _, prompt_expr = node
             prompt_val = self.eval(prompt_expr)
-            ret = input(str(prompt_val))
+            ret = self.out.input(str(prompt_val))
             return ret
         elif typ == 'NUMBER':
             return node[1]
@@ -546,7 +1534,10 @@ class Interpreter:
             _, op, left, right = node
             l = self.eval(left); r = self.eval(right)
             if op == '+':
-                if isinstance(l,str) or isinstance(r,str): return str(l) + str(r)
+                if isinstance(l,str) or isinstance(r,str):
+                    s = str(l) + str(r)
+                    if len(s) > string_check: check_string(s)
+                    return s
                 return l + r
             if op == '-': return l - r
             if op == '*': return l * r
@@ -562,31 +1553,3499 @@ class Interpreter:
             if op == '>': return l > r
             if op == '==': return l == r
             if op == '!=': return l != r
+            if op == 'in': return flux_in(l, r)
         elif typ == 'UMINUS':
             return -self.eval(node[1])
         elif typ == 'SLICE':
             _, name, start_node, end_node = node
             s = self.get_var(name)
-            if not isinstance(s,str): raise Exception("Slice on non-string")
+            if not isinstance(s,(str,FluxArray)): raise Exception("Slice on non-string")
             start = self.eval(start_node) if start_node is not None else 0
             end = self.eval(end_node) if end_node is not None else None
             return s[start:end]
+        elif typ == 'INDEX':
+            return flux_index(self.get_var(node[1]), self.eval(node[2]))
+        elif typ == 'ARRAY':
+            return make_array([self.eval(e) for e in node[1]])
+        elif typ == 'MAP':
+            return make_map([self.eval(e) for e in node[1]])
         else:
             raise Exception(f"Unknown AST node: {typ}")
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python FLUX.py program.fx")
+class ProfilingInterpreter(Interpreter):
+    # Tree walker that reports every statement and function call to
+    # self.profiler. A subclass, so plain runs pay nothing for it.
+    def eval(self, node):
+        if node[0] == 'PROGRAM':
+            return Interpreter.eval(self, node)
+        return Interpreter.exec(self, node)    # expressions are not lines
+
+    def exec(self, node):
+        profiler = self.profiler
+        profiler.enter_line(node[-1])
+        try:
+            return Interpreter.exec(self, node)
+        finally:
+            profiler.leave_line(node[-1])
+
+    def run_function(self, func, arg_vals, line=None):
+        self.profiler.enter_call(func.name)
+        try:
+            return Interpreter.run_function(self, func, arg_vals, line)
+        finally:
+            self.profiler.leave_call()
+
+
+class TierCompiler:
+    # Turns a hot function or loop of the tree walker's AST into Python
+    # source and compile()s it. Arithmetic, comparisons, assignments and
+    # calls become plain Python; what FLUX does differently stays in the
+    # same helpers the other backends use: flux_add for +, flux_div for /,
+    # the DECL_CONVERT functions for declarations, flux_append for +=.
+    # A function is resolved and typed first, so its locals become Python
+    # locals, `return` a Python return, and + and / on known number or
+    # string types plain operators. A loop runs on the scope it was hot in:
+    # inside a function, the names already in that env are copied into
+    # Python locals and written back when the loop ends (no other code can
+    # see a function's env while it runs); globals stay in the dict.
+    def __init__(self, interp):
+        self.interp = interp
+        self.globals = interp.global_vars
+        self.lines = []
+        self.depth = 0
+        self.consts = []
+        self.ntemps = 0
+        self.resolved = False   # refs are Resolver bindings, not names
+        self.fast = {}          # loop variable name -> Python local index
+        self.dynamic = set()    # loop variables looked up in the env each time
+        self.appended = set()   # Python locals += may turn into a StringBuilder
+        self.counted = []
+
+    def function(self, func):
+        node = ('FUNCDEF', func.name, func.params, func.body, None)
+        node = Resolver(self.globals).stmt(node)
+        # Typed like the closure backend; every global it may see counts as
+        # 'any', since the rest of the program is not scanned
+        names = binding_names(node[3], set(self.globals))
+        program = TypeSpecializer(names).specialize_program(('PROGRAM', [node]))
+        if string_checked(self.interp.meter):
+            program = checked_sums(program)
+        _, _, _, body, nlocals, _ = program[1][0]
+        self.resolved = True
+        self.appended = appended_slots(body, set())
+        nparams = len(func.pnames)
+        self.emit(f"def fn({', '.join(f'l{i}' for i in range(nparams))}):")
+        self.depth += 1
+        if nlocals > nparams:
+            # Checked locals test for UNSET; the rest are assigned first anyway
+            self.emit(' = '.join(f"l{i}" for i in range(nparams, nlocals)) + " = UNSET")
+        self.block(body)
+        return self.build(f"function {func.name}")
+
+    def loop(self, node, env):
+        # Returns (fn, guard): fn(E) for WHILE, fn(E, start, end) running the
+        # rest of the range for FOR, fn(E, items) running the rest of the
+        # items for FOREACH. guard(env) tells whether fn still fits a
+        # function's env; None at top level.
+        if string_checked(self.interp.meter):
+            node = checked_sums(node)
+        used, declared = set(), set()
+        loop_names(node, used, declared)
+        guard = None
+        if env is not self.globals:
+            self.fast = {name: i for i, name in enumerate(sorted(used & env.keys()))}
+            self.dynamic = declared - env.keys()
+            self.appended = {i for name, i in self.fast.items()
+                             if name in self.interp.appended_names}
+            local, outside = frozenset(self.fast), frozenset(used - self.fast.keys() - declared)
+            guard = lambda env: local <= env.keys() and env.keys().isdisjoint(outside)
+        if node[0] == 'WHILE':
+            self.emit("def fn(E):")
+        elif node[0] == 'FOREACH':
+            self.emit("def fn(E, items):")
+        else:
+            self.emit("def fn(E, start, end):")
+        self.depth += 1
+        if self.fast:
+            self.emit('; '.join(f"l{i} = E[{n!r}]" for n, i in sorted(self.fast.items())))
+            self.emit("try:")
+            self.depth += 1
+        if node[0] == 'WHILE':
+            self.stmt(node)
+        elif node[0] == 'FOREACH':
+            self.each(self.target(node[1]), 'items', node[3], node[-1])
+        else:
+            self.for_(self.target(node[1]), 'start', 'end', node[4], node[-1])
+        if self.fast:
+            written = set()
+            written_names(node[2] if node[0] == 'WHILE' else node[-2], written)
+            if node[0] != 'WHILE':
+                written.add(node[1])
+            self.depth -= 1
+            self.emit("finally:")
+            self.depth += 1
+            stores = [f"E[{n!r}] = l{i}" for n, i in sorted(self.fast.items()) if n in written]
+            self.emit('; '.join(stores) or 'pass')
+        return self.build(f"{node[0].lower()} loop at line {node[-1]}"), guard
+
+    def build(self, label):
+        src = '\n'.join(self.lines) + '\n'
+        if self.interp.tier_dump is not None:
+            self.interp.tier_dump.write(f"# tier: {label}\n{src}\n")
+        ns = self.namespace()
+        exec(builtins.compile(src, f"<tier {label}>", 'exec'), ns)
+        return ns['fn']
+
+    def namespace(self):
+        interp = self.interp
+        g = self.globals
+        def load_global(name, raw=False):
+            try:
+                v = g[name]
+            except KeyError:
+                raise undefined(name) from None
+            return str(v) if type(v) is StringBuilder and not raw else v
+        def store_global(name, val):
+            if name not in g: raise undefined(name)
+            g[name] = val
+        def load_env(name, raw=False):
+            env = interp.envs[-1]
+            if name not in env:
+                env = g
+                if name not in env: raise undefined(name)
+            v = env[name]
+            return str(v) if type(v) is StringBuilder and not raw else v
+        ns = {
+            'interp': interp, 'M': interp.meter, 'G': g, 'UNSET': UNSET, 'RETURN': RETURN,
+            'call': interp.call_function, 'write': interp.out.write, 'read': interp.out.input,
+            'load_global': load_global, 'store_global': store_global,
+            'load_env': load_env, 'store_env': interp.set_var,
+            'flux_text': flux_text, 'print_text': print_text, 'flux_add': flux_add,
+            'flux_div': flux_div, 'int_div': int_div, 'flux_append': flux_append,
+            'flux_index': flux_index, 'flux_slice': flux_slice, 'flux_setitem': flux_setitem,
+            'make_array': make_array, 'make_map': make_map, 'flux_in': flux_in,
+            'flux_items': flux_items,
+        }
+        for fn in DECL_CONVERT.values():
+            ns[fn.__name__] = fn
+        if string_checked(interp.meter):
+            ns['checked_add'] = checked_add
+            ns['checked_concat'] = checked_concat
+        for i, value in enumerate(self.consts):
+            ns[f"k{i}"] = value
+        return ns
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def temp(self):
+        self.ntemps += 1
+        return f"t{self.ntemps - 1}"
+
+    def block(self, stmts):
+        for s in stmts:
+            self.stmt(s)
+
+    def body(self, stmts):
+        self.depth += 1
+        self.block(stmts)
+        if not stmts:
+            self.emit("pass")
+        self.depth -= 1
+
+    # Metered loops count their iterations in Python locals and spend them
+    # on the meter in bulk. `counted` holds, for every loop around the code
+    # being compiled, the steps it has not spent yet (for a for loop, all of
+    # its current piece), which a return spends.
+    def while_(self, cond, body, line):
+        if self.interp.meter is None:
+            self.emit(f"while {self.expr(cond)}:")
+            self.body(body)
+            return
+        # A loop that does not run costs no more than its condition
+        n, given = self.temp(), self.temp()
+        cond = self.expr(cond)
+        self.emit(f"if {cond}:")
+        self.depth += 1
+        self.emit(f"{n} = {given} = M.left")
+        self.emit("while True:")
+        self.counted.append(f"{given} - {n} + 1")
+        self.depth += 1
+        self.block(body)
+        self.emit(f"{n} -= 1")
+        self.emit(f"if not {n}: M.spend({given}, {line}); {n} = {given} = M.left")
+        self.emit(f"if not {cond}: break")
+        self.depth -= 1
+        self.counted.pop()
+        self.spend(f"{given} - {n}", line)
+        self.depth -= 1
+
+    def for_(self, target, start, end, body, line):
+        # start and end are names
+        if self.interp.meter is None:
+            self.emit(f"for {target} in range({start}, {end}):")
+            self.body(body)
+            return
+        # The range runs in pieces that fit what the meter has left
+        a, b = self.temp(), self.temp()
+        self.emit(f"{a} = {start}")
+        self.emit(f"while {a} < {end}:")
+        self.depth += 1
+        self.emit(f"{b} = min({end}, {a} + M.left)")
+        self.emit(f"for {target} in range({a}, {b}):")
+        self.counted.append(f"{b} - {a}")
+        self.body(body)
+        self.counted.pop()
+        self.spend(f"{b} - {a}", line)
+        self.emit(f"{a} = {b}")
+        self.depth -= 1
+
+    def each(self, target, items, body, line):
+        # items is a name
+        if self.interp.meter is None:
+            self.emit(f"for {target} in {items}:")
+            self.body(body)
+            return
+        n, given = self.temp(), self.temp()
+        self.emit(f"{n} = {given} = M.left")
+        self.emit(f"for {target} in {items}:")
+        self.counted.append(f"{given} - {n} + 1")
+        self.depth += 1
+        self.block(body)
+        self.emit(f"{n} -= 1")
+        self.emit(f"if not {n}: M.spend({given}, {line}); {n} = {given} = M.left")
+        self.depth -= 1
+        self.counted.pop()
+        self.spend(f"{given} - {n}", line)
+
+    def spend(self, steps, line):
+        # M.spend(), inlined: it runs every time a loop ends
+        self.emit(f"M.left -= {steps}")
+        self.emit(f"if M.left <= 0: M.check({line})")
+
+    # Variables: a ref is a Resolver binding in a function, a name in a
+    # loop. kind() sorts it into a Python local ('local', index), a lookup
+    # in the running function's env ('env', name) or a global ('global',
+    # name). Globals that exist at compile time exist for good, so those
+    # skip the "not defined" checks.
+    def kind(self, ref):
+        if self.resolved:
+            return ('local', ref[1]) if ref[0] == LOCAL else ('global', ref[2])
+        if ref in self.fast:
+            return ('local', self.fast[ref])
+        return ('env', ref) if ref in self.dynamic else ('global', ref)
+
+    def load(self, ref, raw=False):
+        where, x = self.kind(ref)
+        if where == 'local':
+            local = f"l{x}" if raw or x not in self.appended else f"flux_text(l{x})"
+            if self.resolved and ref[3]:
+                # Checked local: the global until its declaration has run
+                return f"({local} if l{x} is not UNSET else {self.load_global(ref[2], raw)})"
+            return local
+        if where == 'env':
+            return f"load_env({x!r}, True)" if raw else f"load_env({x!r})"
+        return self.load_global(x, raw)
+
+    def load_global(self, name, raw):
+        if name not in self.globals:
+            return f"load_global({name!r}, True)" if raw else f"load_global({name!r})"
+        if raw or name not in self.interp.appended_names:
+            return f"G[{name!r}]"
+        return f"flux_text(G[{name!r}])"
+
+    def target(self, ref):
+        # Where a declaration (or FOR) puts its value
+        where, x = self.kind(ref)
+        if where == 'local':
+            return f"l{x}"
+        return f"E[{x!r}]" if where == 'env' else f"G[{x!r}]"
+
+    def store(self, ref, value):
+        # ASSIGN: the variable must already exist
+        where, x = self.kind(ref)
+        if where == 'local':
+            self.emit(f"l{x} = {value}")
+        elif where == 'env':
+            self.emit(f"store_env({x!r}, {value})")
+        elif x in self.globals:
+            self.emit(f"G[{x!r}] = {value}")
+        else:
+            self.emit(f"store_global({x!r}, {value})")
+
+    def stmt(self, node):
+        typ = node[0]
+        if typ == 'VAR_DECL':
+            _, vartype, ref, expr, _ = node
+            convert = DECL_CONVERT.get(vartype)
+            if convert is not None and expr[0] in CONST_TAGS:
+                try:
+                    expr = const_node(convert(expr[1]))
+                    convert = None
+                except Exception:
+                    pass    # left for the runtime to report
+            value = self.expr(expr)
+            if convert is not None:
+                value = f"{convert.__name__}({value})"
+            self.emit(f"{self.target(ref)} = {value}")
+        elif typ == 'ASSIGN':
+            _, ref, op, expr, _ = node
+            if self.resolved and ref[0] == LOCAL and ref[3]:
+                self.emit(f"if l{ref[1]} is UNSET:")
+                self.body([('ASSIGN', (GLOBAL, ref[2], ref[2], False), op, expr, None)])
+                self.emit("else:")
+                self.body([('ASSIGN', ref[:3] + (False,), op, expr, None)])
+            else:
+                self.assign(ref, op, expr)
+        elif typ == 'SETITEM':
+            _, ref, index, op, expr, _ = node
+            self.emit(f"flux_setitem({self.load(ref)}, {self.expr(index)}, {op!r}, {self.expr(expr)})")
+        elif typ == 'PRINT':
+            parts = []
+            for p in node[1]:
+                if p[0] in CONST_TAGS:
+                    parts.append(repr(str(p[1])))
+                else:
+                    parts.append(f"print_text({self.expr(p)})")
+            self.emit(f"write({' + '.join(parts) or repr('')})")
+        elif typ == 'IF':
+            _, branches, else_branch, _ = node
+            for i, (cond, body) in enumerate(branches):
+                self.emit(f"{'elif' if i else 'if'} {self.expr(cond)}:")
+                self.body(body)
+            if else_branch:
+                self.emit("else:")
+                self.body(else_branch)
+        elif typ == 'WHILE':
+            _, cond, body, line = node
+            self.while_(cond, body, line)
+        elif typ == 'FOR':
+            _, ref, start, end, body, line = node
+            s, e = self.temp(), self.temp()
+            self.emit(f"{s} = {self.expr(start)}; {e} = {self.expr(end)}")
+            self.emit(f"if not (isinstance({s},int) and isinstance({e},int)):")
+            self.emit("    raise Exception('Loop bounds must be integers')")
+            self.for_(self.target(ref), s, e, body, line)
+        elif typ == 'FOREACH':
+            _, ref, expr, body, line = node
+            items = self.temp()
+            self.emit(f"{items} = flux_items({self.expr(expr)})")
+            self.each(self.target(ref), items, body, line)
+        elif typ == 'RETURN':
+            if self.counted:
+                self.emit(f"M.spend({' + '.join(self.counted)}, {node[-1]})")
+            if self.resolved:
+                self.emit(f"return {self.expr(node[1])}")
+            else:
+                self.emit(f"interp.return_value = {self.expr(node[1])}")
+                self.emit("return RETURN")
+        else:
+            self.emit(self.expr(node))
+
+    def assign(self, ref, op, expr):
+        if op == '=':
+            self.store(ref, self.expr(expr))
+            return
+        if self.kind(ref)[0] == 'local':
+            # Nothing the right side runs can change a Python local, so it
+            # need not be evaluated first
+            value = self.expr(expr)
+        else:
+            value = self.temp()
+            self.emit(f"{value} = {self.expr(expr)}")
+        if op == '+=':
+            self.store(ref, f"flux_append({self.load(ref, raw=True)}, {value})")
+        else:
+            sym = '+' if op == 'add=' else op[0]
+            self.store(ref, f"{self.load(ref)} {sym} ({value})")
+
+    def expr(self, node):
+        typ = node[0]
+        if typ in CONST_TAGS:
+            value = node[1]
+            if type(value) is float and not (value == value and abs(value) != float('inf')):
+                self.consts.append(value)
+                return f"k{len(self.consts) - 1}"
+            return repr(value)
+        if typ == 'VAR':
+            return self.load(node[1])
+        if typ == 'BINOP':
+            _, op, left, right = node
+            l = self.expr(left); r = self.expr(right)
+            if op == '+': return f"flux_add({l}, {r})"
+            if op == '/': return f"flux_div({l}, {r})"
+            if op == 'idiv': return f"int_div({l}, {r})"
+            if op in ('checked_add', 'checked_concat'): return f"{op}({l}, {r})"
+            if op in ('add', 'concat'): op = '+'
+            elif op == 'fdiv': op = '/'
+            if op not in ('-', '*', '+', '/'): return 'None'
+            return f"({l} {op} {r})"
+        if typ == 'CMP':
+            _, op, left, right = node
+            if op not in COMPARE_OPS: return 'None'
+            if op == 'in': return f"flux_in({self.expr(left)}, {self.expr(right)})"
+            return f"({self.expr(left)} {op} {self.expr(right)})"
+        if typ == 'UMINUS':
+            return f"(-{self.expr(node[1])})"
+        if typ in ('CALL', 'INTRINSIC'):
+            fn = None
+            if typ == 'INTRINSIC' or node[1] in self.interp.intrinsic_names:
+                fn = intrinsic_for(node[1], len(node[2]))
+            if fn is not None:
+                self.consts.append(fn)
+                return f"k{len(self.consts) - 1}({', '.join(self.expr(a) for a in node[2])})"
+            args = f"[{', '.join(self.expr(a) for a in node[2])}]"
+            if self.interp.meter is not None:
+                return f"call({node[1]!r}, {args}, {node[3]})"
+            return f"call({node[1]!r}, {args})"
+        if typ == 'INPUT':
+            return f"read(str({self.expr(node[1])}))"
+        if typ == 'SLICE':
+            _, ref, start, end = node
+            start = self.expr(start) if start is not None else '0'
+            end = self.expr(end) if end is not None else 'None'
+            return f"flux_slice({self.load(ref)}, {start}, {end})"
+        if typ == 'INDEX':
+            return f"flux_index({self.load(node[1])}, {self.expr(node[2])})"
+        if typ == 'ARRAY':
+            return f"make_array([{', '.join(self.expr(e) for e in node[1])}])"
+        if typ == 'MAP':
+            return f"make_map([{', '.join(self.expr(e) for e in node[1])}])"
+        raise Exception(f"Unknown AST node: {typ}")
+
+
+def flux_add(l, r):
+    # String concatenation if either side is string
+    if isinstance(l,str) or isinstance(r,str): return str(l) + str(r)
+    return l + r
+
+# Strings longer than this are checked against the string limit of the
+# run making them. It is the smallest limit any run has had, so metered
+# runs without one (or with a large one) hardly ever look. Code compiled
+# for a Meter with a string limit has its sums marked by checked_sums; a
+# StringBuilder checks when it joins.
+string_check = sys.maxsize
+
+def check_string(s):
+    check_length(len(s))
+
+def check_length(n):
+    # check_string for a string of n characters, before it is made
+    limit = metered.max_string
+    if limit and n > limit:
+        raise LimitExceeded('string', f"String length limit of {limit} exceeded")
+
+def checked_add(l, r):
+    if isinstance(l,str) or isinstance(r,str):
+        s = str(l) + str(r)
+        if len(s) > string_check: check_string(s)
+        return s
+    return l + r
+
+def checked_concat(l, r):
+    s = l + r
+    if len(s) > string_check: check_string(s)
+    return s
+
+def flux_append(old, val):
+    # += on a variable's raw slot value; string results accumulate in a
+    # StringBuilder instead of copying the whole string every time
+    if type(old) is StringBuilder:
+        old.parts.append(val if isinstance(val,str) else str(val))
+        return old
+    if isinstance(old,str) or isinstance(val,str):
+        if type(old) is Reduction: return old + val
+        return StringBuilder(str(old), str(val))
+    return old + val
+
+def flux_div(l, r):
+    res = l / r
+    if isinstance(l,int) and isinstance(r,int) and res.is_integer():
+        return int(res)
+    return res
+
+def int_div(l, r):
+    # flux_div for two ints (or bools)
+    res = l / r
+    return int(res) if res.is_integer() else res
+
+def flux_text(val):
+    # A slot value as FLUX code sees it
+    return str(val) if type(val) is StringBuilder else val
+
+def print_text(val):
+    return str(val) if val is not None else ''
+
+def decl_int(val):
+    if isinstance(val,float): return int(val)
+    if not isinstance(val,int): raise Exception("Type mismatch int")
+    return val
+
+def decl_float(val):
+    if isinstance(val,int): return float(val)
+    if not isinstance(val,float): raise Exception("Type mismatch float")
+    return val
+
+def decl_string(val):
+    return val if isinstance(val,str) else str(val)
+
+def decl_bool(val):
+    if isinstance(val,(int,float)): return bool(val)
+    if not isinstance(val,bool): raise Exception("Type mismatch bool")
+    return val
+
+def decl_int_array(val):
+    if type(val) is not FluxArray: raise Exception("Type mismatch int[]")
+    return val if val.data.format == 'q' else FluxArray.of('q', map(int, val.data))
+
+def decl_float_array(val):
+    if type(val) is not FluxArray: raise Exception("Type mismatch float[]")
+    return val if val.data.format == 'd' else FluxArray.of('d', map(float, val.data))
+
+def decl_map(val):
+    if type(val) is not FluxMap: raise Exception("Type mismatch map")
+    return val
+
+def map_key(key):
+    t = type(key)
+    if t is str: return sys.intern(key)
+    if t is int or t is float or t is bool: return key
+    raise Exception("Map keys must be numbers, strings or bools")
+
+def map_text(val):
+    return f'"{val}"' if isinstance(val, str) else str(val)
+
+def make_map(items):
+    # {k: v, ...} literal, from the flat list k1, v1, k2, v2, ...
+    m = FluxMap()
+    for i in range(0, len(items), 2):
+        m[map_key(items[i])] = items[i + 1]
+    return m
+
+def make_array(values):
+    # [a, b, ...] literal: float[] if any element is a float, else int[]
+    for v in values:
+        if not isinstance(v, (int, float)):
+            raise Exception("Array elements must be numbers")
+    floats = any(isinstance(v, float) for v in values)
+    return FluxArray.of('d' if floats else 'q', values)
+
+def flux_index(val, i):
+    if type(val) is FluxMap:
+        try:
+            return val[i]
+        except KeyError:
+            raise Exception(f"Key {map_text(i)} not in map") from None
+        except TypeError:
+            raise Exception("Map keys must be numbers, strings or bools") from None
+    if type(val) is FluxArray:
+        try:
+            return val.data[i]
+        except IndexError:
+            raise Exception("Array index out of range") from None
+    # On a string, s[i] has always meant s[i:]
+    if isinstance(val, str): return val[i:]
+    raise Exception("Slice on non-string")
+
+def flux_slice(val, start, end):
+    if not isinstance(val,(str,FluxArray)): raise Exception("Slice on non-string")
+    return val[start:end]
+
+def flux_setitem(arr, i, op, val):
+    if type(arr) is FluxMap:
+        key = map_key(i)
+        if op != '=':
+            val = BINARY_OPS[op[0]](flux_index(arr, key), val)
+        arr[key] = val
         return
-    with open(sys.argv[1]) as f:
-        lines = f.read()
-    lex = Lexer(lines)
-    tokens = lex.tokenize()
-    parser = Parser(tokens)
-    ast = parser.parse_program()
-    interp = Interpreter()
-    interp.eval(ast)
+    if type(arr) is not FluxArray: raise Exception("Item assignment on non-array")
+    try:
+        if op != '=':
+            val = BINARY_OPS[op[0]](arr.data[i], val)
+        arr[i] = val
+    except IndexError:
+        raise Exception("Array index out of range") from None
+
+def flux_in(key, val):
+    if type(val) is FluxMap:
+        try:
+            return key in val
+        except TypeError:
+            raise Exception("Map keys must be numbers, strings or bools") from None
+    if isinstance(val, str):
+        if not isinstance(key, str): raise Exception("in on a string needs a string")
+        return key in val
+    if type(val) is FluxArray: return key in val.data
+    raise Exception("in needs a map, a string or an array")
+
+def flux_items(val):
+    # What for x in val runs over: the keys a map has when the loop starts,
+    # the characters of a string or the elements of an array
+    if type(val) is FluxMap: return list(val)
+    if isinstance(val, str): return val
+    if type(val) is FluxArray: return val.data.tolist()
+    raise Exception("for ... in needs a map, a string or an array")
+
+def intrinsic_len(val):
+    if type(val) in (FluxArray, FluxMap) or isinstance(val, str): return len(val)
+    raise Exception("len() needs a string, an array or a map")
+
+def reduction(fn):
+    def reduce_(arr):
+        if type(arr) is not FluxArray: raise Exception(f"{fn.__name__}() needs an array")
+        if fn is not sum and not len(arr.data):
+            raise Exception(f"{fn.__name__}() of an empty array")
+        return fn(arr.data)
+    return reduce_
+
+def extremum(fn):
+    # min/max of an array, or of the numbers given
+    reduce_ = reduction(fn)
+    def extremum_(*args):
+        if len(args) == 1: return reduce_(args[0])
+        if not args or not all(type(a) in (int, float, bool) for a in args):
+            raise Exception(f"{fn.__name__}() needs an array or numbers")
+        return fn(args)
+    return extremum_
+
+def intrinsic_zeros(n):
+    if not isinstance(n, int) or n < 0: raise Exception("zeros() needs a count >= 0")
+    return FluxArray(memoryview(array.array('q', bytes(8 * n))))
+
+def intrinsic_find(s, sub):
+    # Index of the first sub in s, -1 if there is none
+    if not (isinstance(s, str) and isinstance(sub, str)): raise Exception("find() needs two strings")
+    return s.find(sub)
+
+def intrinsic_to_int(val):
+    # Strings parse as integers; numbers are cut toward zero
+    try:
+        if isinstance(val, str) or type(val) in (int, float, bool): return int(val)
+    except (ValueError, OverflowError):
+        raise Exception(f"to_int() cannot convert {map_text(val)}") from None
+    raise Exception("to_int() needs a number or a string")
+
+def intrinsic_to_float(val):
+    try:
+        if isinstance(val, str) or type(val) in (int, float, bool): return float(val)
+    except (ValueError, OverflowError):
+        raise Exception(f"to_float() cannot convert {map_text(val)}") from None
+    raise Exception("to_float() needs a number or a string")
+
+def intrinsic_sqrt(x):
+    if type(x) not in (int, float, bool): raise Exception("sqrt() needs a number")
+    if x < 0: raise Exception("sqrt() of a negative number")
+    return math.sqrt(x)
+
+def intrinsic_abs(x):
+    if type(x) not in (int, float, bool): raise Exception("abs() needs a number")
+    return abs(x)
+
+def intrinsic_repeat(s, n):
+    if not isinstance(s, str) or type(n) is not int or n < 0:
+        raise Exception("repeat() needs a string and a count >= 0")
+    if len(s) * n > string_check: check_length(len(s) * n)
+    return s * n
+
+def intrinsic_join(val, sep=''):
+    # The items for x in val runs over, as text, with sep between them
+    if not isinstance(sep, str): raise Exception("join() needs a string separator")
+    s = sep.join(map(str, flux_items(val)))
+    if len(s) > string_check: check_string(s)
+    return s
+
+# Functions written in Python that every program can call unless it
+# defines its own of that name: name -> (fn, the argument counts it takes
+# or None for any). register_intrinsic adds more.
+INTRINSICS = {
+    'len': (intrinsic_len, (1,)), 'sum': (reduction(sum), (1,)),
+    'min': (extremum(min), None), 'max': (extremum(max), None),
+    'zeros': (intrinsic_zeros, (1,)), 'find': (intrinsic_find, (2,)),
+    'to_int': (intrinsic_to_int, (1,)), 'to_float': (intrinsic_to_float, (1,)),
+    'sqrt': (intrinsic_sqrt, (1,)), 'abs': (intrinsic_abs, (1,)),
+    'repeat': (intrinsic_repeat, (2,)), 'join': (intrinsic_join, (1, 2)),
+}
+# Intrinsics whose result depends only on their arguments
+PURE_INTRINSICS = set(INTRINSICS) - {'zeros'}
+
+def register_intrinsic(name, fn, nargs=None, pure=False):
+    # Embedding API: lets programs call fn as name(...), straight from the
+    # compiled code, without the frame a FLUX function gets. fn takes and
+    # returns FLUX values: int, float, bool, str, FluxArray or FluxMap (it
+    # must not change the arrays and maps it is given), and raises
+    # Exception to stop the program with an error. nargs is the number of
+    # arguments, a tuple of the numbers allowed, or None for any. pure
+    # promises the result depends only on the arguments, so calls may be
+    # memoized. A program's own function of the same name wins. Programs
+    # compiled before see it once compiled again; compile()'s cache is
+    # cleared for that.
+    if not isinstance(name, str) or not name.isidentifier() or name in KEYWORDS:
+        raise Exception(f"Invalid intrinsic name {name!r}")
+    if isinstance(nargs, int):
+        nargs = (nargs,)
+    INTRINSICS[name] = (fn, None if nargs is None else tuple(nargs))
+    if pure:
+        PURE_INTRINSICS.add(name)
+    else:
+        PURE_INTRINSICS.discard(name)
+    with program_cache_lock:
+        program_cache.clear()
+
+def call_intrinsic(name, args):
+    entry = INTRINSICS.get(name)
+    if entry is None:
+        raise Exception(f"Function '{name}' not defined")
+    fn, nargs = entry
+    if nargs is not None and len(args) not in nargs:
+        raise Exception(f"Argument count mismatch in call to {name}")
+    return fn(*args)
+
+def intrinsic_for(name, argc):
+    # The function an INTRINSIC call node with argc arguments goes straight
+    # to; None if it takes another count, or is gone, so that the call
+    # fails (as a CALL) when it runs
+    fn, nargs = INTRINSICS.get(name, (None, None))
+    return fn if nargs is None or argc in nargs else None
+
+BINARY_OPS = {'+': flux_add, '-': operator.sub, '*': operator.mul, '/': flux_div}
+COMPARE_OPS = {'<': operator.lt, '>': operator.gt, '==': operator.eq, '!=': operator.ne,
+               'in': flux_in}
+AUG_OPS = {'+=': flux_append, '-=': operator.sub, '*=': operator.mul, '/=': operator.truediv}
+DECL_CONVERT = {'int': decl_int, 'float': decl_float, 'string': decl_string, 'bool': decl_bool,
+                'int[]': decl_int_array, 'float[]': decl_float_array, 'map': decl_map}
+DECL_TYPES = {fn: t for t, fn in DECL_CONVERT.items()}
+OP_SYMBOLS = {fn: sym for table in (BINARY_OPS, COMPARE_OPS) for sym, fn in table.items()}
+OP_SYMBOLS.update({operator.truediv: '/', flux_append: '+'})
+# Operators TypeSpecializer substitutes once both operand types are known
+TYPED_OPS = {'add': operator.add, 'concat': operator.add, 'idiv': int_div, 'fdiv': operator.truediv}
+BINARY_OPS.update(TYPED_OPS)
+AUG_OPS['add='] = operator.add
+OP_SYMBOLS.update({operator.add: 'add', int_div: 'idiv'})
+# Operators checked_sums substitutes in code compiled for a Meter with a
+# string limit
+CHECKED_OPS = {'+': 'checked_add', 'concat': 'checked_concat'}
+BINARY_OPS.update({'checked_add': checked_add, 'checked_concat': checked_concat})
+OP_SYMBOLS.update({checked_add: '+', checked_concat: 'concat'})
+
+
+def string_checked(meter):
+    # Code is compiled with checked_sums only for a meter with a string limit
+    return meter is not None and bool(meter.max_string)
+
+def checked_sums(node, operand=False):
+    # Metered code: the outermost + of every sum checks the string limit.
+    # The + inside it need not, no part of a string is longer than it.
+    if type(node) is list:
+        return [checked_sums(n) for n in node]
+    if type(node) is not tuple:
+        return node
+    if node[0] == 'BINOP' and node[1] in CHECKED_OPS:
+        _, op, left, right = node
+        return ('BINOP', op if operand else CHECKED_OPS[op],
+                checked_sums(left, True), checked_sums(right, True))
+    return tuple(checked_sums(n) for n in node)
+
+
+CONST_TAGS = ('NUMBER', 'STRING', 'BOOL')
+
+# Folded strings longer than this stay as runtime expressions
+MAX_FOLDED_STRING = 4096
+
+
+def const_node(value):
+    if isinstance(value, bool): return ('BOOL', value)
+    if isinstance(value, str): return ('STRING', value)
+    return ('NUMBER', value)
+
+
+def expr_key(node):
+    # Structural key that tells 1 and 1.0 (and True) apart
+    if node is None or node[0] in CONST_TAGS:
+        return node if node is None else (node[0], type(node[1]), node[1])
+    return tuple(expr_key(c) if isinstance(c, tuple) else
+                 tuple(map(expr_key, c)) if isinstance(c, list) else c
+                 for c in node)
+
+
+def has_effects(node):
+    # True if running the node may call a function, read input or create a
+    # (mutable) array or map
+    if isinstance(node, list):
+        return any(map(has_effects, node))
+    if not isinstance(node, tuple):
+        return False
+    if node[0] in ('CALL', 'INTRINSIC', 'INPUT', 'ARRAY', 'MAP'):
+        return True
+    return any(map(has_effects, node))
+
+
+def expr_names(node, names):
+    if node is None:
+        return names
+    typ = node[0]
+    if typ in ('VAR', 'SLICE', 'INDEX'):
+        names.add(node[1])
+    for c in node[1:]:
+        if isinstance(c, tuple): expr_names(c, names)
+        elif isinstance(c, list):
+            for a in c: expr_names(a, names)
+    return names
+
+
+def written_names(stmts, names):
+    # Names a block may write, and whether it contains any call
+    calls = False
+    for s in stmts:
+        typ = s[0]
+        if typ == 'VAR_DECL': names.add(s[2])
+        elif typ == 'ASSIGN': names.add(s[1])
+        elif typ == 'SETITEM':
+            # Array contents can change under any name that aliases it
+            names.add(s[1])
+            calls = True
+        elif typ in ('FOR', 'PFOR', 'FOREACH'):
+            names.add(s[1])
+            calls |= written_names(s[-2], names)
+        elif typ == 'WHILE':
+            calls |= written_names(s[2], names)
+        elif typ == 'IF':
+            for _, body in s[1]:
+                calls |= written_names(body, names)
+            calls |= written_names(s[2], names)
+        calls |= has_effects(s)
+    return calls
+
+
+def contains(node, tag):
+    if isinstance(node, list):
+        return any(contains(n, tag) for n in node)
+    if not isinstance(node, tuple):
+        return False
+    return node[0] == tag or any(contains(c, tag) for c in node[1:])
+
+
+class Optimizer:
+    # AST-to-AST passes run between parsing and execution.
+    #   level 1: constant folding and removal of constant-condition branches
+    #   level 2: also hoists loop-invariant expressions out of WHILE/FOR
+    # Folding uses the runtime's own operator helpers, so int-preserving /
+    # and string + coercion fold exactly as they would evaluate. Anything
+    # that would raise is left for the runtime to report.
+    # Hoisted values live in `$h<n>` temporaries (not valid FLUX names).
+    # Invariants from a loop body are computed only when the loop runs at
+    # least once. They come only from the statements each iteration runs
+    # before its first output, call or nested block, so output is unchanged
+    # up to any error they raise. With non-integer FOR bounds the program
+    # fails either way; at -O2 the error may come from the hoisted guard.
+    def __init__(self, level=1):
+        self.level = level
+        self.ntemps = 0
+        self.in_function = False
+        # Names no call can change: parameters and locals declared so far
+        self.safe = set()
+
+    def optimize(self, node):
+        if self.level <= 0:
+            return node
+        # Whether any array element is ever written; if so, a loop with a
+        # call or element write may change what any array read returns.
+        # Only hoisting (-O2) asks.
+        self.mutates = self.level >= 2 and contains(node[1], 'SETITEM')
+        return ('PROGRAM', self.block(node[1]))
+
+    def optimize_statement(self, node):
+        # The next top-level statement of a program run as it is parsed, as
+        # a list: it may go, or come with hoisted temporaries. Any statement
+        # still to come may write array elements.
+        if self.level <= 0:
+            return [node]
+        self.mutates = True
+        return self.block([node])
+
+    def block(self, stmts):
+        out = []
+        for s in stmts:
+            s = self.stmt(s)
+            if isinstance(s, list): out.extend(s)
+            elif s is not None: out.append(s)
+        return out
+
+    def stmt(self, node):
+        typ = node[0]
+        if typ == 'FUNCDEF':
+            _, name, params, body, line = node
+            saved = self.safe, self.in_function
+            self.safe, self.in_function = {p for _, p in params}, True
+            body = self.block(body)
+            self.safe, self.in_function = saved
+            return ('FUNCDEF', name, params, body, line)
+        if typ == 'VAR_DECL':
+            if self.in_function: self.safe.add(node[2])
+            return ('VAR_DECL', node[1], node[2], self.expr(node[3]), node[4])
+        if typ == 'ASSIGN':
+            return ('ASSIGN', node[1], node[2], self.expr(node[3]), node[4])
+        if typ == 'SETITEM':
+            return ('SETITEM', node[1], self.expr(node[2]), node[3], self.expr(node[4]), node[5])
+        if typ == 'PRINT':
+            return ('PRINT', [self.expr(p) for p in node[1]], node[2])
+        if typ == 'RETURN':
+            return ('RETURN', self.expr(node[1]), node[2])
+        saved = self.safe
+        self.safe = set(saved)
+        try:
+            if typ == 'IF': return self.if_(node)
+            if typ == 'WHILE': return self.while_(node)
+            if typ in ('FOR', 'PFOR'): return self.for_(node)
+            if typ == 'FOREACH':
+                return ('FOREACH', node[1], self.expr(node[2]), self.block(node[3]), node[4])
+        finally:
+            # Declarations inside nested blocks may not run
+            self.safe = saved
+        return self.expr(node)
+
+    def if_(self, node):
+        _, branches, else_branch, line = node
+        kept = []
+        for cond, body in branches:
+            cond = self.expr(cond)
+            if cond[0] in CONST_TAGS:
+                if not cond[1]:
+                    continue
+                if not kept:
+                    return self.block(body)
+                else_branch = self.block(body)
+                break
+            kept.append((cond, self.block(body)))
+        else:
+            else_branch = self.block(else_branch)
+        if not kept:
+            return else_branch
+        return ('IF', kept, else_branch, line)
+
+    def while_(self, node):
+        _, cond, body, line = node
+        cond = self.expr(cond)
+        if cond[0] in CONST_TAGS and not cond[1]:
+            return None
+        loop = ('WHILE', cond, self.block(body), line)
+        return self.hoist(loop) if self.level >= 2 else loop
+
+    def for_(self, node):
+        _, var, start, end, body, line = node
+        start = self.expr(start); end = self.expr(end)
+        if (start[0] == 'NUMBER' and end[0] == 'NUMBER' and type(start[1]) is int
+                and type(end[1]) is int and start[1] >= end[1]):
+            return None
+        loop = (node[0], var, start, end, self.block(body), line)
+        # Hoisting out of a parallel for would make its body's reads shared
+        return self.hoist(loop) if self.level >= 2 and node[0] == 'FOR' else loop
+
+    def expr(self, node):
+        if node is None:
+            return None
+        typ = node[0]
+        if typ in ('BINOP', 'CMP'):
+            _, op, left, right = node
+            left = self.expr(left); right = self.expr(right)
+            if left[0] in CONST_TAGS and right[0] in CONST_TAGS:
+                fn = BINARY_OPS[op] if typ == 'BINOP' else COMPARE_OPS[op]
+                folded = self.fold(fn, left[1], right[1])
+                if folded is not None:
+                    return folded
+            return (typ, op, left, right)
+        if typ == 'UMINUS':
+            operand = self.expr(node[1])
+            if operand[0] in CONST_TAGS:
+                folded = self.fold(operator.neg, operand[1])
+                if folded is not None:
+                    return folded
+            return ('UMINUS', operand)
+        if typ == 'INPUT':
+            return ('INPUT', self.expr(node[1]))
+        if typ == 'CALL':
+            return ('CALL', node[1], [self.expr(a) for a in node[2]], node[3])
+        if typ == 'SLICE':
+            return ('SLICE', node[1], self.expr(node[2]), self.expr(node[3]))
+        if typ == 'INDEX':
+            return ('INDEX', node[1], self.expr(node[2]))
+        if typ in ('ARRAY', 'MAP'):
+            return (typ, [self.expr(e) for e in node[1]])
+        return node
+
+    def fold(self, fn, *args):
+        try:
+            value = fn(*args)
+        except Exception:
+            return None
+        if value is None or (isinstance(value, str) and len(value) > MAX_FOLDED_STRING):
+            return None
+        return const_node(value)
+
+    def hoist(self, loop):
+        # Loop-invariant code motion for one loop (inner loops are done)
+        if loop[0] == 'WHILE':
+            cond, body = loop[1], loop[2]
+            if has_effects(cond):
+                return loop
+            written = set()
+        else:
+            cond, body = None, loop[4]
+            written = {loop[1]}
+        calls = written_names(body, written)
+        if calls and self.mutates:
+            return loop
+
+        def invariant(node):
+            if has_effects(node):
+                return False
+            names = expr_names(node, set())
+            if names & written:
+                return False
+            return not calls or names <= self.safe
+
+        found = {}
+        def collect(node, guarded):
+            if node is None or node[0] in CONST_TAGS or node[0] == 'VAR':
+                return
+            if invariant(node):
+                found.setdefault(expr_key(node), (node, guarded))
+                return
+            for c in node[2:] if node[0] in ('BINOP', 'CMP', 'SLICE', 'INDEX') else node[1:]:
+                if isinstance(c, tuple): collect(c, guarded)
+
+        if cond is not None:
+            collect(cond, False)
+        for s in body:
+            if s[0] not in ('VAR_DECL', 'ASSIGN') or has_effects(s):
+                break
+            collect(s[3], True)
+        if not found:
+            return loop
+
+        line = loop[-1]
+        temps = {}
+        pre, guarded = [], []
+        for key, (node, needs_guard) in found.items():
+            temps[key] = ('VAR', self.temp())
+            (guarded if needs_guard else pre).append(('VAR_DECL', None, temps[key][1], node, line))
+
+        def rexpr(node):
+            if node is None or node[0] in CONST_TAGS or node[0] == 'VAR':
+                return node
+            key = expr_key(node)
+            if key in temps:
+                return temps[key]
+            typ = node[0]
+            if typ in ('BINOP', 'CMP'):
+                return (typ, node[1], rexpr(node[2]), rexpr(node[3]))
+            if typ == 'SLICE':
+                return ('SLICE', node[1], rexpr(node[2]), rexpr(node[3]))
+            if typ == 'INDEX':
+                return ('INDEX', node[1], rexpr(node[2]))
+            if typ in ('ARRAY', 'MAP'):
+                return (typ, [rexpr(e) for e in node[1]])
+            if typ == 'CALL':
+                return ('CALL', node[1], [rexpr(a) for a in node[2]], node[3])
+            return (typ, rexpr(node[1]))
+
+        def rstmt(s):
+            typ = s[0]
+            if typ in ('VAR_DECL', 'ASSIGN'):
+                return (typ, s[1], s[2], rexpr(s[3]), s[4])
+            if typ == 'SETITEM':
+                return ('SETITEM', s[1], rexpr(s[2]), s[3], rexpr(s[4]), s[5])
+            if typ in ('PRINT', 'RETURN'):
+                return (typ, [rexpr(p) for p in s[1]] if typ == 'PRINT' else rexpr(s[1]), s[2])
+            if typ == 'IF':
+                return ('IF', [(rexpr(c), list(map(rstmt, b))) for c, b in s[1]],
+                        list(map(rstmt, s[2])), s[3])
+            if typ == 'WHILE':
+                return ('WHILE', rexpr(s[1]), list(map(rstmt, s[2])), s[3])
+            if typ in ('FOR', 'PFOR'):
+                return (typ, s[1], rexpr(s[2]), rexpr(s[3]), list(map(rstmt, s[4])), s[5])
+            if typ == 'FOREACH':
+                return (typ, s[1], rexpr(s[2]), list(map(rstmt, s[3])), s[4])
+            return rexpr(s)
+
+        if loop[0] == 'WHILE':
+            loop = ('WHILE', rexpr(cond), list(map(rstmt, body)), line)
+            if not guarded:
+                return pre + [loop]
+            return pre + [('IF', [(loop[1], guarded)], [], line), loop]
+        _, var, start, end, body, _ = loop
+        body = list(map(rstmt, body))
+        s_name, e_name = self.temp(), self.temp()
+        return pre + [
+            ('VAR_DECL', None, s_name, start, line),
+            ('VAR_DECL', None, e_name, end, line),
+            ('IF', [(('CMP', '<', ('VAR', s_name), ('VAR', e_name)), guarded)], [], line),
+            ('FOR', var, ('VAR', s_name), ('VAR', e_name), body, line),
+        ]
+
+    def temp(self):
+        self.ntemps += 1
+        return f"$h{self.ntemps - 1}"
+
+
+# Marks a local slot whose declaration has not run yet
+UNSET = object()
+
+GLOBAL, LOCAL = 0, 1
+
+
+def undefined(name):
+    return Exception(f"Variable '{name}' not defined")
+
+
+class Resolver:
+    # Binds every variable reference to a (depth, slot) pair before anything
+    # runs. Depth GLOBAL keeps the value in Interpreter.global_vars (the slot
+    # is the name itself); depth LOCAL indexes the function's frame list.
+    # A binding is (depth, slot, name, checked): checked locals may be read
+    # before their declaration ran and then fall back to the global.
+    def __init__(self, global_names=()):
+        self.global_names = set(global_names)
+        self.errors = []
+        self.locals = None
+        self.definite = set()
+        self.where = 'top level'
+        self.parallel_calls = []   # (name, line, where) called in a parallel for
+        self.later = False         # functions may use globals declared later
+        self.safe = None           # resolve_statement: Purity of the functions so far
+        self.line = None           # of the statement being resolved, for errors
+        self.intrinsics = ()       # names whose calls become INTRINSIC nodes
+
+    def resolve_program(self, node):
+        # With the whole program known, calls of intrinsics it defines no
+        # function for go to the intrinsic directly
+        self.intrinsics = INTRINSICS.keys() - {s[1] for s in function_defs(node[1], [])}
+        self.collect(node[1], self.global_names)
+        stmts = [self.stmt(s) for s in node[1]]
+        self.check(stmts)
+        return ('PROGRAM', stmts)
+
+    def resolve_statement(self, node):
+        # The next top-level statement of a program run as it is parsed.
+        # Function bodies may use globals no statement so far declares
+        # (reading one still missing fails when it runs), and parallel for
+        # calls are checked against the functions defined so far, again
+        # whenever one is (re)defined. A statement that fails leaves the
+        # state as it was, so another may follow.
+        self.later = True
+        if self.safe is None:
+            self.safe = Purity(writes_state, set(INTRINSICS))
+        self.collect([node], self.global_names)
+        ncalls = len(self.parallel_calls)
+        stmt = self.stmt(node)
+        defs = function_defs([stmt], [])
+        safe = self.safe
+        if defs and self.parallel_calls:
+            safe = safe.copy()
+        for d in defs:
+            safe.define(d)
+        try:
+            if defs or len(self.parallel_calls) > ncalls or self.errors:
+                self.check_calls(safe.defined, safe.pure)
+        except Exception:
+            del self.parallel_calls[ncalls:]
+            raise
+        self.safe = safe
+        return stmt
+
+    def check(self, stmts):
+        # Raises the errors found, with the parallel for calls of functions
+        # in stmts that are not safe to run in parallel
+        defined = safe = ()
+        if self.parallel_calls:
+            defined = {s[1] for s in function_defs(stmts, [])}
+            safe = pure_functions(('PROGRAM', stmts), writes_state, set(INTRINSICS))
+        self.check_calls(defined, safe)
+
+    def check_calls(self, defined, safe):
+        # Raises the errors found, with the parallel for calls of functions
+        # in `defined` but not in `safe`
+        if self.parallel_calls:
+            for name, line, where in self.parallel_calls:
+                if name in defined and name not in safe:
+                    self.errors.append(f"parallel for at line {line}: '{name}' may write "
+                                       f"globals or arrays or read input (in {where})")
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise Exception('\n'.join(errors))
+
+    def collect(self, stmts, names):
+        # Every name a block can declare, including nested blocks
+        for s in stmts:
+            typ = s[0]
+            if typ == 'VAR_DECL':
+                names.add(s[2])
+            elif typ in ('FOR', 'PFOR', 'FOREACH'):
+                names.add(s[1]); self.collect(s[-2], names)
+            elif typ == 'WHILE':
+                self.collect(s[2], names)
+            elif typ == 'IF':
+                for _, body in s[1]:
+                    self.collect(body, names)
+                self.collect(s[2], names)
+
+    def bind(self, name):
+        if self.locals is not None and name in self.locals:
+            return (LOCAL, self.locals[name], name, name not in self.definite)
+        if name not in self.global_names and not (self.later and self.locals is not None):
+            self.errors.append(f"Variable '{name}' not defined at line {self.line} "
+                               f"(in {self.where})")
+        return (GLOBAL, name, name, False)
+
+    def block(self, stmts):
+        saved = self.definite
+        self.definite = set(saved)
+        out = [self.stmt(s) for s in stmts]
+        assigned = self.definite
+        self.definite = saved
+        return out, assigned
+
+    def stmt(self, node):
+        typ = node[0]
+        self.line = node[-1]
+        if typ == 'FUNCDEF':
+            _, name, params, body, line = node
+            names = set()
+            self.collect(body, names)
+            slots = {}
+            for _, pname in params:
+                slots.setdefault(pname, len(slots))
+            for n in sorted(names - set(slots)):
+                slots[n] = len(slots)
+            saved = self.locals, self.definite, self.where
+            self.locals, self.definite, self.where = slots, {p for _, p in params}, f"function {name}"
+            body = [self.stmt(s) for s in body]
+            self.locals, self.definite, self.where = saved
+            return ('FUNCDEF', name, params, body, len(slots), line)
+        if typ == 'VAR_DECL':
+            _, vartype, name, expr, line = node
+            expr = self.expr(expr)
+            b = self.bind(name)
+            if b[0] == LOCAL:
+                b = b[:3] + (False,)
+                self.definite.add(name)
+            return ('VAR_DECL', vartype, b, expr, line)
+        if typ == 'ASSIGN':
+            _, name, op, expr, line = node
+            return ('ASSIGN', self.bind(name), op, self.expr(expr), line)
+        if typ == 'SETITEM':
+            _, name, index, op, expr, line = node
+            return ('SETITEM', self.bind(name), self.expr(index), op, self.expr(expr), line)
+        if typ == 'PRINT':
+            return ('PRINT', [self.expr(p) for p in node[1]], node[2])
+        if typ == 'IF':
+            _, branches, else_branch, line = node
+            out = []
+            assigned = None
+            for cond, body in branches:
+                cond = self.expr(cond)
+                body, a = self.block(body)
+                out.append((cond, body))
+                assigned = a if assigned is None else assigned & a
+            else_branch, a = self.block(else_branch)
+            self.definite |= assigned & a
+            return ('IF', out, else_branch, line)
+        if typ == 'WHILE':
+            _, cond, body, line = node
+            cond = self.expr(cond)
+            return ('WHILE', cond, self.block(body)[0], line)
+        if typ in ('FOR', 'PFOR'):
+            _, var, start, end, body, line = node
+            start = self.expr(start); end = self.expr(end)
+            b = self.bind(var)
+            if b[0] == LOCAL:
+                b = b[:3] + (False,)
+            saved = self.definite
+            self.definite = saved | {var}
+            body = self.block(body)[0]
+            self.definite = saved
+            node = (typ, b, start, end, body, line)
+            if typ == 'PFOR':
+                _, _, calls, errors = check_parallel_for(node)
+                self.errors += [f"{e} (in {self.where})" for e in errors]
+                self.parallel_calls += [(name, line, self.where) for name in sorted(calls)]
+            return node
+        if typ == 'FOREACH':
+            _, var, expr, body, line = node
+            expr = self.expr(expr)
+            b = self.bind(var)
+            if b[0] == LOCAL:
+                b = b[:3] + (False,)
+            saved = self.definite
+            self.definite = saved | {var}
+            body = self.block(body)[0]
+            self.definite = saved
+            return ('FOREACH', b, expr, body, line)
+        if typ == 'RETURN':
+            return ('RETURN', self.expr(node[1]), node[2])
+        return self.expr(node)
+
+    def expr(self, node):
+        typ = node[0]
+        if typ == 'VAR':
+            return ('VAR', self.bind(node[1]))
+        if typ in ('BINOP', 'CMP'):
+            return (typ, node[1], self.expr(node[2]), self.expr(node[3]))
+        if typ in ('UMINUS', 'INPUT'):
+            return (typ, self.expr(node[1]))
+        if typ == 'CALL':
+            tag = 'INTRINSIC' if node[1] in self.intrinsics else 'CALL'
+            return (tag, node[1], [self.expr(a) for a in node[2]], node[3])
+        if typ == 'SLICE':
+            _, name, start, end = node
+            return ('SLICE', self.bind(name),
+                    self.expr(start) if start is not None else None,
+                    self.expr(end) if end is not None else None)
+        if typ == 'INDEX':
+            return ('INDEX', self.bind(node[1]), self.expr(node[2]))
+        if typ in ('ARRAY', 'MAP'):
+            return (typ, [self.expr(e) for e in node[1]])
+        return node
+
+
+def appended_slots(stmts, slots):
+    # Local slots a resolved function body grows with +=
+    for s in stmts:
+        typ = s[0]
+        if typ == 'ASSIGN' and s[2] == '+=' and s[1][0] == LOCAL:
+            slots.add(s[1][1])
+        elif typ == 'IF':
+            for _, body in s[1]:
+                appended_slots(body, slots)
+            appended_slots(s[2], slots)
+        elif typ == 'WHILE':
+            appended_slots(s[2], slots)
+        elif typ in ('FOR', 'PFOR', 'FOREACH'):
+            appended_slots(s[-2], slots)
+    return slots
+
+
+def augmented_names(stmts, names):
+    # Variable names an unresolved program (functions included) uses += on
+    for s in stmts:
+        typ = s[0]
+        if typ == 'ASSIGN' and s[2] == '+=':
+            names.add(s[1])
+        elif typ == 'FUNCDEF':
+            augmented_names(s[3], names)
+        elif typ == 'IF':
+            for _, body in s[1]:
+                augmented_names(body, names)
+            augmented_names(s[2], names)
+        elif typ == 'WHILE':
+            augmented_names(s[2], names)
+        elif typ in ('FOR', 'PFOR', 'FOREACH'):
+            augmented_names(s[-2], names)
+    return names
+
+
+def loop_names(node, used, declared):
+    # Variable names an unresolved node refers to, and those it declares
+    if isinstance(node, list):
+        for n in node:
+            loop_names(n, used, declared)
+    elif isinstance(node, tuple) and node:
+        typ = node[0]
+        if typ in ('VAR', 'SLICE', 'INDEX', 'ASSIGN', 'SETITEM'):
+            used.add(node[1])
+        elif typ in ('FOR', 'FOREACH'):
+            used.add(node[1]); declared.add(node[1])
+        elif typ == 'VAR_DECL':
+            used.add(node[2]); declared.add(node[2])
+        for c in node:
+            loop_names(c, used, declared)
+    return used
+
+
+def binding_names(node, names):
+    # Names of the globals a resolved node may read or write, including the
+    # ones checked locals fall back to
+    if isinstance(node, list):
+        for n in node:
+            binding_names(n, names)
+    elif isinstance(node, tuple) and node:
+        if type(node[0]) is int:
+            if node[0] == GLOBAL or node[3]: names.add(node[2])
+        else:
+            for c in node:
+                binding_names(c, names)
+    return names
+
+
+def impure(node, calls):
+    # True if a resolved node prints, reads input, touches a global, creates
+    # or writes an array or map, or defines a function. Names it calls are added to
+    # `calls`.
+    if isinstance(node, list):
+        return any([impure(n, calls) for n in node])
+    if not isinstance(node, tuple):
+        return False
+    typ = node[0]
+    if typ == GLOBAL or typ == LOCAL:
+        # A binding; checked locals may fall back to the global
+        return typ == GLOBAL or node[3]
+    if typ in ('PRINT', 'INPUT', 'FUNCDEF', 'ARRAY', 'MAP', 'SETITEM'):
+        return True
+    if typ in ('CALL', 'INTRINSIC'):
+        calls.add(node[1])
+    # All of node: an IF branch is a bare (cond, body) pair
+    return any([impure(c, calls) for c in node])
+
+
+def pure_functions(program, effects=impure, intrinsics=PURE_INTRINSICS):
+    # Names of functions whose result depends only on their arguments, so
+    # calls can be memoized: they only call other pure functions, and are
+    # defined exactly once (a later definition would change what runs).
+    # With another `effects` predicate it finds the functions free of those
+    # effects instead.
+    defs = function_defs(program[1], [])
+    purity = Purity(effects, intrinsics, {s[1] for s in defs})
+    for s in defs:
+        purity.define(s)
+    # Functions called but never defined are not pure
+    for name in list(purity.callers):
+        if name not in purity.defined and name not in intrinsics:
+            purity.demote(name)
+    return purity.pure
+
+
+def function_defs(stmts, defs):
+    # Appends the FUNCDEF statements of stmts, nested ones too, to defs
+    for s in stmts:
+        typ = s[0]
+        if typ == 'FUNCDEF':
+            defs.append(s)
+        elif typ == 'IF':
+            for _, body in s[1]:
+                function_defs(body, defs)
+            function_defs(s[2], defs)
+        elif typ == 'WHILE':
+            function_defs(s[2], defs)
+        elif typ in ('FOR', 'PFOR', 'FOREACH'):
+            function_defs(s[-2], defs)
+    return defs
+
+
+class Purity:
+    # pure_functions for a program that comes a function definition at a
+    # time. A function is pure when defined if its body is free of the
+    # effects and every function it calls is pure so far; one not defined
+    # yet counts as pure until it is, unless it names an intrinsic that is
+    # not (and is not one of the names `coming` to be defined). So when a
+    # definition turns out impure, or redefines a function, that function
+    # and every pure one that calls it, directly or not, stop being pure.
+    def __init__(self, effects=impure, intrinsics=PURE_INTRINSICS, coming=()):
+        self.effects = effects
+        self.intrinsics = intrinsics
+        self.coming = coming
+        self.pure = set()
+        self.defined = set()
+        self.callers = {}     # name -> names of the functions calling it
+
+    def define(self, node, again=False):
+        # Adds a resolved FUNCDEF; returns the names that stopped being pure.
+        # With `again` a function defined before may be pure this time: the
+        # caller forgets what its earlier definition computed.
+        name = node[1]
+        called = set()
+        demoted = set()
+        if again and name in self.defined:
+            demoted = self.demote(name)
+            self.defined.discard(name)
+        if (name not in self.defined and not self.effects(node[3], called)
+                and all([self.allowed(c) for c in called if c != name])):
+            self.defined.add(name)
+            self.pure.add(name)
+            for c in called:
+                self.callers.setdefault(c, set()).add(name)
+            return demoted
+        self.defined.add(name)
+        return demoted | self.demote(name)
+
+    def allowed(self, name):
+        if name in self.defined:
+            return name in self.pure
+        return name in self.intrinsics or name not in INTRINSICS or name in self.coming
+
+    def copy(self):
+        other = Purity(self.effects, self.intrinsics, self.coming)
+        other.pure = set(self.pure)
+        other.defined = set(self.defined)
+        other.callers = {name: set(c) for name, c in self.callers.items()}
+        return other
+
+    def demote(self, name):
+        # name is not pure, nor is anything calling it; returns what was
+        demoted = {name} & self.pure
+        self.pure.discard(name)
+        stack = [name]
+        while stack:
+            for c in self.callers.get(stack.pop(), ()):
+                if c in self.pure:
+                    self.pure.discard(c)
+                    demoted.add(c)
+                    stack.append(c)
+        return demoted
+
+
+def writes_state(node, calls):
+    # True if a resolved node reads input, defines a function, writes an
+    # array element, runs a parallel for or assigns a variable that may be a
+    # global: what functions called from a parallel for must not do. Names
+    # it calls are added to `calls`.
+    if isinstance(node, list):
+        return any([writes_state(n, calls) for n in node])
+    if not isinstance(node, tuple) or not node:
+        return False
+    typ = node[0]
+    if typ in ('INPUT', 'FUNCDEF', 'SETITEM', 'PFOR'):
+        return True
+    if typ in ('VAR_DECL', 'ASSIGN', 'FOR', 'FOREACH'):
+        b = node[2] if typ == 'VAR_DECL' else node[1]
+        if b[0] == GLOBAL or b[3]:
+            return True
+    if typ in ('CALL', 'INTRINSIC'):
+        calls.add(node[1])
+    return any([writes_state(c, calls) for c in node if isinstance(c, (tuple, list))])
+
+
+def check_parallel_for(node):
+    # Checks that the iterations of a parallel for (resolved or not) are
+    # independent. Variables outside the loop may only be grown with +=
+    # ("reductions") and never read in the body; every other name the body
+    # writes has to be declared by the same iteration before it is used.
+    # Elements may only be set on arrays (and maps) declared in the body. Returns
+    # (reductions, declared names, called names, errors); the calls are
+    # checked by the Resolver once all functions are known.
+    _, var, _, _, body, line = node
+    name_of = lambda ref: ref if isinstance(ref, str) else ref[2]
+    declared = {name_of(var)}
+    def collect(stmts):
+        for s in stmts:
+            typ = s[0]
+            if typ == 'VAR_DECL':
+                declared.add(name_of(s[2]))
+            elif typ in ('FOR', 'PFOR', 'FOREACH'):
+                declared.add(name_of(s[1])); collect(s[-2])
+            elif typ == 'WHILE':
+                collect(s[2])
+            elif typ == 'IF':
+                for _, b in s[1]:
+                    collect(b)
+                collect(s[2])
+    collect(body)
+    reductions, reads, calls, errors = set(), set(), set(), []
+    where = f"parallel for at line {line}"
+
+    def read(name, defined):
+        reads.add(name)
+        if name in declared and name not in defined:
+            errors.append(f"{where}: '{name}' may be used before this iteration declares it")
+
+    def expr(e, defined):
+        typ = e[0]
+        rest = e[1:]
+        if typ in ('VAR', 'SLICE', 'INDEX'):
+            read(name_of(e[1]), defined)
+            rest = e[2:]
+        elif typ == 'INPUT':
+            errors.append(f"{where}: input is not allowed")
+        elif typ in ('CALL', 'INTRINSIC'):
+            calls.add(e[1])
+            rest = e[2]
+        for c in rest:
+            if isinstance(c, tuple): expr(c, defined)
+            elif isinstance(c, list):
+                for a in c: expr(a, defined)
+
+    def block(stmts, defined):
+        # Returns the names definitely declared after the block
+        for s in stmts:
+            typ = s[0]
+            if typ == 'VAR_DECL':
+                expr(s[3], defined)
+                defined.add(name_of(s[2]))
+            elif typ == 'ASSIGN':
+                _, ref, op, value, _ = s
+                name = name_of(ref)
+                expr(value, defined)
+                if name in declared:
+                    if op != '=' or name not in defined:
+                        read(name, defined)
+                elif op in ('+=', 'add='):
+                    reductions.add(name)
+                else:
+                    errors.append(f"{where}: outer variable '{name}' can only be grown with +=")
+            elif typ == 'SETITEM':
+                name = name_of(s[1])
+                expr(s[2], defined); expr(s[4], defined)
+                if name in declared:
+                    read(name, defined)
+                else:
+                    errors.append(f"{where}: cannot set elements of outer array '{name}'")
+            elif typ == 'PRINT':
+                for p in s[1]: expr(p, defined)
+            elif typ == 'IF':
+                after = None
+                for cond, b in s[1]:
+                    expr(cond, defined)
+                    a = block(b, set(defined))
+                    after = a if after is None else after & a
+                defined |= after & block(s[2], set(defined))
+            elif typ == 'WHILE':
+                expr(s[1], defined)
+                block(s[2], set(defined))
+            elif typ in ('FOR', 'PFOR'):
+                if typ == 'PFOR':
+                    errors.append(f"{where}: parallel for cannot be nested")
+                expr(s[2], defined); expr(s[3], defined)
+                block(s[4], defined | {name_of(s[1])})
+            elif typ == 'FOREACH':
+                expr(s[2], defined)
+                block(s[3], defined | {name_of(s[1])})
+            elif typ == 'RETURN':
+                errors.append(f"{where}: return is not allowed")
+            else:
+                expr(s, defined)
+        return defined
+
+    block(body, {name_of(var)})
+    for name in sorted(reductions & reads):
+        errors.append(f"{where}: accumulator '{name}' is read in the loop")
+    return reductions, declared, calls, errors
+
+
+def node_bindings(node, bindings):
+    # name -> binding for every variable a resolved node refers to
+    if isinstance(node, list):
+        for n in node:
+            node_bindings(n, bindings)
+    elif isinstance(node, tuple) and node:
+        if type(node[0]) is int:
+            bindings[node[2]] = node
+        else:
+            for c in node:
+                node_bindings(c, bindings)
+    return bindings
+
+
+NUMERIC = ('int', 'float', 'num')
+DECL_RESULT = {'int': 'int', 'float': 'float', 'string': 'string', 'bool': 'int',
+               'int[]': 'any', 'float[]': 'any', 'map': 'any'}
+
+
+def join_types(a, b):
+    # None is "no value seen yet", 'any' is "could be anything"
+    if a is None or a == b: return b
+    if b is None: return a
+    if a in NUMERIC and b in NUMERIC: return 'num'
+    return 'any'
+
+
+def arith_type(op, l, r):
+    # Result type of l <op> r; 'int' covers bool, 'num' is int or float
+    if l is None or r is None:
+        return None
+    if op in ('+', '+=') and 'string' in (l, r):
+        return 'string'
+    if l not in NUMERIC or r not in NUMERIC:
+        return 'string' if op in ('*', '*=') and 'string' in (l, r) else 'any'
+    if op == '/=':
+        return 'float'
+    if op == '/':
+        return 'float' if 'float' in (l, r) else 'num'
+    if l == r == 'int':
+        return 'int'
+    return 'float' if 'float' in (l, r) else 'num'
+
+
+class TypeSpecializer:
+    # Infers the types variables can hold from the declarations, literals and
+    # every write to them, then swaps generic + and / for typed versions where
+    # both operand types are known: add (numbers), concat (strings), idiv and
+    # fdiv. A declared type only counts through its conversion: plain =
+    # stores anything, and parameters are not converted, so they stay 'any'.
+    # Types are flow-insensitive: a variable has the join of all its writes.
+    def __init__(self, global_names=()):
+        # Globals that already hold a value from an earlier program
+        self.preset = set(global_names)
+
+    def specialize_program(self, node):
+        stmts = node[1]
+        self.types = {(None, name): 'any' for name in self.preset}
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            self.scan(stmts, None)
+        return ('PROGRAM', self.block(stmts, None))
+
+    def key(self, binding, scope):
+        depth, slot, name, checked = binding
+        return (None, name) if depth == GLOBAL else (scope, slot)
+
+    def var_type(self, binding, scope):
+        t = self.types.get(self.key(binding, scope))
+        if binding[0] == LOCAL and binding[3]:
+            t = join_types(t, self.types.get((None, binding[2])))
+        return t
+
+    def write(self, binding, scope, t):
+        keys = [self.key(binding, scope)]
+        if binding[0] == LOCAL and binding[3]:
+            keys.append((None, binding[2]))   # a checked store may land in the global
+        for k in keys:
+            new = join_types(self.types.get(k), t)
+            if new != self.types.get(k):
+                self.types[k] = new
+                self.changed = True
+
+    def scan(self, stmts, scope):
+        for s in stmts:
+            typ = s[0]
+            if typ == 'FUNCDEF':
+                _, name, params, body, nlocals, _ = s
+                fscope = id(body)
+                for slot in range(len(params)):
+                    self.write((LOCAL, slot, None, False), fscope, 'any')
+                self.scan(body, fscope)
+            elif typ == 'VAR_DECL':
+                _, vartype, binding, expr, _ = s
+                t = DECL_RESULT[vartype] if vartype else self.type_of(expr, scope)
+                self.write(binding, scope, t)
+            elif typ == 'ASSIGN':
+                _, binding, op, expr, _ = s
+                t = self.type_of(expr, scope)
+                if op != '=':
+                    t = arith_type(op, self.var_type(binding, scope), t)
+                self.write(binding, scope, t)
+            elif typ == 'IF':
+                for _, body in s[1]:
+                    self.scan(body, scope)
+                self.scan(s[2], scope)
+            elif typ == 'WHILE':
+                self.scan(s[2], scope)
+            elif typ in ('FOR', 'PFOR'):
+                self.write(s[1], scope, 'int')
+                self.scan(s[4], scope)
+            elif typ == 'FOREACH':
+                # A string's characters are strings; keys and elements vary
+                t = self.type_of(s[2], scope)
+                self.write(s[1], scope, t if t is None or t == 'string' else 'any')
+                self.scan(s[3], scope)
+
+    def type_of(self, node, scope):
+        typ = node[0]
+        if typ == 'NUMBER':
+            return 'float' if isinstance(node[1], float) else 'int'
+        if typ in ('BOOL', 'CMP'):
+            return 'int'
+        if typ in ('STRING', 'INPUT'):
+            return 'string'
+        if typ in ('SLICE', 'INDEX'):
+            # Strings slice to strings, arrays to arrays or elements
+            t = self.var_type(node[1], scope)
+            return t if t is None or t == 'string' else 'any'
+        if typ == 'VAR':
+            return self.var_type(node[1], scope)
+        if typ == 'BINOP':
+            return arith_type(node[1], self.type_of(node[2], scope), self.type_of(node[3], scope))
+        if typ == 'UMINUS':
+            t = self.type_of(node[1], scope)
+            return t if t is None or t in NUMERIC else 'any'
+        return 'any'
+
+    def block(self, stmts, scope):
+        return [self.stmt(s, scope) for s in stmts]
+
+    def stmt(self, node, scope):
+        typ = node[0]
+        if typ == 'FUNCDEF':
+            _, name, params, body, nlocals, line = node
+            return ('FUNCDEF', name, params, self.block(body, id(body)), nlocals, line)
+        if typ == 'VAR_DECL':
+            return node[:3] + (self.expr(node[3], scope), node[4])
+        if typ == 'ASSIGN':
+            _, binding, op, expr, line = node
+            if op == '+=' and self.var_type(binding, scope) in NUMERIC \
+                    and self.type_of(expr, scope) in NUMERIC:
+                op = 'add='
+            return ('ASSIGN', binding, op, self.expr(expr, scope), line)
+        if typ == 'SETITEM':
+            _, binding, index, op, expr, line = node
+            return ('SETITEM', binding, self.expr(index, scope), op, self.expr(expr, scope), line)
+        if typ == 'PRINT':
+            return ('PRINT', [self.expr(p, scope) for p in node[1]], node[2])
+        if typ == 'IF':
+            return ('IF', [(self.expr(c, scope), self.block(b, scope)) for c, b in node[1]],
+                    self.block(node[2], scope), node[3])
+        if typ == 'WHILE':
+            return ('WHILE', self.expr(node[1], scope), self.block(node[2], scope), node[3])
+        if typ in ('FOR', 'PFOR'):
+            _, binding, start, end, body, line = node
+            return (typ, binding, self.expr(start, scope), self.expr(end, scope),
+                    self.block(body, scope), line)
+        if typ == 'FOREACH':
+            _, binding, expr, body, line = node
+            return ('FOREACH', binding, self.expr(expr, scope), self.block(body, scope), line)
+        if typ == 'RETURN':
+            return ('RETURN', self.expr(node[1], scope), node[2])
+        return self.expr(node, scope)
+
+    def expr(self, node, scope):
+        typ = node[0]
+        if typ in ('BINOP', 'CMP'):
+            _, op, left, right = node
+            if typ == 'BINOP' and op in ('+', '/'):
+                l = self.type_of(left, scope); r = self.type_of(right, scope)
+                if l in NUMERIC and r in NUMERIC:
+                    if op == '+': op = 'add'
+                    elif 'float' in (l, r): op = 'fdiv'
+                    elif l == r == 'int': op = 'idiv'
+                elif op == '+' and l == r == 'string':
+                    op = 'concat'
+            return (typ, op, self.expr(left, scope), self.expr(right, scope))
+        if typ in ('UMINUS', 'INPUT'):
+            return (typ, self.expr(node[1], scope))
+        if typ in ('CALL', 'INTRINSIC'):
+            return (typ, node[1], [self.expr(a, scope) for a in node[2]], node[3])
+        if typ == 'SLICE':
+            _, binding, start, end = node
+            return ('SLICE', binding,
+                    self.expr(start, scope) if start is not None else None,
+                    self.expr(end, scope) if end is not None else None)
+        if typ == 'INDEX':
+            return ('INDEX', node[1], self.expr(node[2], scope))
+        if typ in ('ARRAY', 'MAP'):
+            return (typ, [self.expr(e, scope) for e in node[1]])
+        return node
+
+
+class ClosureCompiler:
+    # Turns a resolved AST into a tree of pre-bound closures. Dispatch on the
+    # node tag happens once here instead of on every evaluation. Every
+    # closure takes the current frame (the list of local slots).
+    def __init__(self, interp):
+        self.interp = interp
+        self.globals = interp.global_vars
+        # Local slots of the current function that += may turn into a
+        # StringBuilder; only their loads pay for the check
+        self.appended = set()
+        self.profiler = interp.profiler
+
+    def compile(self, node):
+        return getattr(self, 'c_' + node[0])(node)
+
+    def stmt(self, node):
+        fn = self.compile(node)
+        if self.profiler is None:
+            return fn
+        return self.profiler.wrap_line(fn, node[-1])
+
+
+    def c_PROGRAM(self, node):
+        fns = [self.stmt(s) for s in node[1]]
+        interp = self.interp
+        def program():
+            for f in fns:
+                if f(None) is RETURN:
+                    raise ReturnException(interp.return_value)
+        return program
+
+    def c_FUNCDEF(self, node):
+        _, name, params, body, nlocals, _ = node
+        functions = self.interp.functions
+        saved = self.appended
+        self.appended = appended_slots(body, set())
+        body = [self.stmt(s) for s in body]
+        if self.profiler is not None:
+            body = self.profiler.wrap_body(name, body)
+        func = self.interp.make_function(name, params, body, nlocals)
+        self.appended = saved
+        def funcdef(fr):
+            functions[name] = func
+        return funcdef
+
+    def load(self, binding, raw=False):
+        # raw loads hand out a StringBuilder as is (for += only)
+        depth, slot, name, checked = binding
+        g = self.globals
+        if depth == LOCAL and not checked:
+            if raw or slot not in self.appended:
+                return lambda fr: fr[slot]
+            def load_fast(fr):
+                v = fr[slot]
+                return str(v) if type(v) is StringBuilder else v
+            return load_fast
+        if depth == LOCAL:
+            def load_checked(fr):
+                v = fr[slot]
+                if v is UNSET:
+                    if name not in g: raise undefined(name)
+                    v = g[name]
+                return str(v) if type(v) is StringBuilder and not raw else v
+            return load_checked
+        def load_global(fr):
+            try:
+                v = g[name]
+            except KeyError:
+                raise undefined(name) from None
+            return str(v) if type(v) is StringBuilder and not raw else v
+        return load_global
+
+    def store(self, binding):
+        # Returns store(fr, value) with ASSIGN semantics (target must exist)
+        depth, slot, name, checked = binding
+        g = self.globals
+        if depth == LOCAL and not checked:
+            def store_fast(fr, val):
+                fr[slot] = val
+            return store_fast
+        if depth == LOCAL:
+            def store_checked(fr, val):
+                if fr[slot] is UNSET and name in g: g[name] = val
+                elif fr[slot] is UNSET: raise undefined(name)
+                else: fr[slot] = val
+            return store_checked
+        def store_global(fr, val):
+            if name not in g: raise undefined(name)
+            g[name] = val
+        return store_global
+
+    def c_VAR_DECL(self, node):
+        _, vartype, (depth, slot, name, _), expr, _ = node
+        ev = self.compile(expr)
+        convert = DECL_CONVERT.get(vartype)
+        g = self.globals
+        if depth == LOCAL:
+            if convert is None:
+                def decl(fr): fr[slot] = ev(fr)
+            else:
+                def decl(fr): fr[slot] = convert(ev(fr))
+        else:
+            if convert is None:
+                def decl(fr): g[name] = ev(fr)
+            else:
+                def decl(fr): g[name] = convert(ev(fr))
+        return decl
+
+    def c_ASSIGN(self, node):
+        _, binding, op, expr, _ = node
+        ev = self.compile(expr)
+        depth, slot, name, checked = binding
+        if op == '=':
+            if depth == LOCAL and not checked:
+                def assign(fr): fr[slot] = ev(fr)
+                return assign
+            store = self.store(binding)
+            def assign(fr): store(fr, ev(fr))
+            return assign
+        if op == '+=':
+            combine = flux_append
+            if depth == LOCAL and not checked:
+                def augassign(fr):
+                    val = ev(fr)
+                    fr[slot] = flux_append(fr[slot], val)
+                return augassign
+            load = self.load(binding, raw=True)
+        else:
+            combine = AUG_OPS[op]
+            if depth == LOCAL and not checked and slot not in self.appended:
+                def augassign(fr):
+                    fr[slot] = combine(fr[slot], ev(fr))
+                return augassign
+            load = self.load(binding)
+        store = self.store(binding)
+        def augassign(fr):
+            val = ev(fr)
+            store(fr, combine(load(fr), val))
+        return augassign
+
+    def c_PRINT(self, node):
+        parts = [self.compile(p) for p in node[1]]
+        write = self.interp.out.write
+        def print_(fr):
+            out_str = ''
+            for part in parts:
+                v = part(fr)
+                out_str += str(v) if v is not None else ''
+            write(out_str)
+        return print_
+
+    def c_IF(self, node):
+        _, branches, else_branch, _ = node
+        compiled = [(self.compile(cond), [self.stmt(s) for s in body]) for cond, body in branches]
+        else_fns = [self.stmt(s) for s in else_branch]
+        if len(compiled) == 1:
+            cond, body = compiled[0]
+            def if_(fr):
+                for f in (body if cond(fr) else else_fns):
+                    if f(fr) is RETURN: return RETURN
+            return if_
+        def if_chain(fr):
+            for cond, body in compiled:
+                if cond(fr):
+                    break
+            else:
+                body = else_fns
+            for f in body:
+                if f(fr) is RETURN: return RETURN
+        return if_chain
+
+    def c_WHILE(self, node):
+        _, cond, body, line = node
+        cond = self.compile(cond)
+        body = [self.stmt(s) for s in body]
+        meter = self.interp.meter
+        if meter is not None:
+            def while_(fr):
+                # Iterations are counted down from what the meter had
+                # left, and spent when that runs out or the loop ends
+                if not cond(fr):
+                    return
+                n = given = meter.left
+                while True:
+                    for f in body:
+                        if f(fr) is RETURN:
+                            meter.spend(given - n + 1, line)
+                            return RETURN
+                    n -= 1
+                    if not n:
+                        meter.spend(given, line)
+                        n = given = meter.left
+                    if not cond(fr):
+                        break
+                meter.spend(given - n, line)
+            return while_
+        def while_(fr):
+            while cond(fr):
+                for f in body:
+                    if f(fr) is RETURN: return RETURN
+        return while_
+
+    def c_FOR(self, node):
+        _, (depth, slot, name, _), start_expr, end_expr, body, _ = node
+        start_fn = self.compile(start_expr)
+        end_fn = self.compile(end_expr)
+        body = [self.stmt(s) for s in body]
+        target = slot if depth == LOCAL else name
+        g = self.globals
+        meter = self.interp.meter
+        if meter is not None:
+            line = node[-1]
+            def for_(fr):
+                start = start_fn(fr); end = end_fn(fr)
+                if not (isinstance(start,int) and isinstance(end,int)):
+                    raise Exception("Loop bounds must be integers")
+                env = fr if depth == LOCAL else g
+                # The range runs in pieces that fit what is left of the
+                # meter's interval, each spent once it is done
+                while start < end:
+                    stop = min(end, start + meter.left)
+                    for i in range(start, stop):
+                        env[target] = i
+                        for f in body:
+                            if f(fr) is RETURN:
+                                meter.spend(i + 1 - start, line)
+                                return RETURN
+                    meter.spend(stop - start, line)
+                    start = stop
+            return for_
+        def for_(fr):
+            start = start_fn(fr); end = end_fn(fr)
+            if not (isinstance(start,int) and isinstance(end,int)):
+                raise Exception("Loop bounds must be integers")
+            env = fr if depth == LOCAL else g
+            for i in range(start, end):
+                env[target] = i
+                for f in body:
+                    if f(fr) is RETURN: return RETURN
+        return for_
+
+    def c_FOREACH(self, node):
+        _, (depth, slot, name, _), expr, body, line = node
+        items_fn = self.compile(expr)
+        body = [self.stmt(s) for s in body]
+        target = slot if depth == LOCAL else name
+        g = self.globals
+        meter = self.interp.meter
+        if meter is not None:
+            def each(fr):
+                env = fr if depth == LOCAL else g
+                # Counted down like a while loop's iterations
+                n = given = meter.left
+                for item in flux_items(items_fn(fr)):
+                    env[target] = item
+                    for f in body:
+                        if f(fr) is RETURN:
+                            meter.spend(given - n + 1, line)
+                            return RETURN
+                    n -= 1
+                    if not n:
+                        meter.spend(given, line)
+                        n = given = meter.left
+                meter.spend(given - n, line)
+            return each
+        def each(fr):
+            env = fr if depth == LOCAL else g
+            for item in flux_items(items_fn(fr)):
+                env[target] = item
+                for f in body:
+                    if f(fr) is RETURN: return RETURN
+        return each
+
+    def c_PFOR(self, node):
+        _, (depth, slot, name, _), start_expr, end_expr, body, _ = node
+        reductions, declared, _, _ = check_parallel_for(node)
+        bindings = node_bindings(node, {})
+        start_fn = self.compile(start_expr)
+        end_fn = self.compile(end_expr)
+        body = [self.stmt(s) for s in body]
+        target = slot if depth == LOCAL else name
+        interp = self.interp
+        g = self.globals
+        meter = interp.meter
+        line = node[-1]
+        def pfor(fr):
+            start = start_fn(fr); end = end_fn(fr)
+            if not (isinstance(start,int) and isinstance(end,int)):
+                raise Exception("Loop bounds must be integers")
+            env = fr if depth == LOCAL else g
+            def run_range(a, b):
+                for i in range(a, b):
+                    env[target] = i
+                    for f in body:
+                        f(fr)
+                    if meter is not None: meter.spend(1, line)
+            parallel_for(interp, start, end, run_range, SlotScope(g, fr, bindings),
+                         reductions, declared)
+        return pfor
+
+    def c_RETURN(self, node):
+        ev = self.compile(node[1])
+        interp = self.interp
+        def return_(fr):
+            interp.return_value = ev(fr)
+            return RETURN
+        return return_
+
+    def c_CALL(self, node):
+        _, name, args, line = node
+        interp = self.interp
+        functions = interp.functions
+        arg_fns = [self.compile(a) for a in args]
+        argc = len(args)
+        if interp.meter is not None:
+            return self.metered_call(name, arg_fns, line)
+        def call(fr):
+            # The argument list becomes the callee's frame
+            frame = [a(fr) for a in arg_fns]
+            func = functions.get(name)
+            if func is None:
+                return call_intrinsic(name, frame)
+            if argc != func.arity:
+                raise Exception(f"Argument count mismatch in call to {name}")
+            memo = func.memo
+            if memo is not None:
+                key = memo.key(func, frame)
+                ret = memo.get(key)
+                if ret is not MISSING:
+                    return ret
+            if func.nlocals > argc:
+                frame += [UNSET] * (func.nlocals - argc)
+            ret = None
+            for f in func.body:
+                if f(frame) is RETURN:
+                    ret = interp.return_value
+                    break
+            if memo is not None:
+                memo.put(key, ret)
+            return ret
+        return call
+
+    def metered_call(self, name, arg_fns, line):
+        # c_CALL's call, also counting a step and a level of depth
+        interp = self.interp
+        functions = interp.functions
+        argc = len(arg_fns)
+        meter = interp.meter
+        def call(fr):
+            frame = [a(fr) for a in arg_fns]
+            func = functions.get(name)
+            if func is None:
+                return call_intrinsic(name, frame)
+            if argc != func.arity:
+                raise Exception(f"Argument count mismatch in call to {name}")
+            memo = func.memo
+            if memo is not None:
+                key = memo.key(func, frame)
+                ret = memo.get(key)
+                if ret is not MISSING:
+                    return ret
+            if func.nlocals > argc:
+                frame += [UNSET] * (func.nlocals - argc)
+            meter.calls += 1
+            if meter.calls >= meter.check_at: meter.check(line)
+            ret = None
+            for f in func.body:
+                if f(frame) is RETURN:
+                    ret = interp.return_value
+                    break
+            meter.returns += 1
+            if memo is not None:
+                memo.put(key, ret)
+            return ret
+        return call
+
+    def c_INTRINSIC(self, node):
+        _, name, args, _ = node
+        fn = intrinsic_for(name, len(args))
+        if fn is None:
+            return self.c_CALL(node)
+        arg_fns = [self.compile(a) for a in args]
+        if len(arg_fns) == 1:
+            a, = arg_fns
+            return lambda fr: fn(a(fr))
+        if len(arg_fns) == 2:
+            a, b = arg_fns
+            return lambda fr: fn(a(fr), b(fr))
+        return lambda fr: fn(*[a(fr) for a in arg_fns])
+
+    def c_INPUT(self, node):
+        prompt_fn = self.compile(node[1])
+        read = self.interp.out.input
+        def input_(fr):
+            return read(str(prompt_fn(fr)))
+        return input_
+
+    def c_NUMBER(self, node):
+        value = node[1]
+        return lambda fr: value
+    c_STRING = c_BOOL = c_NUMBER
+
+    def c_VAR(self, node):
+        return self.load(node[1])
+
+    def c_BINOP(self, node):
+        _, op, left, right = node
+        lf = self.compile(left); rf = self.compile(right)
+        if op == 'checked_add':
+            def checked_add(fr):
+                l = lf(fr); r = rf(fr)
+                if isinstance(l,str) or isinstance(r,str):
+                    s = str(l) + str(r)
+                    if len(s) > string_check: check_string(s)
+                    return s
+                return l + r
+            return checked_add
+        if op == 'checked_concat':
+            def checked_concat(fr):
+                s = lf(fr) + rf(fr)
+                if len(s) > string_check: check_string(s)
+                return s
+            return checked_concat
+        if op == '+':
+            def add(fr):
+                l = lf(fr); r = rf(fr)
+                if isinstance(l,str) or isinstance(r,str): return str(l) + str(r)
+                return l + r
+            return add
+        if op == '-': return lambda fr: lf(fr) - rf(fr)
+        if op == '*': return lambda fr: lf(fr) * rf(fr)
+        if op == '/': return lambda fr: flux_div(lf(fr), rf(fr))
+        if op == 'add' or op == 'concat': return lambda fr: lf(fr) + rf(fr)
+        if op == 'fdiv': return lambda fr: lf(fr) / rf(fr)
+        if op == 'idiv': return lambda fr: int_div(lf(fr), rf(fr))
+        return lambda fr: None
+
+    def c_CMP(self, node):
+        _, op, left, right = node
+        lf = self.compile(left); rf = self.compile(right)
+        if op == '<': return lambda fr: lf(fr) < rf(fr)
+        if op == '>': return lambda fr: lf(fr) > rf(fr)
+        if op == '==': return lambda fr: lf(fr) == rf(fr)
+        if op == '!=': return lambda fr: lf(fr) != rf(fr)
+        if op == 'in': return lambda fr: flux_in(lf(fr), rf(fr))
+        return lambda fr: None
+
+    def c_UMINUS(self, node):
+        f = self.compile(node[1])
+        return lambda fr: -f(fr)
+
+    def c_SLICE(self, node):
+        _, binding, start_node, end_node = node
+        var = self.load(binding)
+        start_fn = self.compile(start_node) if start_node is not None else (lambda fr: 0)
+        end_fn = self.compile(end_node) if end_node is not None else (lambda fr: None)
+        def slice_(fr):
+            s = var(fr)
+            if not isinstance(s,(str,FluxArray)): raise Exception("Slice on non-string")
+            return s[start_fn(fr):end_fn(fr)]
+        return slice_
+
+    def c_INDEX(self, node):
+        var = self.load(node[1])
+        index_fn = self.compile(node[2])
+        return lambda fr: flux_index(var(fr), index_fn(fr))
+
+    def c_ARRAY(self, node):
+        fns = [self.compile(e) for e in node[1]]
+        return lambda fr: make_array([f(fr) for f in fns])
+
+    def c_MAP(self, node):
+        fns = [self.compile(e) for e in node[1]]
+        return lambda fr: make_map([f(fr) for f in fns])
+
+    def c_SETITEM(self, node):
+        _, binding, index, op, expr, _ = node
+        var = self.load(binding)
+        index_fn = self.compile(index)
+        ev = self.compile(expr)
+        def setitem(fr):
+            arr = var(fr)
+            i = index_fn(fr)
+            flux_setitem(arr, i, op, ev(fr))
+        return setitem
+
+    def __getattr__(self, name):
+        if name.startswith('c_'):
+            raise Exception(f"Unknown AST node: {name[2:]}")
+        raise AttributeError(name)
+
+
+class ClosureInterpreter(Interpreter):
+    # Same global state as Interpreter, but executes compiled closures.
+    def prepare(self, node):
+        node = Resolver(self.global_vars).resolve_program(node)
+        self.pure = pure_functions(node)
+        node = TypeSpecializer(self.global_vars).specialize_program(node)
+        if string_checked(self.meter):
+            node = checked_sums(node)
+        return self.metered(ClosureCompiler(self).compile(node))
+
+    def statement(self, node, resolved, untyped):
+        return ClosureCompiler(self).compile(self.typed_statement(resolved, untyped))
+
+    def eval(self, node):
+        return self.prepare(node)()
+
+
+# Bytecode opcodes. Every instruction is an (opcode, arg) pair; jump
+# arguments are absolute indexes into the instruction list. JUMP_BACK is
+# the jump that closes a loop.
+OPNAMES = [
+    'LOAD_CONST', 'LOAD_FAST', 'LOAD_GLOBAL', 'LOAD_CHECKED',
+    'STORE_FAST', 'STORE_GLOBAL', 'STORE_CHECKED', 'DECLARE_FAST',
+    'DECLARE_GLOBAL', 'AUG_FAST', 'AUG_GLOBAL', 'AUG_CHECKED',
+    'BINARY', 'COMPARE', 'NEGATE', 'JUMP', 'JUMP_IF_FALSE', 'JUMP_BACK', 'FOR_PREP',
+    'FOR_ITER', 'CALL', 'RETURN_VALUE', 'POP', 'PRINT', 'INPUT', 'SLICE',
+    'MAKE_FUNCTION', 'MATERIALIZE', 'INDEX', 'BUILD_ARRAY', 'STORE_INDEX',
+    'PARALLEL_FOR', 'GET_ITER', 'BUILD_MAP', 'CALL_INTRINSIC', 'HALT',
+]
+(LOAD_CONST, LOAD_FAST, LOAD_GLOBAL, LOAD_CHECKED,
+ STORE_FAST, STORE_GLOBAL, STORE_CHECKED, DECLARE_FAST,
+ DECLARE_GLOBAL, AUG_FAST, AUG_GLOBAL, AUG_CHECKED,
+ BINARY, COMPARE, NEGATE, JUMP, JUMP_IF_FALSE, JUMP_BACK, FOR_PREP,
+ FOR_ITER, CALL, RETURN_VALUE, POP, PRINT, INPUT, SLICE,
+ MAKE_FUNCTION, MATERIALIZE, INDEX, BUILD_ARRAY, STORE_INDEX,
+ PARALLEL_FOR, GET_ITER, BUILD_MAP, CALL_INTRINSIC, HALT) = range(len(OPNAMES))
+
+
+class Code:
+    def __init__(self, name, params=(), nlocals=0):
+        self.name = name
+        self.params = params
+        self.nlocals = nlocals
+        self.instrs = []
+        self.lines = []   # (index of a statement's first instruction, its line)
+    def __repr__(self):
+        return f"<code {self.name} at {id(self):#x}>"
+    def line(self, pc):
+        # Source line of the statement instruction pc belongs to
+        i = bisect.bisect_right(self.lines, (pc, sys.maxsize))
+        return self.lines[i - 1][1] if i else None
+
+
+class BytecodeCompiler:
+    # Lowers a resolved AST into flat Code objects for the VM.
+    def __init__(self):
+        self.code = None
+        self.appended = set()
+
+    def compile_program(self, node):
+        self.code = Code('<program>')
+        for stmt in node[1]:
+            self.stmt(stmt)
+        self.emit(HALT)
+        return self.code
+
+    def emit(self, op, arg=None):
+        self.code.instrs.append((op, arg))
+        return len(self.code.instrs) - 1
+
+    def patch(self, index, target):
+        op, _ = self.code.instrs[index]
+        self.code.instrs[index] = (op, target)
+
+    def here(self):
+        return len(self.code.instrs)
+
+    def load(self, binding):
+        depth, slot, name, checked = binding
+        if depth == GLOBAL: self.emit(LOAD_GLOBAL, name)
+        elif checked: self.emit(LOAD_CHECKED, (slot, name))
+        else:
+            self.emit(LOAD_FAST, slot)
+            if slot in self.appended:
+                self.emit(MATERIALIZE)
+
+    def stmt(self, node):
+        typ = node[0]
+        self.code.lines.append((self.here(), node[-1]))
+        if typ == 'FUNCDEF':
+            _, name, params, body, nlocals, _ = node
+            outer = self.code, self.appended
+            self.code = Code(name, params, nlocals)
+            self.appended = appended_slots(body, set())
+            for s in body:
+                self.stmt(s)
+            self.emit(LOAD_CONST, None)
+            self.emit(RETURN_VALUE)
+            func = self.code
+            self.code, self.appended = outer
+            self.emit(MAKE_FUNCTION, func)
+        elif typ == 'VAR_DECL':
+            _, vartype, (depth, slot, name, _), expr, _ = node
+            self.expr(expr)
+            convert = DECL_CONVERT.get(vartype)
+            if depth == LOCAL: self.emit(DECLARE_FAST, (slot, convert))
+            else: self.emit(DECLARE_GLOBAL, (name, convert))
+        elif typ == 'ASSIGN':
+            _, (depth, slot, name, checked), op, expr, _ = node
+            if op not in ('=', '+=') and depth == LOCAL and not checked and slot in self.appended:
+                # The slot may hold a StringBuilder; read it materialized
+                self.load(node[1])
+                self.expr(expr)
+                self.emit(BINARY, AUG_OPS[op])
+                self.emit(STORE_FAST, slot)
+                return
+            self.expr(expr)
+            if op == '=':
+                if depth == GLOBAL: self.emit(STORE_GLOBAL, name)
+                elif checked: self.emit(STORE_CHECKED, (slot, name))
+                else: self.emit(STORE_FAST, slot)
+            else:
+                fn = AUG_OPS[op]
+                if depth == GLOBAL: self.emit(AUG_GLOBAL, (name, fn))
+                elif checked: self.emit(AUG_CHECKED, (slot, name, fn))
+                else: self.emit(AUG_FAST, (slot, fn))
+        elif typ == 'SETITEM':
+            _, binding, index, op, expr, _ = node
+            self.load(binding)
+            self.expr(index)
+            self.expr(expr)
+            self.emit(STORE_INDEX, op)
+        elif typ == 'PRINT':
+            for part in node[1]:
+                self.expr(part)
+            self.emit(PRINT, len(node[1]))
+        elif typ == 'IF':
+            _, branches, else_branch, _ = node
+            exits = []
+            for n, (cond, body) in enumerate(branches, 1):
+                self.expr(cond)
+                skip = self.emit(JUMP_IF_FALSE)
+                for s in body:
+                    self.stmt(s)
+                if n < len(branches) or else_branch:
+                    exits.append(self.emit(JUMP))
+                self.patch(skip, self.here())
+            for s in else_branch:
+                self.stmt(s)
+            for j in exits:
+                self.patch(j, self.here())
+        elif typ == 'WHILE':
+            _, cond, body, _ = node
+            top = self.here()
+            self.expr(cond)
+            exit_ = self.emit(JUMP_IF_FALSE)
+            for s in body:
+                self.stmt(s)
+            self.emit(JUMP_BACK, top)
+            self.patch(exit_, self.here())
+        elif typ == 'FOR':
+            _, (depth, slot, name, _), start_expr, end_expr, body, _ = node
+            self.expr(start_expr)
+            self.expr(end_expr)
+            self.emit(FOR_PREP)
+            top = self.emit(FOR_ITER)
+            for s in body:
+                self.stmt(s)
+            self.emit(JUMP_BACK, top)
+            target = slot if depth == LOCAL else name
+            self.code.instrs[top] = (FOR_ITER, (depth, target, self.here()))
+        elif typ == 'FOREACH':
+            _, (depth, slot, name, _), expr, body, _ = node
+            self.expr(expr)
+            self.emit(GET_ITER)
+            top = self.emit(FOR_ITER)
+            for s in body:
+                self.stmt(s)
+            self.emit(JUMP_BACK, top)
+            target = slot if depth == LOCAL else name
+            self.code.instrs[top] = (FOR_ITER, (depth, target, self.here()))
+        elif typ == 'PFOR':
+            # The body becomes its own Code, a FOR loop over the range a
+            # worker is given, run on the frame of the enclosing code
+            _, (depth, slot, name, _), start_expr, end_expr, body, line = node
+            reductions, declared, _, _ = check_parallel_for(node)
+            self.expr(start_expr)
+            self.expr(end_expr)
+            outer = self.code
+            self.code = Code(f"<parallel for at line {line}>")
+            self.code.lines.append((0, line))
+            top = self.emit(FOR_ITER)
+            for s in body:
+                self.stmt(s)
+            self.emit(JUMP_BACK, top)
+            target = slot if depth == LOCAL else name
+            self.code.instrs[top] = (FOR_ITER, (depth, target, self.here()))
+            self.emit(HALT)
+            loop, self.code = self.code, outer
+            self.emit(PARALLEL_FOR, (loop, reductions, declared, node_bindings(node, {})))
+        elif typ == 'RETURN':
+            self.expr(node[1])
+            self.emit(RETURN_VALUE)
+        else:
+            self.expr(node)
+            self.emit(POP)
+
+    def expr(self, node):
+        typ = node[0]
+        if typ in ('NUMBER', 'STRING', 'BOOL'):
+            self.emit(LOAD_CONST, node[1])
+        elif typ == 'VAR':
+            self.load(node[1])
+        elif typ == 'BINOP':
+            _, op, left, right = node
+            self.expr(left); self.expr(right)
+            self.emit(BINARY, BINARY_OPS[op])
+        elif typ == 'CMP':
+            _, op, left, right = node
+            self.expr(left); self.expr(right)
+            self.emit(COMPARE, COMPARE_OPS[op])
+        elif typ == 'UMINUS':
+            self.expr(node[1])
+            self.emit(NEGATE)
+        elif typ in ('CALL', 'INTRINSIC'):
+            _, name, args, _ = node
+            for a in args:
+                self.expr(a)
+            fn = intrinsic_for(name, len(args)) if typ == 'INTRINSIC' else None
+            if fn is None:
+                self.emit(CALL, (name, len(args)))
+            else:
+                self.emit(CALL_INTRINSIC, (name, len(args), fn))
+        elif typ == 'INPUT':
+            self.expr(node[1])
+            self.emit(INPUT)
+        elif typ == 'SLICE':
+            _, binding, start_node, end_node = node
+            self.load(binding)
+            if start_node is not None: self.expr(start_node)
+            else: self.emit(LOAD_CONST, 0)
+            if end_node is not None: self.expr(end_node)
+            else: self.emit(LOAD_CONST, None)
+            self.emit(SLICE)
+        elif typ == 'INDEX':
+            self.load(node[1])
+            self.expr(node[2])
+            self.emit(INDEX)
+        elif typ == 'ARRAY':
+            for e in node[1]:
+                self.expr(e)
+            self.emit(BUILD_ARRAY, len(node[1]))
+        elif typ == 'MAP':
+            for e in node[1]:
+                self.expr(e)
+            self.emit(BUILD_MAP, len(node[1]))
+        else:
+            raise Exception(f"Unknown AST node: {typ}")
+
+
+def disassemble(code, out=None):
+    out = out or sys.stdout
+    codes = [code]
+    while codes:
+        code = codes.pop(0)
+        params = ', '.join(f"{t} {n}" for t, n in code.params)
+        title = code.name if code.name.startswith('<') else f"{code.name}({params})"
+        out.write(f"Disassembly of {title}:\n")
+        targets = {arg for op, arg in code.instrs if op in (JUMP, JUMP_IF_FALSE, JUMP_BACK)}
+        targets |= {arg[2] for op, arg in code.instrs if op == FOR_ITER}
+        for i, (op, arg) in enumerate(code.instrs):
+            if op == MAKE_FUNCTION:
+                codes.append(arg)
+                text = arg.name
+            elif op == PARALLEL_FOR:
+                codes.append(arg[0])
+                text = arg[0].name
+            elif op in (BINARY, COMPARE):
+                text = OP_SYMBOLS[arg]
+            elif op in (AUG_FAST, AUG_GLOBAL, AUG_CHECKED):
+                text = f"{' '.join(map(str, arg[:-1]))} ({OP_SYMBOLS[arg[-1]]}=)"
+            elif op in (DECLARE_FAST, DECLARE_GLOBAL):
+                text = str(arg[0]) if arg[1] is None else f"{arg[0]} ({DECL_TYPES[arg[1]]})"
+            elif op == FOR_ITER:
+                text = f"{arg[1]} (to {arg[2]})"
+            elif op in (JUMP, JUMP_IF_FALSE, JUMP_BACK):
+                text = f"to {arg}"
+            elif op in (CALL, CALL_INTRINSIC):
+                text = f"{arg[0]} ({arg[1]} args)"
+            elif op == LOAD_CONST:
+                text = repr(arg)
+            elif isinstance(arg, tuple):
+                text = ' '.join(map(str, arg))
+            else:
+                text = '' if arg is None else str(arg)
+            mark = '>>' if i in targets else '  '
+            out.write(f"  {mark} {i:4d} {OPNAMES[op]:<14} {text}".rstrip() + "\n")
+        out.write("\n")
+
+
+class VirtualMachine(Interpreter):
+    # Stack-based VM over BytecodeCompiler output. Calls push a frame onto an
+    # explicit frame stack, so FLUX recursion does not recurse in Python,
+    # and the whole state of a run fits in one list: that is what lets
+    # run_async suspend it and pick it up again.
+    suspend_input = False
+    ticks_left = 0
+
+    def compile_code(self, node):
+        node = Resolver(self.global_vars).resolve_program(node)
+        self.pure = pure_functions(node)
+        node = TypeSpecializer(self.global_vars).specialize_program(node)
+        if string_checked(self.meter):
+            node = checked_sums(node)
+        return BytecodeCompiler().compile_program(node)
+
+    def prepare(self, node):
+        code = self.compile_code(node)
+        return self.metered(lambda: self.run(code))
+
+    def statement(self, node, resolved, untyped):
+        code = BytecodeCompiler().compile_program(self.typed_statement(resolved, untyped))
+        return lambda: self.run(code)
+
+    def eval(self, node):
+        return self.prepare(node)()
+
+    def run(self, code, fr=None, stack=None):
+        # fr and stack are given to run the body of a parallel for. Metered,
+        # the run is cut into slices of what is left of the meter's interval.
+        state = [code, 0, [] if stack is None else stack, fr, []]
+        meter = self.meter
+        if meter is None:
+            return self.execute(state)
+        while True:
+            n = meter.left
+            if self.execute(state, n) is None:
+                # Ticks used in the last, partial slice count too
+                meter.spend(n - self.ticks_left, state[0].line(state[1]))
+                return None
+            meter.spend(n, state[0].line(state[1]))
+
+    async def run_async(self, code, reader, writer, ticks=ASYNC_TICKS):
+        # Runs code as a session on the running event loop: input << awaits
+        # reader() for a line (None at EOF), output is passed to the
+        # coroutine writer(text), and every `ticks` loop iterations and calls
+        # the VM gives the other tasks a turn. self.out only collects text.
+        state = [code, 0, [], None, []]
+        out = self.out
+        meter = self.meter
+        if meter is not None:
+            meter.start(out)
+        self.suspend_input = True
+        try:
+            while True:
+                if meter is None:
+                    status = self.execute(state, ticks)
+                else:
+                    n = min(ticks, meter.left) if ticks else meter.left
+                    status = meter.run(self.execute, state, n)
+                text = out.take()
+                if text:
+                    await writer(text)
+                out.check()
+                if meter is not None:
+                    spent = n if status is SUSPENDED else n - self.ticks_left
+                    meter.spend(spent, state[0].line(state[1]))
+                if status is None:
+                    return
+                if status is NEEDS_INPUT:
+                    stack = state[2]
+                    prompt = str(stack.pop())
+                    if prompt:
+                        await writer(prompt)
+                    line = await reader()
+                    if line is None:
+                        raise EOFError("EOF when reading a line")
+                    stack.append(line)
+                else:
+                    await asyncio.sleep(0)
+        finally:
+            self.suspend_input = False
+
+    def execute(self, state, ticks=0):
+        # Runs from state, [code, pc, stack, frame, frames], to HALT and
+        # returns None. With ticks it stops after that many back jumps and
+        # calls, and with suspend_input at input <<, saving where it was in
+        # state and returning SUSPENDED or NEEDS_INPUT. ticks 0 never stops.
+        # At HALT and input << the ticks not used are left in ticks_left.
+        g = self.global_vars
+        functions = self.functions
+        memo = self.memo
+        write = self.out.write
+        read = self.out.input
+        suspend_input = self.suspend_input
+        meter = self.meter
+        max_depth = meter.max_depth if meter is not None and meter.max_depth else sys.maxsize
+        code, pc, stack, fr, frames = state
+        instrs = code.instrs
+        push = stack.append
+        pop = stack.pop
+        while True:
+            op, arg = instrs[pc]
+            pc += 1
+            if op == LOAD_FAST:
+                push(fr[arg])
+            elif op == LOAD_CONST:
+                push(arg)
+            elif op == BINARY or op == COMPARE:
+                r = pop()
+                stack[-1] = arg(stack[-1], r)
+            elif op == JUMP_IF_FALSE:
+                if not pop(): pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == JUMP_BACK:
+                pc = arg
+                ticks -= 1
+                if ticks == 0:
+                    state[:] = code, pc, stack, fr, frames
+                    return SUSPENDED
+            elif op == AUG_FAST:
+                slot, fn = arg
+                fr[slot] = fn(fr[slot], pop())
+            elif op == STORE_FAST:
+                fr[arg] = pop()
+            elif op == LOAD_GLOBAL:
+                if arg not in g: raise undefined(arg)
+                v = g[arg]
+                push(str(v) if type(v) is StringBuilder else v)
+            elif op == FOR_ITER:
+                i = next(stack[-1], None)
+                if i is None:
+                    pop()
+                    pc = arg[2]
+                elif arg[0] == LOCAL:
+                    fr[arg[1]] = i
+                else:
+                    g[arg[1]] = i
+            elif op == CALL:
+                name, argc = arg
+                if argc:
+                    arg_vals = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    arg_vals = []
+                if name not in functions:
+                    push(call_intrinsic(name, arg_vals))
+                    continue
+                func = functions[name]
+                if argc != func.arity:
+                    raise Exception(f"Argument count mismatch in call to {name}")
+                key = None
+                if func.memo is not None:
+                    key = memo.key(func, arg_vals)
+                    val = memo.get(key)
+                    if val is not MISSING:
+                        push(val)
+                        continue
+                if func.nlocals > argc:
+                    arg_vals += [UNSET] * (func.nlocals - argc)
+                if len(frames) >= max_depth:
+                    raise meter.too_deep(code.line(pc - 1))
+                # The key rides on the caller's frame until RETURN_VALUE stores the result
+                frames.append((code, pc, stack, fr, key))
+                code = func.body
+                instrs = code.instrs
+                pc = 0
+                fr = arg_vals
+                stack = []
+                push = stack.append
+                pop = stack.pop
+                ticks -= 1
+                if ticks == 0:
+                    state[:] = code, pc, stack, fr, frames
+                    return SUSPENDED
+            elif op == CALL_INTRINSIC:
+                argc = arg[1]
+                if argc:
+                    arg_vals = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    arg_vals = ()
+                push(arg[2](*arg_vals))
+            elif op == RETURN_VALUE:
+                val = pop()
+                if not frames:
+                    raise ReturnException(val)
+                code, pc, stack, fr, key = frames.pop()
+                instrs = code.instrs
+                if key is not None:
+                    memo.put(key, val)
+                push = stack.append
+                pop = stack.pop
+                push(val)
+            elif op == DECLARE_FAST:
+                slot, convert = arg
+                fr[slot] = convert(pop()) if convert else pop()
+            elif op == DECLARE_GLOBAL:
+                name, convert = arg
+                g[name] = convert(pop()) if convert else pop()
+            elif op == STORE_GLOBAL:
+                if arg not in g: raise undefined(arg)
+                g[arg] = pop()
+            elif op == AUG_GLOBAL:
+                name, fn = arg
+                if name not in g: raise undefined(name)
+                old = g[name]
+                if type(old) is StringBuilder and fn is not flux_append: old = str(old)
+                g[name] = fn(old, pop())
+            elif op == POP:
+                pop()
+            elif op == PRINT:
+                out_str = ''
+                if arg:
+                    for v in stack[-arg:]:
+                        out_str += str(v) if v is not None else ''
+                    del stack[-arg:]
+                write(out_str)
+            elif op == NEGATE:
+                stack[-1] = -stack[-1]
+            elif op == FOR_PREP:
+                end = pop(); start = pop()
+                if not (isinstance(start,int) and isinstance(end,int)):
+                    raise Exception("Loop bounds must be integers")
+                push(iter(range(start, end)))
+            elif op == SLICE:
+                end = pop(); start = pop(); s = pop()
+                if not isinstance(s,(str,FluxArray)): raise Exception("Slice on non-string")
+                push(s[start:end])
+            elif op == INPUT:
+                if suspend_input:
+                    state[:] = code, pc, stack, fr, frames
+                    self.ticks_left = ticks
+                    return NEEDS_INPUT
+                push(read(str(pop())))
+            elif op == LOAD_CHECKED or op == STORE_CHECKED or op == AUG_CHECKED:
+                slot, name = arg[0], arg[1]
+                if fr[slot] is not UNSET: env, key = fr, slot
+                elif name in g: env, key = g, name
+                else: raise undefined(name)
+                old = env[key]
+                if type(old) is StringBuilder and (op == LOAD_CHECKED or arg[2] is not flux_append):
+                    old = str(old)
+                if op == LOAD_CHECKED: push(old)
+                elif op == STORE_CHECKED: env[key] = pop()
+                else: env[key] = arg[2](old, pop())
+            elif op == MATERIALIZE:
+                if type(stack[-1]) is StringBuilder: stack[-1] = str(stack[-1])
+            elif op == INDEX:
+                i = pop()
+                stack[-1] = flux_index(stack[-1], i)
+            elif op == BUILD_ARRAY:
+                if arg:
+                    values = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    values = []
+                push(make_array(values))
+            elif op == BUILD_MAP:
+                if arg:
+                    items = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    items = []
+                push(make_map(items))
+            elif op == GET_ITER:
+                # FOR_ITER stops at None, which no item can be
+                stack[-1] = iter(flux_items(stack[-1]))
+            elif op == STORE_INDEX:
+                val = pop(); i = pop()
+                flux_setitem(pop(), i, arg, val)
+            elif op == MAKE_FUNCTION:
+                functions[arg.name] = self.make_function(arg.name, arg.params, arg, arg.nlocals)
+            elif op == PARALLEL_FOR:
+                end = pop(); start = pop()
+                if not (isinstance(start,int) and isinstance(end,int)):
+                    raise Exception("Loop bounds must be integers")
+                loop, reductions, declared, bindings = arg
+                run_range = lambda a, b, fr=fr: self.run(loop, fr, [iter(range(a, b))])
+                parallel_for(self, start, end, run_range, SlotScope(g, fr, bindings),
+                             reductions, declared)
+            elif op == HALT:
+                state[:] = code, pc, stack, fr, frames
+                self.ticks_left = ticks
+                return None
+            else:
+                raise Exception(f"Unknown opcode: {op}")
+
+
+# On-disk cache of parsed programs, laid out like __pycache__. An entry is
+# CACHE_MAGIC + interpreter tag + sha256 of the source, then the optimized
+# AST in marshal format. Any mismatch in that header means a miss.
+CACHE_MAGIC = b'FXC1'
+CACHE_DIRNAME = '__fluxcache__'
+
+
+@functools.lru_cache(maxsize=None)
+def interpreter_tag():
+    # Changes whenever FLUX.py or the Python marshal format does
+    h = hashlib.sha256(sys.implementation.cache_tag.encode())
+    with open(__file__, 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()[:16].encode()
+
+
+def cache_path(program, opt_level, cache_dir=None):
+    directory, base = os.path.split(os.path.abspath(program))
+    if cache_dir is None:
+        directory = os.path.join(directory, CACHE_DIRNAME)
+    else:
+        # Mirror the source tree under cache_dir, like PYTHONPYCACHEPREFIX
+        directory = os.path.join(cache_dir, os.path.splitdrive(directory)[1].lstrip(os.sep))
+    return os.path.join(directory, f"{os.path.splitext(base)[0]}.O{opt_level}.fxc")
+
+
+def read_cache(path, header):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if not data.startswith(header):
+        return None
+    try:
+        return marshal.loads(data[len(header):])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def write_cache(path, header, ast, mode=0o644):
+    # Write to a temp file and rename it into place, so a concurrent reader
+    # sees either the old entry or the complete new one
+    directory = os.path.dirname(path)
+    tmp = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header + marshal.dumps(ast))
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except OSError:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def parse_source(source, opt_level=1):
+    ast = Parser(Lexer(source).tokens()).parse_program()
+    return Optimizer(opt_level).optimize(ast)
+
+
+def source_lines(f, out):
+    # The lines of a program file being streamed. From a pipe or terminal,
+    # where the next line may be long in coming, `out` (the Output) is
+    # flushed first, so what the lines so far printed shows in the meantime.
+    if f.seekable():
+        return f
+    def lines():
+        while True:
+            out.flush()
+            line = f.readline()
+            if not line:
+                return
+            yield line
+    return lines()
+
+
+def repl(interp, opt_level=1):
+    # Interactive session on stdin, prompting when it is a terminal. Every
+    # statement runs once complete: a block or string still open reads more
+    # lines first. Globals and functions persist from one to the next, and
+    # only what is typed gets lexed and parsed. An error is reported, the
+    # rest of its line dropped, and the session goes on.
+    feed = interp.streamer(opt_level)
+    out = interp.out
+    prompts = sys.stdin.isatty()
+    fresh = True   # nothing of the next statement read yet
+    read_lines = 0
+    def read():
+        nonlocal fresh, read_lines
+        out.flush()
+        try:
+            line = input(('>>> ' if fresh else '... ') if prompts else '')
+        except EOFError:
+            if prompts: print()
+            return ''
+        read_lines += 1
+        if line.strip() and not line.lstrip().startswith('#'):
+            fresh = False
+        return line + '\n'
+    # Unlike a generator, this iterator outlives a KeyboardInterrupt in read()
+    lines = iter(read, '')
+    while True:
+        fresh = True
+        try:
+            # Lines are numbered from the start of the session
+            for node in Parser(Lexer(lines, read_lines + 1).tokens()).statements():
+                if interp.meter is not None:
+                    interp.meter.start(out)
+                feed(node)
+                fresh = True
+            return
+        except KeyboardInterrupt:
+            message = "KeyboardInterrupt"
+        except ReturnException:
+            message = "error: return outside a function"
+        except Exception as e:
+            message = f"error: {e}"
+        # The tree walker's scopes of the calls the error cut short
+        del interp.envs[1:]
+        try:
+            out.flush()
+        except LimitExceeded:
+            pass
+        print(message, file=sys.stderr)
+
+
+def load_program(program, opt_level=1, use_cache=True, cache_dir=None):
+    # Source file -> optimized AST, going through the cache when allowed
+    with open(program) as f:
+        source = f.read()
+        mode = os.fstat(f.fileno()).st_mode & 0o666
+    if not use_cache:
+        return parse_source(source, opt_level)
+    path = cache_path(program, opt_level, cache_dir)
+    header = (CACHE_MAGIC + interpreter_tag() +
+              hashlib.sha256(source.encode('utf-8', 'surrogateescape')).digest())
+    ast = read_cache(path, header)
+    if ast is None:
+        ast = parse_source(source, opt_level)
+        write_cache(path, header, ast, mode)
+    return ast
+
+
+# --check: lex, parse and resolve programs without running them. Results
+# are cached in one file, keyed by the sha256 of each source, behind a
+# header of CHECK_MAGIC + interpreter tag + opt level; only sources not in
+# it are checked. It keeps the entries of the last check and, up to
+# CHECK_CACHE_SIZE, older ones.
+CHECK_MAGIC = b'FXK1'
+CHECK_CACHE_NAME = 'check.fxc'
+CHECK_CACHE_SIZE = 100000
+LINE_RE = re.compile(r'\bat line (\d+)')
+
+
+def check_source(source, opt_level=1):
+    # The errors a program stops with before it runs, as (line, col,
+    # message) tuples: col is 0 where only the line is known, line too
+    # where neither is
+    parser = None
+    try:
+        parser = Parser(Lexer(source).tokens())
+        ast = Optimizer(opt_level).optimize(parser.parse_program())
+        parser = None
+        TypeSpecializer().specialize_program(Resolver().resolve_program(ast))
+    except SourceError as e:
+        return [(e.line or 0, e.col or 0, e.message)]
+    except Exception as e:
+        errors = []
+        for message in (str(e) or type(e).__name__).split('\n'):
+            m = LINE_RE.search(message)
+            if m:
+                errors.append((int(m.group(1)), 0, message))
+            elif parser is not None:
+                # Where the parser got to
+                errors.append((parser.current.line or 0, parser.current.col or 0, message))
+            else:
+                errors.append((0, 0, message))
+        return errors
+    return []
+
+
+def fx_files(paths):
+    # Files as given, and the .fx files under directories, in order
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for directory, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != CACHE_DIRNAME)
+            for name in sorted(files):
+                if name.endswith('.fx'):
+                    yield os.path.join(directory, name)
+
+
+def check_paths(paths, opt_level=1, workers=PARALLEL_WORKERS, cache_file=None):
+    # Checks the files fx_files(paths) finds. Returns a list of (path,
+    # errors) and how many files the cache answered for. Files not in the
+    # cache are checked on `workers` processes.
+    header = CHECK_MAGIC + interpreter_tag() + bytes([opt_level])
+    cache = (read_cache(cache_file, header) if cache_file else None) or {}
+    found = []     # (path, digest or the read error)
+    todo = {}      # digest -> source not in the cache
+    hits = 0
+    for path in fx_files(paths):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).digest()
+            if digest in cache:
+                hits += 1
+            elif digest not in todo:
+                todo[digest] = data.decode('utf-8')
+        except (OSError, UnicodeDecodeError) as e:
+            found.append((path, [(0, 0, str(e))]))
+            continue
+        found.append((path, digest))
+    sources = list(todo.values())
+    check = functools.partial(check_source, opt_level=opt_level)
+    if workers > 1 and len(sources) > 1:
+        workers = min(workers, len(sources))
+        chunk = max(1, len(sources) // (workers * PARALLEL_CHUNKS))
+        ctx = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+            checked = list(pool.map(check, sources, chunksize=chunk))
+    else:
+        checked = list(map(check, sources))
+    cache.update(zip(todo, checked))
+    if cache_file and todo:
+        kept = {digest: cache[digest] for _, digest in found if isinstance(digest, bytes)}
+        for digest, errors in cache.items():
+            if len(kept) >= CHECK_CACHE_SIZE: break
+            kept.setdefault(digest, errors)
+        write_cache(cache_file, header, kept)
+    results = [(path, cache[d] if isinstance(d, bytes) else d) for path, d in found]
+    return results, hits
+
+
+BACKENDS = {
+    'tree': Interpreter,
+    'closure': ClosureInterpreter,
+    'vm': VirtualMachine,
+}
+
+
+# Embedding API: compile(source) -> Program, program.run(...) -> output.
+# Compiled programs are kept in an in-memory LRU keyed by the sha256 of the
+# source, so a service running the same scripts over and over parses,
+# checks and compiles each one once.
+PROGRAM_CACHE_SIZE = 256
+program_cache = {}      # key -> Program, dict order is recency order
+program_cache_lock = threading.Lock()
+
+
+class Program:
+    # A parsed and checked FLUX program. Every run() starts from empty
+    # globals (plus the ones it is given) on an interpreter that has already
+    # prepared the program; interpreters go back to a pool after a run, so
+    # one per concurrent run is ever made. Output is captured, never sent to
+    # sys.stdout, and input << reads from the given stdin only. Runs given
+    # limits use interpreters that prepared the program with a Meter, one
+    # with a string limit if they have one.
+    def __init__(self, ast, backend='tree', global_names=(), memo_size=MEMO_SIZE,
+                 tier_threshold=TIER_THRESHOLD):
+        if backend not in BACKENDS:
+            raise Exception(f"Unknown backend {backend}")
+        self.ast = ast
+        self.backend = backend
+        self.global_names = tuple(sorted(global_names))
+        self.memo_size = memo_size
+        self.tier_threshold = tier_threshold
+        Resolver(self.global_names).resolve_program(ast)   # static errors raise here
+        # (metered, string limit) -> (interpreter, run function) pairs
+        self.idle = {}
+
+    def interpreter(self, limits):
+        interp = BACKENDS[self.backend](Output(io.StringIO()), self.memo_size,
+                                        self.tier_threshold)
+        interp.global_vars.update(dict.fromkeys(self.global_names))
+        if any(limits):
+            interp.meter = Meter(*limits)
+        return interp, interp.prepare(self.ast)
+
+    def run(self, globals=None, stdin=None, stdout=None, max_steps=0, timeout=0,
+            max_depth=0, max_output=0, max_string=0):
+        # globals maps names to values (lists become arrays, dicts maps);
+        # every name given to compile() must be there. stdin is a string or
+        # a file, none reads as EOF. Returns the print output, or None when it went
+        # to the file `stdout`. The limits are those of Meter; going over
+        # one raises LimitExceeded.
+        globals = globals or {}
+        missing = [name for name in self.global_names if name not in globals]
+        if missing:
+            raise Exception(f"No value given for global '{missing[0]}'")
+        limits = (max_steps, timeout, max_depth, max_output, max_string)
+        idle = self.idle.setdefault((any(limits), bool(max_string)), [])
+        try:
+            interp, run = idle.pop()
+        except IndexError:
+            interp, run = self.interpreter(limits)
+        if interp.meter is not None:
+            interp.meter.limit(*limits)
+        if stdin is None or isinstance(stdin, str):
+            stdin = io.StringIO(stdin or '')
+        captured = io.StringIO() if stdout is None else stdout
+        out = interp.out
+        out.redirect(captured, stdin)
+        try:
+            interp.reset()
+            for name, val in globals.items():
+                if isinstance(val, list): val = make_array(val)
+                elif isinstance(val, dict) and type(val) is not FluxMap:
+                    val = make_map([x for kv in val.items() for x in kv])
+                interp.global_vars[name] = val
+            run()
+        finally:
+            out.flush()
+            out.redirect(None)
+            idle.append((interp, run))
+        return captured.getvalue() if stdout is None else None
+
+
+async def serve(ast, host='127.0.0.1', port=0, ticks=ASYNC_TICKS, limits=None):
+    # Demo TCP server: every connection is a session running the program on
+    # its own VM, input << reading lines from the client and print output
+    # going back to it. The program is compiled once. limits are Meter
+    # arguments for each session. Returns the started asyncio server.
+    template = VirtualMachine()
+    if limits:
+        template.meter = Meter(**limits)
+    code = template.compile_code(ast)
+
+    async def session(reader, writer):
+        vm = VirtualMachine(Output(io.StringIO(), sys.maxsize))
+        vm.pure = template.pure
+        vm.workers = 1    # never fork the server
+        if limits:
+            vm.meter = Meter(**limits)
+        async def read():
+            line = await reader.readline()
+            return line.decode('utf-8', 'replace').rstrip('\r\n') if line else None
+        async def write(text):
+            writer.write(text.encode('utf-8'))
+            await writer.drain()
+        try:
+            await vm.run_async(code, read, write, ticks)
+        except (ConnectionError, EOFError, asyncio.CancelledError):
+            pass   # the client left, or the server is shutting down
+        except Exception as e:
+            writer.write(f"error: {e}\n".encode('utf-8'))
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(session, host, port, backlog=SERVE_BACKLOG)
+
+
+def compile(source, backend='tree', opt_level=1, globals=()):
+    # source -> Program; `globals` names the globals run() will be given
+    key = (hashlib.sha256(source.encode('utf-8', 'surrogateescape')).digest(),
+           backend, opt_level, frozenset(globals))
+    with program_cache_lock:
+        program = program_cache.pop(key, None)
+    if program is None:
+        program = Program(parse_source(source, opt_level), backend, globals)
+    with program_cache_lock:
+        program_cache[key] = program
+        while len(program_cache) > PROGRAM_CACHE_SIZE:
+            del program_cache[next(iter(program_cache))]
+    return program
+
+
+def main():
+    argp = argparse.ArgumentParser(prog='FLUX.py')
+    argp.add_argument('program', nargs='?',
+                      help='FLUX source file (.fx), or - to read it from stdin; '
+                           'without one, statements are read and run interactively')
+    argp.add_argument('--check', nargs='+', metavar='PATH',
+                      help='lex, parse and resolve the files, and the .fx files under the '
+                           'directories, without running them, on --workers processes. '
+                           'Errors are printed as path:line:col: message (col 0 when only '
+                           'the line is known); exit status 1 if there are any. Results '
+                           f'are cached in {CACHE_DIRNAME}/{CHECK_CACHE_NAME} (or under '
+                           '--cache-dir) by the hash of each file')
+    argp.add_argument('--backend', choices=sorted(BACKENDS), default='tree',
+                      help='execution engine (default: tree)')
+    argp.add_argument('--dis', action='store_true',
+                      help='print the bytecode the program compiles to and exit')
+    argp.add_argument('-O', dest='opt_level', type=int, choices=(0, 1, 2), default=1,
+                      help='optimization level: 0 none, 1 constant folding and '
+                           'dead branches (default), 2 adds loop-invariant hoisting')
+    argp.add_argument('--stream', action='store_true',
+                      help='run each top-level statement as soon as it is parsed, instead of '
+                           'parsing the whole program first (always on for -). Functions '
+                           'exist from when their definition has run, as in a normal run, '
+                           'but a function may use globals declared later')
+    argp.add_argument('--no-cache', action='store_true',
+                      help=f'always lex and parse; do not read or write {CACHE_DIRNAME}')
+    argp.add_argument('--cache-dir', metavar='DIR',
+                      help=f'keep cached programs under DIR instead of {CACHE_DIRNAME} '
+                           'next to each script')
+    argp.add_argument('--output', metavar='FILE',
+                      help='write print output to FILE instead of stdout')
+    argp.add_argument('--unbuffered', action='store_true',
+                      help='write every print immediately instead of in batches')
+    argp.add_argument('--buffer-size', type=int, default=OUTPUT_BUFFER_SIZE, metavar='N',
+                      help='characters of print output to collect before each '
+                           f'write (default: {OUTPUT_BUFFER_SIZE})')
+    argp.add_argument('--memo-size', type=int, default=MEMO_SIZE, metavar='N',
+                      help='results of pure function calls to keep (LRU); 0 disables '
+                           f'memoization (default: {MEMO_SIZE})')
+    argp.add_argument('--memo-stats', action='store_true',
+                      help='report memo hits, misses and evictions on stderr at exit')
+    argp.add_argument('--profile', action='store_true',
+                      help='report time per function and per line on stderr at exit '
+                           '(tree and closure backends)')
+    argp.add_argument('--profile-stacks', metavar='FILE',
+                      help='with --profile, also write collapsed stacks for flame graph tools')
+    argp.add_argument('--tier-threshold', type=int, default=TIER_THRESHOLD, metavar='N',
+                      help='tree backend: calls of a function, or iterations of a loop, '
+                           'after which it is compiled to Python; 0 never compiles '
+                           f'(default: {TIER_THRESHOLD})')
+    argp.add_argument('--tier-dump', action='store_true',
+                      help='print the Python code generated for hot functions and loops on stderr')
+    argp.add_argument('--serve', metavar='[HOST:]PORT',
+                      help='serve the program over TCP: every connection is a session '
+                           'on the bytecode VM, input and output going over the socket')
+    argp.add_argument('--workers', type=int, default=PARALLEL_WORKERS, metavar='N',
+                      help='processes to run parallel for loops on; 1 runs them '
+                           f'sequentially (default: {PARALLEL_WORKERS}, the CPU count)')
+    argp.add_argument('--max-steps', type=int, default=0, metavar='N',
+                      help='stop the run after N loop iterations and calls')
+    argp.add_argument('--timeout', type=float, default=0, metavar='SECONDS',
+                      help='stop the run after this much wall-clock time')
+    argp.add_argument('--max-depth', type=int, default=0, metavar='N',
+                      help='stop the run when calls nest deeper than N')
+    argp.add_argument('--max-output', type=int, default=0, metavar='N',
+                      help='stop the run when it prints more than N characters')
+    argp.add_argument('--max-string', type=int, default=0, metavar='N',
+                      help='stop the run when it builds a string longer than N characters')
+    args = argp.parse_args()
+    if args.check:
+        if args.program is not None:
+            argp.error("--check takes the files to check instead of a program")
+        cache_file = None
+        if not args.no_cache:
+            cache_file = os.path.join(args.cache_dir or CACHE_DIRNAME, CHECK_CACHE_NAME)
+        results, cached = check_paths(args.check, args.opt_level, args.workers, cache_file)
+        nerrors = 0
+        for path, errors in results:
+            for line, col, message in errors:
+                print(f"{path}:{line}:{col}: {message}")
+            nerrors += len(errors)
+        print(f"checked {len(results)} files ({cached} from the cache), {nerrors} errors",
+              file=sys.stderr)
+        sys.exit(1 if nerrors else 0)
+    limits = {name: getattr(args, name) for name in
+              ('max_steps', 'timeout', 'max_depth', 'max_output', 'max_string')}
+    if not any(limits.values()):
+        limits = None
+    if args.profile and args.backend == 'vm':
+        argp.error("--profile needs the tree or closure backend")
+    streamed = args.stream or args.program in (None, '-')
+    if streamed and (args.dis or args.serve):
+        argp.error("--dis and --serve need the whole program; they do not stream")
+    if args.program is None and args.stream:
+        argp.error("--stream needs a program")
+    if streamed:
+        ast = None
+    else:
+        ast = load_program(args.program, args.opt_level, not args.no_cache, args.cache_dir)
+        resolved = Resolver().resolve_program(ast)
+    if args.dis:
+        disassemble(BytecodeCompiler().compile_program(
+            TypeSpecializer().specialize_program(resolved)))
+        return
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        async def serve_forever():
+            server = await serve(ast, host or '127.0.0.1', int(port), limits=limits)
+            addr = server.sockets[0].getsockname()
+            print(f"serving {args.program} on {addr[0]}:{addr[1]}", file=sys.stderr)
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(serve_forever())
+        except KeyboardInterrupt:
+            pass
+        return
+    stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    out = Output(stream, 0 if args.unbuffered else max(args.buffer_size, 0))
+    if args.profile and args.backend == 'tree':
+        # Compiled code would hide its lines from the profiler
+        interp = ProfilingInterpreter(out, args.memo_size, 0)
+    else:
+        interp = BACKENDS[args.backend](out, args.memo_size, args.tier_threshold)
+    if args.tier_dump:
+        interp.tier_dump = sys.stderr
+    interp.workers = args.workers
+    if limits:
+        interp.meter = Meter(**limits)
+    if args.profile:
+        interp.profiler = Profiler()
+    source = None
+    if streamed and args.program is not None:
+        if args.program == '-':
+            # stdin is the program: input << reads end of input
+            source = sys.stdin
+            out.redirect(stream, io.StringIO())
+        else:
+            source = open(args.program)
+    try:
+        if args.program is None:
+            repl(interp, args.opt_level)
+        elif streamed:
+            interp.stream(Parser(Lexer(source_lines(source, out)).tokens()).statements(),
+                          args.opt_level)
+        else:
+            interp.eval(ast)
+    except LimitExceeded as e:
+        sys.exit(f"error: {e}")
+    finally:
+        out.flush()
+        if args.output:
+            stream.close()
+        if source is not None and source is not sys.stdin:
+            source.close()
+        if args.memo_stats and interp.memo is not None:
+            print(interp.memo.report(), file=sys.stderr)
+        if args.profile:
+            interp.profiler.finish()
+            if args.program in (None, '-'):
+                interp.profiler.report(sys.stderr)
+            else:
+                with open(args.program, encoding='utf-8') as f:
+                    interp.profiler.report(sys.stderr, f.read())
+            if args.profile_stacks:
+                interp.profiler.write_stacks(args.profile_stacks)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,122 @@
+"""Call-protocol microbenchmark: FLUX calls per second, before and after.
+
+"before" is the original tree-walker call path: a fresh scope dict built
+by zipping params, and `return` raised and caught as ReturnException.
+"after" is the current protocol on each backend; the tree walker runs
+with and without tiering (compiling hot functions to Python).
+
+    python benchmarks/bench_calls.py [--repeat N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+FLAT_CALLS = 50000
+FIB_N = 18
+
+FLAT = f"""
+function add(int a, int b)
+    return a + b
+end function
+int t = 0
+for i = 0 in {FLAT_CALLS}
+    t = add(t, i)
+end for
+print << t << "\\n"
+"""
+
+FIB = f"""
+function fib(int n)
+    if n < 2
+        return n
+    end if
+    return fib(n - 1) + fib(n - 2)
+end function
+print << fib({FIB_N}) << "\\n"
+"""
+
+
+def fib_calls(n):
+    a, b = 1, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return 2 * a - 1
+
+
+class ExceptionCallInterpreter(FLUX.Interpreter):
+    # The call path as it was: return unwinds with an exception
+    def exec(self, node):
+        typ = node[0]
+        if typ == 'RETURN':
+            raise FLUX.ReturnException(self.eval(node[1]))
+        if typ == 'CALL':
+            name, args = node[1], node[2]
+            arg_vals = [self.eval(a) for a in args]
+            if name not in self.functions:
+                raise Exception(f"Function '{name}' not defined")
+            func = self.functions[name]
+            params, body = func.params, func.body
+            if len(arg_vals) != len(params):
+                raise Exception(f"Argument count mismatch in call to {name}")
+            new_env = {}
+            for (ptype,pname), val in zip(params, arg_vals):
+                new_env[pname] = val
+            self.envs.append(new_env)
+            ret_val = None
+            try:
+                for stmt in body:
+                    self.exec(stmt)
+            except FLUX.ReturnException as re:
+                ret_val = re.value
+            self.envs.pop()
+            return ret_val
+        return super().exec(node)
+
+
+ENGINES = [
+    ('before (tree, exceptions)', ExceptionCallInterpreter, 0),
+    ('after  (tree)', FLUX.Interpreter, 0),
+    ('after  (tree, tiered)', FLUX.Interpreter, FLUX.TIER_THRESHOLD),
+    ('after  (closure)', FLUX.ClosureInterpreter, 0),
+    ('after  (vm)', FLUX.VirtualMachine, 0),
+]
+
+
+def best_time(engine, tier_threshold, ast, repeat):
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Memoization would skip the calls being measured
+            interp = engine(memo_size=0, tier_threshold=tier_threshold)
+            t = time.perf_counter()
+            interp.eval(ast)
+            t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--repeat', type=int, default=5)
+    args = argp.parse_args()
+    workloads = [
+        ('flat add()', FLAT, FLAT_CALLS),
+        (f'fib({FIB_N})', FIB, fib_calls(FIB_N)),
+    ]
+    print(f"{'engine':<28}{'workload':<12}{'calls/s':>14}")
+    for wname, source, ncalls in workloads:
+        ast = FLUX.Parser(FLUX.Lexer(source).tokenize()).parse_program()
+        for ename, engine, tier_threshold in ENGINES:
+            t = best_time(engine, tier_threshold, ast, args.repeat)
+            print(f"{ename:<28}{wname:<12}{ncalls / t:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
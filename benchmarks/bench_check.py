@@ -0,0 +1,78 @@
+"""--check: time to check a generated tree of .fx files, cold and cached.
+
+Writes --files scripts (a few functions and loops each, one in every
+--bad with a syntax error) under a temporary directory, in subdirectories
+of 100, and times FLUX.check_paths on it: with one worker, with --workers,
+and again with the cache all of it is then in. Then one file in every 100
+is changed and the check is timed once more.
+
+    python benchmarks/bench_check.py [--files N] [--workers N] [--bad N]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+def gen_script(k, bad):
+    lines = []
+    for f in range(5):
+        lines += [f"function f{f}(int a)",
+                  "    int v = a",
+                  f"    for i = 0 in {k % 7 + 3}",
+                  f"        v = v * {f + 2} - i",
+                  "    end for",
+                  "    return v",
+                  "end function"]
+    lines.append(f'print << "{k}: " << f0({k}) + f4(2) << "\\n"')
+    if bad:
+        lines.append("int broken = (1 +")
+    return '\n'.join(lines) + '\n'
+
+
+def timed(root, workers, cache_file):
+    t = time.perf_counter()
+    results, cached = FLUX.check_paths([root], 1, workers, cache_file)
+    t = time.perf_counter() - t
+    errors = sum(len(e) for _, e in results)
+    return t, len(results), cached, errors
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--files', type=int, default=10000)
+    argp.add_argument('--workers', type=int, default=FLUX.PARALLEL_WORKERS)
+    argp.add_argument('--bad', type=int, default=50, metavar='N',
+                      help='every Nth file has a syntax error')
+    args = argp.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        paths = []
+        for k in range(args.files):
+            directory = os.path.join(root, f"d{k // 100}")
+            os.makedirs(directory, exist_ok=True)
+            paths.append(os.path.join(directory, f"s{k}.fx"))
+            with open(paths[-1], 'w') as f:
+                f.write(gen_script(k, k % args.bad == 0))
+        cache_file = os.path.join(root, FLUX.CACHE_DIRNAME, FLUX.CHECK_CACHE_NAME)
+        print(f"{'run':<24}{'seconds':>10}{'files':>8}{'cached':>8}{'errors':>8}")
+        runs = [('cold, 1 worker', 1, None),
+                (f'cold, {args.workers} workers', args.workers, cache_file),
+                ('cached', args.workers, cache_file)]
+        for label, workers, cache in runs:
+            print(f"{label:<24}{'%10.2f%8d%8d%8d' % timed(root, workers, cache)}")
+        for path in paths[::100]:
+            with open(path, 'a') as f:
+                f.write("print << 1\n")
+        print(f"{'1% changed':<24}{'%10.2f%8d%8d%8d' % timed(root, args.workers, cache_file)}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Embedding throughput: small scripts run per second, in process.
+
+"fresh" is what embedding cost before: lex, parse, optimize and a new
+Interpreter for every run. "compile+run" goes through FLUX.compile(), whose
+LRU hands back the already compiled Program, and Program.run(), which
+reuses a pooled interpreter and returns the output as a string.
+
+    python benchmarks/bench_embed.py [--backend B] [--runs N]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+SCRIPTS = [
+    'int x = n * 3\nprint << "x = " << x << "\\n"\n',
+    'string s = ""\nfor i = 0 in n\n    s += i\nend for\nprint << s << "\\n"\n',
+    'function sq(int v)\n    return v * v\nend function\nprint << sq(n) + 1 << "\\n"\n',
+]
+
+
+def fresh(source, backend, n):
+    stream = io.StringIO()
+    out = FLUX.Output(stream)
+    interp = FLUX.BACKENDS[backend](out)
+    interp.global_vars['n'] = n
+    interp.eval(FLUX.parse_source(source))
+    out.flush()
+    return stream.getvalue()
+
+
+def embedded(source, backend, n):
+    return FLUX.compile(source, backend, globals=['n']).run({'n': n})
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--backend', choices=sorted(FLUX.BACKENDS), default='tree')
+    argp.add_argument('--runs', type=int, default=3000)
+    args = argp.parse_args()
+    print(f"{'mode':<14}{'runs/s':>12}")
+    for label, fn in (('fresh', fresh), ('compile+run', embedded)):
+        t = time.perf_counter()
+        for k in range(args.runs):
+            text = fn(SCRIPTS[k % len(SCRIPTS)], args.backend, k % 20)
+        t = time.perf_counter() - t
+        assert text == fresh(SCRIPTS[(args.runs - 1) % len(SCRIPTS)], args.backend,
+                             (args.runs - 1) % 20)
+        print(f"{label:<14}{args.runs / t:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Intrinsics: calls of functions written in Python against FLUX versions.
+
+Times loops of --calls calls, through FLUX.compile(), on every backend:
+abs() against a FLUX function doing the same, find() against a FLUX
+search over slices, and to_int() against a FLUX digit loop, best of three
+runs each. The last column is the same loop calling a function registered by the host with
+FLUX.register_intrinsic.
+
+    python benchmarks/bench_intrinsics.py [--calls N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+FLUX_FUNCTIONS = '''
+function my_abs(int x)
+    if x < 0
+        return -x
+    end if
+    return x
+end function
+function my_find(string s, string sub)
+    int n = len(sub)
+    for i = 0 in len(s) - n + 1
+        if s[i:i + n] == sub
+            return i
+        end if
+    end for
+    return -1
+end function
+function my_to_int(string s)
+    int v = 0
+    for i = 0 in len(s)
+        v = v * 10 + find("0123456789", s[i:i + 1])
+    end for
+    return v
+end function
+'''
+
+# name -> (call of the intrinsic, call of the FLUX function)
+CASES = {
+    'abs': ('abs(i - 500)', 'my_abs(i - 500)'),
+    'find': ('find("the quick brown fox jumps", "jumps")',
+             'my_find("the quick brown fox jumps", "jumps")'),
+    'to_int': ('to_int("123456")', 'my_to_int("123456")'),
+}
+
+
+def loop(call):
+    return FLUX_FUNCTIONS + f'int t = 0\nfor i = 0 in n\n    t += {call}\nend for\n'
+
+
+def timed(source, backend, n, repeat=3):
+    # Best of `repeat` runs, after one that prepares an interpreter
+    program = FLUX.compile(source, backend, globals=['n'])
+    program.run({'n': 1})
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        program.run({'n': n})
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--calls', type=int, default=100000)
+    args = argp.parse_args()
+    n = args.calls
+    FLUX.register_intrinsic('host_abs', abs, 1, pure=True)
+    print(f"ns per call, {n} calls")
+    print(f"{'backend':<10}" + ''.join(f"{name:>10}{'flux':>10}" for name in CASES)
+          + f"{'host_abs':>10}")
+    for backend in sorted(FLUX.BACKENDS):
+        row = ''
+        for native, written in CASES.values():
+            row += f"{timed(loop(native), backend, n) / n * 1e9:>10.0f}"
+            row += f"{timed(loop(written), backend, n) / n * 1e9:>10.0f}"
+        row += f"{timed(loop('host_abs(i - 500)'), backend, n) / n * 1e9:>10.0f}"
+        print(f"{backend:<10}{row}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Maps: build, lookup, `in` and iteration times and memory at 1M entries.
+
+For int keys (i) and string keys ("k" + i) it times FLUX programs, run
+through FLUX.compile(), that build a map of --entries entries with m[k] = v,
+read every entry back with m[k], test every key (half of them missing) with
+`in` and walk the keys with `for k in m`. The map the lookups run on is
+built once and handed in as a global. Times are the best of --repeat runs,
+and per entry have the same loop without the map operation taken off.
+Memory per entry is what one traced build holds once it is done: the map,
+its keys and, for string keys, the room they take in the interned string
+table.
+
+    python benchmarks/bench_map.py [--backend B] [--entries N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+# Key expression and a declaration for a variable holding one
+KEYS = {'int': ('i', 'int k = 0'), 'string': ('"k" + i', 'string k = ""')}
+
+# Each one runs with globals n and m; KEY is the key expression
+LOOPS = {
+    'empty': 'DECL\nfor i = 0 in n\n    k = KEY\nend for\n',
+    'build': 'map b = {}\nfor i = 0 in n\n    b[KEY] = i\nend for\n',
+    'lookup': 'int s = 0\nfor i = 0 in n\n    s += m[KEY]\nend for\n',
+    'in': 'int s = 0\nfor i = 0 in n * 2\n    if KEY in m\n        s += 1\n    end if\nend for\n',
+}
+EACH = 'int s = 0\nfor k in m\n    s += 1\nend for\n'
+
+
+def timed(source, backend, n, m, repeat):
+    program = FLUX.compile(source, backend, globals=['n', 'm'])
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        program.run({'n': n, 'm': m})
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def build_bytes(key, backend, n):
+    # The build program holds its map in b after the run; a first run with
+    # n = 0 makes the interpreter, so only the map is traced. Runs before
+    # anything else has made (and interned) the keys.
+    program = FLUX.compile(LOOPS['build'].replace('KEY', key), backend, globals=['n', 'm'])
+    program.run({'n': 0, 'm': FLUX.FluxMap()})
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        program.run({'n': n, 'm': FLUX.FluxMap()})
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--backend', choices=sorted(FLUX.BACKENDS), default='tree')
+    argp.add_argument('--entries', type=int, default=1_000_000)
+    argp.add_argument('--repeat', type=int, default=3)
+    args = argp.parse_args()
+    n = args.entries
+    print(f"{n} entries, {args.backend} backend, ns per entry")
+    print(f"{'keys':<8}{'build':>10}{'lookup':>10}{'in':>10}{'for in':>10}{'B/entry':>10}")
+    for label, (key, decl) in KEYS.items():
+        size = build_bytes(key, args.backend, n) / n
+        m = FLUX.make_map([x for i in range(n) for x in ((i if label == 'int' else f"k{i}"), i)])
+        empty = timed(LOOPS['empty'].replace('KEY', key).replace('DECL', decl),
+                      args.backend, n, m, args.repeat)
+        times = {}
+        for name in ('build', 'lookup', 'in'):
+            loops = 2 if name == 'in' else 1
+            t = timed(LOOPS[name].replace('KEY', key), args.backend, n, m, args.repeat)
+            times[name] = (t - empty * loops) / (n * loops) * 1e9
+        times['each'] = timed(EACH, args.backend, n, m, args.repeat) / n * 1e9
+        del m
+        print(f"{label:<8}{times['build']:>10.0f}{times['lookup']:>10.0f}{times['in']:>10.0f}"
+              f"{times['each']:>10.0f}{size:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
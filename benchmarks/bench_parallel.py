@@ -0,0 +1,62 @@
+"""parallel for scaling: wall time of workloads/parallel.fx by worker count.
+
+Every row runs the same program with Interpreter.workers set to N; 1 is a
+plain sequential run. The output of every run is compared against it, so
+the numbers are only printed for runs that match exactly. Speedups need
+as many free cores as workers (os.cpu_count() is printed first).
+
+    python benchmarks/bench_parallel.py [--backend B] [--workers N ...] [--repeat N]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+WORKLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workloads', 'parallel.fx')
+
+
+def run(engine, ast, workers):
+    stream = io.StringIO()
+    out = FLUX.Output(stream)
+    interp = engine(out)
+    interp.workers = workers
+    t = time.perf_counter()
+    interp.eval(ast)
+    out.flush()
+    return time.perf_counter() - t, stream.getvalue()
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--backend', choices=sorted(FLUX.BACKENDS), default='tree')
+    argp.add_argument('--workers', type=int, nargs='+', metavar='N',
+                      default=sorted({1, 2, 4, cpus}))
+    argp.add_argument('--repeat', type=int, default=3)
+    args = argp.parse_args()
+
+    engine = FLUX.BACKENDS[args.backend]
+    with open(WORKLOAD, encoding='utf-8') as f:
+        ast = FLUX.parse_source(f.read())
+    print(f"{cpus} CPUs, backend {args.backend}")
+    print(f"{'workers':>8}{'best ms':>12}{'speedup':>10}")
+    _, expected = run(engine, ast, 1)
+    base = None
+    for workers in args.workers:
+        best = None
+        for _ in range(args.repeat):
+            t, text = run(engine, ast, workers)
+            if text != expected:
+                raise SystemExit(f"output with {workers} workers differs from the sequential run")
+            best = t if best is None else min(best, t)
+        base = base or best
+        print(f"{workers:>8}{best * 1000:>12.1f}{base / best:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""REPL: time per input as the session grows.
+
+Feeds a session (Interpreter.streamer, what FLUX.py without a program runs)
+--defs function definitions, in chains of CHAIN each calling the one
+before, plus a global per definition. At every checkpoint it times a few
+inputs of each kind: a new definition, a call, a redefinition of an early
+function (whose callers all lose their memoized results) and a global
+assignment. Each input goes through the lexer and parser on its own, as
+typed.
+
+    python benchmarks/bench_repl.py [--backend B] [--defs N] [--samples N]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+CHAIN = 20
+
+
+def definition(k):
+    call = f"f{k - 1}(a) + 1" if k % CHAIN else "a"
+    return f"int g{k} = {k}\nfunction f{k}(int a)\n    return {call}\nend function\n"
+
+
+def feed_text(feed, text):
+    for node in FLUX.Parser(FLUX.Lexer(text).tokens()).statements():
+        feed(node)
+
+
+def timed(feed, texts):
+    times = []
+    for text in texts:
+        t = time.perf_counter()
+        feed_text(feed, text)
+        times.append(time.perf_counter() - t)
+    return statistics.median(times) * 1000
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--backend', choices=sorted(FLUX.BACKENDS), default='tree')
+    argp.add_argument('--defs', type=int, default=5000)
+    argp.add_argument('--samples', type=int, default=20)
+    args = argp.parse_args()
+    interp = FLUX.BACKENDS[args.backend](FLUX.Output(io.StringIO(), 0))
+    feed = interp.streamer()
+    checkpoints = sorted({0, args.defs // 10, args.defs // 2, args.defs})
+    print(f"{'defs':>8}{'define ms':>12}{'call ms':>12}{'redefine ms':>14}{'assign ms':>12}")
+    n = 0
+    for checkpoint in checkpoints:
+        while n < checkpoint:
+            feed_text(feed, definition(n))
+            n += 1
+        extra = [f"function h{n}_{i}(int a)\n    return a * {i}\nend function\n"
+                 for i in range(args.samples)]
+        calls = [f"int r = f{max(n - 1, 0)}({i})\n" if n else f"int r = {i}\n"
+                 for i in range(args.samples)]
+        redefs = [f"function f0(int a)\n    return a + {i}\nend function\n"
+                  for i in range(args.samples)]
+        assigns = [f"g0 = {i}\n" if n else f"int g0 = {i}\n" for i in range(args.samples)]
+        print(f"{n:>8}{timed(feed, extra):>12.3f}{timed(feed, calls):>12.3f}"
+              f"{timed(feed, redefs):>14.3f}{timed(feed, assigns):>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
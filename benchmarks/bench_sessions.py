@@ -0,0 +1,106 @@
+"""Async sessions load test: many simulated clients on one event loop.
+
+Starts FLUX.serve() in process on a free local port, running an echo
+program that does a little work per line. Then it opens --clients
+connections at once; each one sends --lines lines and waits for every
+reply. One extra "hog" session runs a long loop the whole time. Because
+sessions yield every ASYNC_TICKS loop iterations and calls, the hog only
+adds a bounded delay to everyone else's replies, and does not stall them.
+
+    python benchmarks/bench_sessions.py [--clients N] [--lines N] [--work N]
+                                        [--ticks N] [--no-hog]
+
+The server can also be run on its own: python FLUX.py --serve 8000 prog.fx
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+ECHO = """
+string line = input << "> "
+while line != "quit"
+    int n = 0
+    for i = 0 in {work}
+        n += i
+    end for
+    print << "echo " << line << " " << n << "\\n"
+    line = input << "> "
+end while
+print << "bye\\n"
+"""
+
+HOG = """
+int n = 0
+for i = 0 in 3000000
+    n += i
+end for
+print << n << "\\n"
+"""
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+async def client(port, nlines, work, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    expected = work * (work - 1) // 2
+    await reader.readuntil(b'> ')
+    for k in range(nlines):
+        t = time.perf_counter()
+        writer.write(f"line{k}\n".encode())
+        reply = await reader.readuntil(b'> ')
+        latencies.append(time.perf_counter() - t)
+        if reply != f"echo line{k} {expected}\n> ".encode():
+            raise SystemExit(f"unexpected reply {reply!r}")
+    writer.write(b"quit\n")
+    if await reader.read() != b"bye\n":
+        raise SystemExit("missing bye")
+    writer.close()
+
+
+async def hog(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await reader.read()
+    writer.close()
+
+
+async def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--clients', type=int, default=1000)
+    argp.add_argument('--lines', type=int, default=5)
+    argp.add_argument('--work', type=int, default=200, help='loop iterations per line')
+    argp.add_argument('--ticks', type=int, default=FLUX.ASYNC_TICKS)
+    argp.add_argument('--no-hog', action='store_true')
+    args = argp.parse_args()
+
+    server = await FLUX.serve(FLUX.parse_source(ECHO.format(work=args.work)), ticks=args.ticks)
+    port = server.sockets[0].getsockname()[1]
+    hog_task = None
+    if not args.no_hog:
+        hog_server = await FLUX.serve(FLUX.parse_source(HOG), ticks=args.ticks)
+        hog_task = asyncio.ensure_future(hog(hog_server.sockets[0].getsockname()[1]))
+    latencies = []
+    t = time.perf_counter()
+    await asyncio.gather(*(client(port, args.lines, args.work, latencies)
+                           for _ in range(args.clients)))
+    t = time.perf_counter() - t
+    if hog_task is not None:
+        hog_task.cancel()
+    print(f"{args.clients} sessions, {len(latencies)} exchanges in {t:.2f}s "
+          f"({len(latencies) / t:,.0f}/s){'' if args.no_hog else ', with a hog session'}")
+    print(f"reply latency ms: p50 {percentile(latencies, 50) * 1000:.1f}  "
+          f"p90 {percentile(latencies, 90) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 99) * 1000:.1f}  max {max(latencies) * 1000:.1f}")
+    server.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""Streaming: time to first output and peak memory on a large generated script.
+
+"batch" is a normal run: the whole file is read and parsed before anything
+runs. "stream" runs each top-level statement as soon as it is parsed
+(FLUX.py --stream, or a program piped into FLUX.py -). The script is
+--blocks function definitions, each followed by a print of a call to it.
+Output is unbuffered, so the first print is seen when it runs. Peak memory
+comes from one extra, traced run with tracemalloc.
+
+    python benchmarks/bench_stream.py [--backend B] [--blocks N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+def gen_script(blocks, nstmts=10):
+    lines = []
+    for f in range(blocks):
+        lines.append(f"function f{f}(int a)")
+        lines.append("    int v = a")
+        for k in range(nstmts):
+            lines.append(f"    v = v * {k + 2} - (a / {k + 1}) + {k}")
+        lines.append("    return v")
+        lines.append("end function")
+        lines.append(f'print << "f{f}: " << f{f}({f}) << "\\n"')
+    return '\n'.join(lines) + '\n'
+
+
+class Sink:
+    # Output stream that notes when the first text arrives
+    def __init__(self):
+        self.first = None
+    def write(self, text):
+        if self.first is None:
+            self.first = time.perf_counter()
+    def flush(self):
+        pass
+
+
+def batch(path, interp):
+    with open(path) as f:
+        interp.eval(FLUX.parse_source(f.read()))
+
+
+def stream(path, interp):
+    with open(path) as f:
+        interp.stream(FLUX.Parser(FLUX.Lexer(f).tokens()).statements())
+
+
+def measure(fn, path, backend):
+    sink = Sink()
+    interp = FLUX.BACKENDS[backend](FLUX.Output(sink, 0))
+    t = time.perf_counter()
+    fn(path, interp)
+    end = time.perf_counter()
+    return sink.first - t, end - t
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--backend', choices=sorted(FLUX.BACKENDS), default='tree')
+    argp.add_argument('--blocks', type=int, default=20000)
+    args = argp.parse_args()
+    with tempfile.NamedTemporaryFile('w', suffix='.fx', delete=False) as f:
+        f.write(gen_script(args.blocks))
+        path = f.name
+    try:
+        print(f"{os.path.getsize(path) / 1e6:.1f} MB of source, {args.blocks} functions")
+        print(f"{'mode':<10}{'first ms':>12}{'total ms':>12}{'peak MiB':>12}")
+        for label, fn in (('batch', batch), ('stream', stream)):
+            first, total = measure(fn, path, args.backend)
+            tracemalloc.start()
+            try:
+                measure(fn, path, args.backend)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            print(f"{label:<10}{first * 1000:>12.1f}{total * 1000:>12.1f}{peak / 2 ** 20:>12.1f}")
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
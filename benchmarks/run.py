@@ -0,0 +1,258 @@
+"""Benchmark suite: per-phase timings for the workloads in benchmarks/workloads.
+
+Each workload is run --repeat times and timed in three phases: lex
+(Lexer.tokenize), parse (Parser.parse_program plus the -O optimizer) and
+execute (Interpreter.eval, which for the closure and vm backends includes
+resolving and compiling). Print output goes to os.devnull. Peak memory of
+one extra, traced run is measured with tracemalloc, and so is the size of
+the AST: the bytes it holds once parsed (streaming the tokens, as
+FLUX.py does) per node, shared nodes counted once in the bytes but at
+every use in the nodes.
+
+Besides the .fx files, two sources are generated: `gen_large` (many
+functions and statements, a lexer/parser stress test) and `gen_deep`
+(deeply nested ifs).
+
+    python benchmarks/run.py [--backend B] [-O N] [--repeat N] [--only NAME ...]
+                             [--workers N] [--meter] [--save FILE]
+                             [--baseline FILE] [--threshold PCT]
+
+--workers sets the processes `parallel for` loops run on (default: the CPU
+count, like FLUX.py); compare runs with --workers 1 to see the scaling.
+
+--meter runs every workload under a FLUX.Meter with limits it never
+reaches, to measure what metering costs.
+
+--save writes the results as a JSON baseline. --baseline compares against
+one and exits with status 1 if any phase median got slower, or the AST
+bigger per node, by more than --threshold percent.
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FLUX  # noqa: E402
+
+
+WORKLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workloads')
+PHASES = ('lex', 'parse', 'execute')
+# Phase medians below this many seconds are too noisy to call regressions
+MIN_COMPARE = 0.001
+
+
+def gen_large(nfuncs=400, nstmts=25):
+    lines = []
+    for f in range(nfuncs):
+        lines.append(f"function f{f}(int a, float b, string s)")
+        for k in range(nstmts):
+            lines.append(f"    int v{k} = a * {k} + {k}.5 - (a / {k + 1})")
+        lines.append(f"    s += \"x{f}\"  # comment {f}")
+        lines.append("    return v0 + b")
+        lines.append("end function")
+    lines.append('print << f0(1, 2.0, "s") << "\\n"')
+    return '\n'.join(lines) + '\n'
+
+
+def gen_deep(depth=60, n=2000):
+    lines = ["int hits = 0", f"for i = 0 in {n}"]
+    for d in range(depth):
+        lines.append("    " * (d + 1) + f"if i > {d - 1}")
+    lines.append("    " * (depth + 1) + "hits += 1")
+    for d in reversed(range(depth)):
+        lines.append("    " * (d + 1) + "end if")
+    lines += ["end for", 'print << hits << "\\n"']
+    return '\n'.join(lines) + '\n'
+
+
+def load_workloads(only):
+    workloads = {}
+    for path in sorted(glob.glob(os.path.join(WORKLOAD_DIR, '*.fx'))):
+        with open(path, encoding='utf-8') as f:
+            workloads[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    workloads['gen_large'] = gen_large()
+    workloads['gen_deep'] = gen_deep()
+    if only:
+        missing = set(only) - set(workloads)
+        if missing:
+            raise SystemExit(f"unknown workload(s): {', '.join(sorted(missing))}")
+        workloads = {name: workloads[name] for name in only}
+    return workloads
+
+
+# Limits --meter runs with: all set, none reached
+METER_LIMITS = dict(max_steps=10 ** 12, timeout=3600, max_depth=10 ** 6,
+                    max_output=10 ** 12, max_string=10 ** 12)
+
+
+def run_once(source, engine, opt_level, sink, workers, meter):
+    times = {}
+    t = time.perf_counter()
+    tokens = FLUX.Lexer(source).tokenize()
+    times['lex'] = time.perf_counter() - t
+    t = time.perf_counter()
+    ast = FLUX.Optimizer(opt_level).optimize(FLUX.Parser(tokens).parse_program())
+    times['parse'] = time.perf_counter() - t
+    out = FLUX.Output(sink)
+    interp = engine(out)
+    interp.workers = workers
+    if meter:
+        interp.meter = FLUX.Meter(**METER_LIMITS)
+    t = time.perf_counter()
+    interp.eval(ast)
+    out.flush()
+    times['execute'] = time.perf_counter() - t
+    return times
+
+
+def count_nodes(node):
+    # Tagged tuples; a leaf shared between several places counts at each
+    if isinstance(node, tuple) and node and isinstance(node[0], str) and node[0].isupper():
+        return 1 + sum(count_nodes(child) for child in node[1:])
+    if isinstance(node, (list, tuple)):
+        return sum(count_nodes(child) for child in node)
+    return 0
+
+
+def ast_size(source, opt_level):
+    # Bytes per node the optimized AST holds, tokens and all else freed. A
+    # first, untraced parse keeps one-time allocations out of it.
+    FLUX.parse_source(source, opt_level)
+    tracemalloc.start()
+    try:
+        ast = FLUX.parse_source(source, opt_level)
+        held = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return held / count_nodes(ast)
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def summarize(samples):
+    return {
+        'median': statistics.median(samples),
+        'p90': percentile(samples, 90),
+        'min': min(samples),
+        'max': max(samples),
+    }
+
+
+def bench(source, engine, opt_level, repeat, sink, workers, meter):
+    samples = {phase: [] for phase in PHASES}
+    for _ in range(repeat):
+        for phase, t in run_once(source, engine, opt_level, sink, workers, meter).items():
+            samples[phase].append(t)
+    result = {phase: summarize(samples[phase]) for phase in PHASES}
+    tracemalloc.start()
+    try:
+        run_once(source, engine, opt_level, sink, workers, meter)
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+    result['bytes_per_node'] = ast_size(source, opt_level)
+    return result
+
+
+def compare(results, baseline, threshold):
+    # Returns the (workload, phase, old, new) entries that regressed; the
+    # AST size is the phase 'B/node'
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        for phase in PHASES:
+            before, after = old[phase]['median'], result[phase]['median']
+            if after < MIN_COMPARE or before <= 0:
+                continue
+            if after > before * (1 + threshold / 100):
+                regressions.append((name, phase, before, after))
+        before = old.get('bytes_per_node')
+        if before and result['bytes_per_node'] > before * (1 + threshold / 100):
+            regressions.append((name, 'B/node', before, result['bytes_per_node']))
+    return regressions
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--backend', choices=sorted(FLUX.BACKENDS), default='tree')
+    argp.add_argument('-O', dest='opt_level', type=int, choices=(0, 1, 2), default=1)
+    argp.add_argument('--repeat', type=int, default=5)
+    argp.add_argument('--only', nargs='+', metavar='NAME', help='run only these workloads')
+    argp.add_argument('--workers', type=int, default=FLUX.PARALLEL_WORKERS, metavar='N',
+                      help='processes for parallel for loops (default: the CPU count)')
+    argp.add_argument('--meter', action='store_true',
+                      help='run under a Meter whose limits are never reached')
+    argp.add_argument('--save', metavar='FILE', help='write results as a JSON baseline')
+    argp.add_argument('--baseline', metavar='FILE', help='compare against a saved baseline')
+    argp.add_argument('--threshold', type=float, default=10.0, metavar='PCT',
+                      help='slowdown in percent that counts as a regression (default: 10)')
+    args = argp.parse_args()
+
+    engine = FLUX.BACKENDS[args.backend]
+    workloads = load_workloads(args.only)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print(f"{'workload':<12}" + ''.join(f"{p + ' med':>12}{p + ' p90':>12}" for p in PHASES)
+          + f"{'peak KiB':>10}{'B/node':>8}")
+    results = {}
+    with open(os.devnull, 'w') as sink:
+        for name, source in workloads.items():
+            result = results[name] = bench(source, engine, args.opt_level, args.repeat, sink,
+                                           args.workers, args.meter)
+            row = ''.join(f"{result[p]['median'] * 1000:>10.2f}ms{result[p]['p90'] * 1000:>10.2f}ms"
+                          for p in PHASES)
+            print(f"{name:<12}{row}{result['peak_kb']:>10}{result['bytes_per_node']:>8.1f}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'backend': args.backend,
+                    'opt_level': args.opt_level,
+                    'repeat': args.repeat,
+                    'workers': args.workers,
+                    'meter': args.meter,
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"saved baseline to {args.save}")
+
+    if baseline is not None:
+        meta = baseline.get('meta', {})
+        if (meta.get('backend'), meta.get('opt_level')) != (args.backend, args.opt_level):
+            print(f"note: baseline was taken with --backend {meta.get('backend')} "
+                  f"-O {meta.get('opt_level')}")
+        regressions = compare(results, baseline, args.threshold)
+        for name, phase, before, after in regressions:
+            if phase == 'B/node':
+                change = f"{before:.1f} -> {after:.1f} bytes/node"
+            else:
+                change = f"{before * 1000:.2f}ms -> {after * 1000:.2f}ms"
+            print(f"REGRESSION {name} {phase}: {change} (+{(after / before - 1) * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions over {args.threshold:g}% against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
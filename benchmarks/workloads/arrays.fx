@@ -0,0 +1,7 @@
+# Element-wise array arithmetic and reductions next to an element loop
+float[] a = zeros(100000)
+for i = 0 in len(a)
+    a[i] = i
+end for
+float[] b = a * 2.0 + a
+print << sum(b) << " " << min(b) << " " << max(b[10:20]) << "\n"
@@ -0,0 +1,15 @@
+# Tight while and for loops over scalar locals
+function spin(int n)
+    int i = 0
+    int acc = 0
+    while i < n
+        acc += i * 3 - 1
+        i += 1
+    end while
+    for j = 0 in n
+        acc -= j
+    end for
+    return acc
+end function
+
+print << spin(200000) << "\n"
@@ -0,0 +1,21 @@
+# Keyed lookups: maps with string and int keys, read back, tested with in
+# and walked with for k in m
+map seen = {}
+for i = 0 in 100000
+    seen["k" + i] = i
+end for
+int hits = 0
+for i = 0 in 200000
+    if "k" + i in seen
+        hits += 1
+    end if
+end for
+map squares = {0: 0}
+for i = 1 in 50000
+    squares[i] = squares[i - 1] + 2 * i - 1
+end for
+int total = 0
+for k in squares
+    total += squares[k] - k * k
+end for
+print << len(seen) << " " << hits << " " << len(squares) << " " << total << "\n"
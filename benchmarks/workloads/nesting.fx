@@ -0,0 +1,27 @@
+# Deeply nested blocks and branches inside a loop
+function classify(int n)
+    int hits = 0
+    for i = 0 in n
+        if i > 10
+            if i > 100
+                if i > 1000
+                    if i > 10000
+                        while hits < 0
+                            hits = 0
+                        end while
+                        hits += 4
+                    elif i > 5000
+                        hits += 3
+                    else
+                        hits += 2
+                    end if
+                else
+                    hits += 1
+                end if
+            end if
+        end if
+    end for
+    return hits
+end function
+
+print << classify(60000) << "\n"
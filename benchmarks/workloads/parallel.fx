@@ -0,0 +1,26 @@
+# Independent iterations of a CPU-bound body under parallel for: each one
+# counts the steps of a Collatz walk, and the totals are += reductions.
+function steps(int n)
+    int k = 0
+    while n != 1
+        if n / 2 * 2 == n
+            n = n / 2
+        else
+            n = 3 * n + 1
+        end if
+        k += 1
+    end while
+    return k
+end function
+
+int total = 0
+string marks = ""
+parallel for i = 1 in 2000
+    int s = steps(i)
+    total += s
+    if s > 150
+        marks += i
+        marks += " "
+    end if
+end for
+print << total << "\n" << marks << "\n"
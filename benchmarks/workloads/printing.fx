@@ -0,0 +1,4 @@
+# Print-heavy output: one short line per iteration
+for i = 0 in 100000
+    print << "row " << i << ": " << i * 2 << "\n"
+end for
@@ -0,0 +1,13 @@
+# Call-heavy recursion. The global counter keeps fib impure, so every call
+# really runs instead of coming out of the memo cache.
+int calls = 0
+
+function fib(int n)
+    calls += 1
+    if n < 2
+        return n
+    end if
+    return fib(n - 1) + fib(n - 2)
+end function
+
+print << fib(20) << " in " << calls << " calls\n"
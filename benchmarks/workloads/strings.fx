@@ -0,0 +1,11 @@
+# String accumulation with += and slicing of the result
+function build(int n)
+    string out = ""
+    for i = 0 in n
+        out += "row " + i + ";"
+    end for
+    return out
+end function
+
+string s = build(50000)
+print << s[0:20] << " " << s[-10:] << "\n"
@@ -0,0 +1,87 @@
+"""int[] and float[]: literals, views, element-wise ops and errors.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+class ArrayTest(unittest.TestCase):
+    PROGRAM = '''
+int[] a = [1, 2, 3, 4]
+float[] f = [1, 2.5]
+print << a << " " << f << " " << len(a) << " " << sum(a) << " " << min(a) << " " << max(f) << "\\n"
+int[] b = a[1:3]
+b[0] = 9
+b[1] += 5
+print << a << " " << b << "\\n"
+a[3] = 2.7
+print << a << " " << a + 1 << " " << a * a << " " << a / 2 << " " << 10 - a << " " << -a << "\\n"
+float[] z = zeros(3)
+print << z << " " << a[0] << " " << a[1:2] << "\\n"
+string s = "hello"
+print << s[1] << " " << s[1:3] << "\\n"
+function first(int[] x)
+    return x[0]
+end function
+print << first(a) << " "
+a[0] = 7
+print << first(a) << "\\n"
+'''
+    EXPECTED = ("[1, 2, 3, 4] [1.0, 2.5] 4 10 1 2.5\n"
+                "[1, 9, 8, 4] [9, 8]\n"
+                "[1, 9, 8, 2] [2, 10, 9, 3] [1, 81, 64, 4] [0.5, 4.5, 4.0, 1.0] "
+                "[9, 1, 2, 8] [-1, -9, -8, -2]\n"
+                "[0.0, 0.0, 0.0] 1 [9]\n"
+                "ello el\n"
+                "1 7\n")
+
+    def test_semantics(self):
+        # Views write through; calls with array arguments are not memoized
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(self.PROGRAM, backend), (self.EXPECTED, ''))
+
+    def test_own_len(self):
+        # A program's own function wins over the intrinsic of that name
+        source = ('function len(int[] x)\n    return 42\nend function\n'
+                  'int[] a = [1]\nprint << len(a)\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend), ("42", ''))
+
+    def test_errors(self):
+        cases = [('int[] a = [1, 2]\nint[] b = [1]\nprint << a + b\n', "Array length mismatch"),
+                 ('int[] a = [1, 2]\nprint << a[2]\n', "Array index out of range"),
+                 ('int[] a = [4611686018427387904, 1]\nprint << a * 4\n',
+                  "int[] element out of 64-bit range"),
+                 ('int[] a = [1, 99999999999999999999]\n', "int[] element out of 64-bit range"),
+                 ('int[] a = [1, 2]\na[1] = 9223372036854775807\nprint << a\n'
+                  'a[0] = 99999999999999999999\n', "int[] element out of 64-bit range")]
+        for source, message in cases:
+            for backend in FLUX.BACKENDS:
+                with self.subTest(source=source, backend=backend):
+                    out, err = run(source, backend)
+                    self.assertEqual(err.splitlines()[-1], f"Exception: {message}")
+
+
+if __name__ == '__main__':
+    unittest.main()
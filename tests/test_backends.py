@@ -0,0 +1,178 @@
+"""Programs every backend must run the same way.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, stdin='', *args):
+    # stdout and stderr of FLUX.py running source
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, *args, path],
+                           input=stdin, capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+# name -> (source, expected output)
+PROGRAMS = {
+    'return': ('''
+function sign(int x)
+    if x < 0
+        return -1
+    end if
+    while x > 100
+        return 2
+    end while
+    for i = 0 in 10
+        if i == x
+            return 1
+        end if
+    end for
+    return 0
+end function
+function fact(int n)
+    if n < 2
+        return 1
+    end if
+    return n * fact(n - 1)
+end function
+function nothing()
+    print << "side "
+end function
+print << sign(-5) << " " << sign(500) << " " << sign(3) << " " << sign(50) << "\\n"
+print << fact(20) << "\\n"
+print << nothing() << "effect\\n"
+''', "-1 2 1 0\n2432902008176640000\nside effect\n"),
+    'scoping': ('''
+int g = 1
+function bump()
+    g += 1
+end function
+function shadow(int g)
+    g = g * 10
+    return g
+end function
+function loop_sum(int n)
+    int s = 0
+    for i = 0 in n
+        s += i
+    end for
+    return s
+end function
+bump()
+bump()
+print << g << " " << shadow(5) << " " << g << "\\n"
+print << loop_sum(5) << " " << loop_sum(10) << "\\n"
+if g == 3
+    int inner = 4
+end if
+print << inner << "\\n"
+''', "3 50 3\n10 45\n4\n"),
+    'types': ('''
+int a = 7 / 2
+float f = 3
+string s = 12
+bool b = 0
+print << a << " " << f << " " << s << " " << b << "\\n"
+print << 6 / 3 << " " << 7 / 2 << " " << 1.5 + 1 << " " << "a" + 1 << "\\n"
+s += 3
+s += 4.5
+print << s << " " << s[1:3] << " " << s[0:-1] << "\\n"
+print << 2 < 3 << " " << -a * 2 << "\\n"
+''', "3 3.0 12 False\n2 3.5 2.5 a1\n1234.5 23 1234.\nTrue -6\n"),
+}
+
+
+class ProgramTest(unittest.TestCase):
+    def test_programs(self):
+        for name, (source, expected) in PROGRAMS.items():
+            for backend in FLUX.BACKENDS:
+                with self.subTest(program=name, backend=backend):
+                    self.assertEqual(run(source, backend), (expected, ''))
+
+    def test_flux_code(self):
+        # The sample program, against the tree walker
+        with open(os.path.join(ROOT, 'flux_code.fx')) as f:
+            source = f.read()
+        expected, err = run(source, 'tree', 'ada\n')
+        self.assertEqual(err, '')
+        self.assertIn("hello ada\n10\n200\n", expected)
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend, 'ada\n'), (expected, ''))
+
+    def test_undefined(self):
+        # Every undefined name is reported, before anything runs. A
+        # function sees the globals, not its caller's locals.
+        source = ('int x = 1\nprint << x << "\\n"\nprint << y\n'
+                  'function caller()\n    int mine = 5\n    return peek()\nend function\n'
+                  'function peek()\n    return mine\nend function\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, err = run(source, backend)
+                self.assertEqual(out, '')
+                self.assertIn("Variable 'y' not defined at line 3 (in top level)\n"
+                              "Variable 'mine' not defined at line 9 (in function peek)\n", err)
+
+    def test_global_fallback(self):
+        # A local read before its declaration runs is the global of that name
+        source = ('function f()\n    print << x << "\\n"\nend function\nint x = 3\nf()\n'
+                  'function g()\n    print << late << "\\n"\n    int late = 2\n'
+                  '    print << late << "\\n"\nend function\nint late = 1\ng()\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend), ("3\n1\n2\n", ''))
+
+
+class ReturnTest(unittest.TestCase):
+    def test_statement_call(self):
+        # A call used as a statement is not a return, whatever it returns:
+        # not even the number of the VM's return opcode
+        value = FLUX.OPNAMES.index('RETURN_VALUE')
+        source = (f'function f()\n    return {value}\nend function\n'
+                  'function g()\n    f()\n    return 7\nend function\n'
+                  'f()\nprint << g() << " done\\n"\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend), ("7 done\n", ''))
+
+    def test_top_level(self):
+        # return outside any function ends the program
+        source = 'print << "a\\n"\nreturn 1\nprint << "b\\n"\n'
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend)[0], "a\n")
+
+
+class VMTest(unittest.TestCase):
+    def test_deep_recursion(self):
+        # Calls push VM frames, not Python ones
+        source = ('function down(int n)\n    if n == 0\n        return 0\n    end if\n'
+                  '    return 1 + down(n - 1)\nend function\nprint << down(20000) << "\\n"\n')
+        self.assertEqual(run(source, 'vm'), ("20000\n", ''))
+
+    def test_dis(self):
+        # Prints the code of the program and every function, runs nothing
+        source = 'function twice(int x)\n    return x * 2\nend function\nprint << twice(4)\n'
+        out, err = run(source, 'tree', '', '--dis')
+        self.assertEqual(err, '')
+        self.assertTrue(out.startswith("Disassembly of <program>:\n"))
+        self.assertIn("\nDisassembly of twice(int x):\n", out)
+        self.assertIn(" CALL ", out)
+        self.assertNotIn("8", out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""The benchmark harness: timing summaries, baselines and workloads.
+
+    python -m pytest -q tests
+"""
+import importlib.util
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+spec = importlib.util.spec_from_file_location('bench_run', os.path.join(ROOT, 'benchmarks', 'run.py'))
+bench_run = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench_run)
+
+
+def result(median):
+    return {phase: {'median': median} for phase in bench_run.PHASES}
+
+
+class HarnessTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(10, 0, -1))
+        self.assertEqual(bench_run.percentile(values, 90), 9)
+        self.assertEqual(bench_run.percentile(values, 50), 5)
+        self.assertEqual(bench_run.percentile([3.0], 90), 3.0)
+
+    def test_compare(self):
+        baseline = {'results': {'a': result(0.010), 'b': result(0.010), 'c': result(0.0001)}}
+        results = {'a': result(0.0105), 'b': result(0.012), 'c': result(0.0005),
+                   'new': result(1.0)}
+        # a is within 10%, c is under the noise floor, new has no baseline
+        self.assertEqual(bench_run.compare(results, baseline, 10),
+                         [('b', phase, 0.010, 0.012) for phase in bench_run.PHASES])
+        self.assertEqual(bench_run.compare(results, baseline, 25), [])
+
+    def test_bench(self):
+        source = 'int s = 0\nfor i = 0 in 10\n    s += i\nend for\nprint << s\n'
+        with open(os.devnull, 'w') as sink:
+            res = bench_run.bench(source, FLUX.BACKENDS['vm'], 1, 3, sink, 1, False)
+        self.assertEqual(set(res), set(bench_run.PHASES) | {'peak_kb', 'bytes_per_node'})
+        self.assertGreater(res['bytes_per_node'], 0)
+        for phase in bench_run.PHASES:
+            s = res[phase]
+            self.assertTrue(0 <= s['min'] <= s['median'] <= s['p90'] <= s['max'])
+
+
+class WorkloadTest(unittest.TestCase):
+    def test_load(self):
+        names = set(bench_run.load_workloads(None))
+        self.assertIn('recursion', names)
+        self.assertTrue({'gen_large', 'gen_deep'} <= names)
+        self.assertEqual(list(bench_run.load_workloads(['gen_deep'])), ['gen_deep'])
+        with self.assertRaises(SystemExit):
+            bench_run.load_workloads(['nope'])
+
+    def test_generated(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                stream = io.StringIO()
+                FLUX.BACKENDS[backend](FLUX.Output(stream, 0)).eval(
+                    FLUX.parse_source(bench_run.gen_deep(depth=5, n=10)))
+                self.assertEqual(stream.getvalue(), "6\n")
+                FLUX.parse_source(bench_run.gen_large(nfuncs=3, nstmts=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
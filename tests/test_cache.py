@@ -0,0 +1,81 @@
+"""Hits and misses of the on-disk cache of parsed programs.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+SOURCE = 'int x = 2 * 3\nprint << x << "\\n"\n'
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.program = os.path.join(self.dir.name, 'prog.fx')
+        self.write(SOURCE)
+
+    def write(self, source):
+        with open(self.program, 'w') as f:
+            f.write(source)
+
+    def load(self, parsed, opt_level=1, **kw):
+        # load_program, asserting whether it parsed (a miss) or not (a hit)
+        real = FLUX.parse_source
+        with mock.patch.object(FLUX, 'parse_source', side_effect=real) as parse:
+            ast = FLUX.load_program(self.program, opt_level, **kw)
+        self.assertEqual(parse.called, parsed)
+        return ast
+
+    def test_hit(self):
+        ast = self.load(True)
+        self.assertTrue(os.path.exists(FLUX.cache_path(self.program, 1)))
+        self.assertEqual(self.load(False), ast)
+
+    def test_source_changed(self):
+        self.load(True)
+        self.write(SOURCE.replace('3', '4'))
+        ast = self.load(True)
+        self.assertEqual(self.load(False), ast)
+        self.assertEqual(ast, FLUX.parse_source(SOURCE.replace('3', '4')))
+
+    def test_per_level(self):
+        self.load(True, 1)
+        self.load(True, 0)
+        self.load(False, 0)
+        self.assertNotEqual(FLUX.cache_path(self.program, 0), FLUX.cache_path(self.program, 1))
+
+    def test_bad_entry(self):
+        # A damaged entry is a miss, and is written again
+        self.load(True)
+        path = FLUX.cache_path(self.program, 1)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+        self.load(True)
+        self.load(False)
+
+    def test_no_cache(self):
+        self.load(True, use_cache=False)
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, FLUX.CACHE_DIRNAME)))
+
+    def test_cache_dir(self):
+        # Entries mirror the source tree under cache_dir
+        cache_dir = os.path.join(self.dir.name, 'cache')
+        self.load(True, cache_dir=cache_dir)
+        self.load(False, cache_dir=cache_dir)
+        path = FLUX.cache_path(self.program, 1, cache_dir)
+        self.assertTrue(path.startswith(cache_dir + os.sep))
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, FLUX.CACHE_DIRNAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""--check: where errors are reported, the cache of results, and the output.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+class SourceTest(unittest.TestCase):
+    def test_places(self):
+        cases = [('print << 1\n', []),
+                 ('int x = (1\n', [(1, 11, "Expected RPAREN None. Got Token('NL', None)")]),
+                 ('int x = "a\n', [(1, 9, "Unterminated string")]),
+                 ('int x = 1\nprint << y\nfunction f(int a)\n    return b\nend function\n',
+                  [(2, 0, "Variable 'y' not defined at line 2 (in top level)"),
+                   (4, 0, "Variable 'b' not defined at line 4 (in function f)")])]
+        for source, errors in cases:
+            with self.subTest(source=source):
+                self.assertEqual(FLUX.check_source(source), errors)
+
+
+class PathsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.write('ok.fx', 'int x = 1\nprint << x\n')
+        self.write('sub/undef.fx', 'int x = 1\nprint << y\n')
+        self.write('sub/syntax.fx', 'int x = (1\n')
+        self.write('notes.txt', 'not a program')
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def check(self, *paths):
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'), '--workers', '2',
+                            '--check', *paths], cwd=self.dir.name, capture_output=True, text=True)
+        return p.stdout, p.stderr, p.returncode
+
+    def test_output(self):
+        out, err, code = self.check('.', 'missing.fx')
+        self.assertEqual(out, "./sub/syntax.fx:1:11: Expected RPAREN None. Got Token('NL', None)\n"
+                              "./sub/undef.fx:2:0: Variable 'y' not defined at line 2 (in top level)\n"
+                              "missing.fx:0:0: [Errno 2] No such file or directory: 'missing.fx'\n")
+        self.assertEqual(err, "checked 4 files (0 from the cache), 3 errors\n")
+        self.assertEqual(code, 1)
+        self.assertEqual(self.check('ok.fx'), ('', "checked 1 files (1 from the cache), 0 errors\n", 0))
+
+    def test_cache(self):
+        cache_file = os.path.join(self.dir.name, 'check.fxc')
+        paths = [self.dir.name]
+        results, hits = FLUX.check_paths(paths, workers=1, cache_file=cache_file)
+        self.assertEqual(hits, 0)
+        self.assertEqual([len(errors) for _, errors in results], [0, 1, 1])
+        self.assertEqual(FLUX.check_paths(paths, workers=1, cache_file=cache_file), (results, 3))
+        # Only the changed file is checked again
+        self.write('sub/undef.fx', 'int y = 1\nprint << y\n')
+        results, hits = FLUX.check_paths(paths, workers=1, cache_file=cache_file)
+        self.assertEqual(hits, 2)
+        self.assertEqual([len(errors) for _, errors in results], [0, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""The embedding API: compile() once, run() many times.
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+SOURCE = '''int count = 0
+function sq(int x)
+    return x * x
+end function
+count += n
+string who = input << "name> "
+print << who << " " << count << " " << sq(n) << " " << sum(xs) << "\\n"
+'''
+
+
+class CompileTest(unittest.TestCase):
+    def setUp(self):
+        FLUX.program_cache.clear()
+
+    def test_cached(self):
+        program = FLUX.compile(SOURCE, globals=('n', 'xs'))
+        self.assertIs(FLUX.compile(SOURCE, globals=['xs', 'n']), program)
+        self.assertIsNot(FLUX.compile(SOURCE, 'vm', globals=('n', 'xs')), program)
+        self.assertIsNot(FLUX.compile(SOURCE, opt_level=0, globals=('n', 'xs')), program)
+
+    def test_evicted(self):
+        with mock.patch.object(FLUX, 'PROGRAM_CACHE_SIZE', 2):
+            first = FLUX.compile('print << 1\n')
+            FLUX.compile('print << 2\n')
+            FLUX.compile('print << 1\n')
+            FLUX.compile('print << 3\n')
+            self.assertEqual(len(FLUX.program_cache), 2)
+            self.assertIs(FLUX.compile('print << 1\n'), first)
+
+    def test_static_errors(self):
+        with self.assertRaisesRegex(Exception, r"^Variable 'y' not defined at line 1 \(in top level\)$"):
+            FLUX.compile('print << y\n')
+
+
+class RunTest(unittest.TestCase):
+    def test_runs(self):
+        # Every run starts from fresh globals, and reads only its own stdin
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                program = FLUX.compile(SOURCE, backend, globals=('n', 'xs'))
+                self.assertEqual(program.run({'n': 3, 'xs': [1, 2]}, 'ada\n'), "name> ada 3 9 3\n")
+                self.assertEqual(program.run({'n': 4, 'xs': [1.5]}, 'x'), "name> x 4 16 1.5\n")
+                stdout = io.StringIO()
+                self.assertIsNone(program.run({'n': 1, 'xs': []}, io.StringIO('bo\n'), stdout))
+                self.assertEqual(stdout.getvalue(), "name> bo 1 1 0\n")
+
+    def test_missing_global(self):
+        program = FLUX.compile(SOURCE, globals=('n', 'xs'))
+        with self.assertRaisesRegex(Exception, r"^No value given for global 'xs'$"):
+            program.run({'n': 1})
+        with self.assertRaises(EOFError):
+            program.run({'n': 1, 'xs': []})
+        self.assertEqual(program.run({'n': 2, 'xs': [3]}, 'ok\n'), "name> ok 2 4 3\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Intrinsics: results, shadowing by program functions, and host ones.
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+class ResultTest(unittest.TestCase):
+    PROGRAM = '''print << find("hello", "ll") << " " << find("hello", "z") << " " << to_int("42") + 1
+print << " " << to_float("2.5") * 2 << " " << to_int(3.9) << " " << sqrt(16) << " " << abs(-3)
+print << " " << abs(-2.5) << " " << repeat("ab", 3) << " " << join({1: 2, "k": 3}, ",")
+print << " " << join("abc", "-") << " " << join([1, 2], "+") << " " << min(3, 1, 2)
+print << " " << max(4, 9) << " " << min([5, 2]) << "\\n"
+'''
+
+    def test_same_results(self):
+        expected = "2 -1 43 5.0 3 4.0 3 2.5 ababab 1,k a-b-c 1+2 1 9 2\n"
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(FLUX.compile(self.PROGRAM, backend).run(), expected)
+
+    def test_errors(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                with self.assertRaisesRegex(Exception, "Argument count mismatch in call to find"):
+                    FLUX.compile('print << find("a")\n', backend).run()
+                # Checked before the string is built
+                with self.assertRaisesRegex(FLUX.LimitExceeded, "String length limit of 50"):
+                    FLUX.compile('print << repeat("ab", 10000000000)\n', backend).run(max_string=50)
+
+
+class ShadowTest(unittest.TestCase):
+    SOURCE = 'print << abs(-1)\nfunction abs(int x)\n    return 7\nend function\nprint << abs(-1)\n'
+
+    def test_resolved(self):
+        # Calls of intrinsics no function shadows are bound when resolved
+        stmts = FLUX.Resolver().resolve_program(FLUX.parse_source(self.SOURCE))[1]
+        self.assertEqual(stmts[0][1][0][0], 'CALL')
+        stmts = FLUX.Resolver().resolve_program(FLUX.parse_source('print << abs(-1)\n'))[1]
+        self.assertEqual(stmts[0][1][0][:2], ('INTRINSIC', 'abs'))
+
+    def test_program_function_wins(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                # From where its definition runs, streamed or not
+                self.assertEqual(FLUX.compile(self.SOURCE, backend).run(), "17")
+                out = io.StringIO()
+                interp = FLUX.BACKENDS[backend](FLUX.Output(out, 0))
+                interp.stream(FLUX.Parser(FLUX.Lexer(self.SOURCE).tokens()).statements())
+                self.assertEqual(out.getvalue(), "17")
+
+
+class RegisterTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def host(x):
+            self.calls.append(x)
+            return x * 10
+        FLUX.register_intrinsic('host', host, 1, pure=True)
+        self.addCleanup(FLUX.INTRINSICS.pop, 'host')
+        self.addCleanup(FLUX.PURE_INTRINSICS.discard, 'host')
+
+    def test_host(self):
+        # A pure host function leaves its callers memoizable
+        source = ('function f(int x)\n    return host(x) + 1\nend function\n'
+                  'print << f(2) << " " << f(2) << " " << host(3)\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                del self.calls[:]
+                self.assertEqual(FLUX.compile(source, backend).run(), "21 21 30")
+                self.assertEqual(self.calls, [2, 3])
+
+    def test_bad_name(self):
+        with self.assertRaisesRegex(Exception, "Invalid intrinsic name 'for'"):
+            FLUX.register_intrinsic('for', abs)
+
+
+if __name__ == '__main__':
+    unittest.main()
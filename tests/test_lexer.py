@@ -0,0 +1,85 @@
+"""Tokens the lexer produces, where it places them, and its errors.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def tokens(source):
+    return [(t.type, t.value, t.line, t.col) for t in FLUX.Lexer(source).tokenize()]
+
+
+class TokenTest(unittest.TestCase):
+    def test_stream(self):
+        source = ('int x = 3\nfloat y=2.50 # c\nif x >= 1 and true\n'
+                  '  print << "a\\nb\\"c\\q" << x[0:-1]\nend if\ns += "two\nlines" != y\n')
+        self.assertEqual(tokens(source), [
+            ('TYPE', 'int', 1, 1), ('IDENT', 'x', 1, 5), ('EQ', '=', 1, 7),
+            ('NUMBER', 3, 1, 9), ('NL', None, 1, 10),
+            ('TYPE', 'float', 2, 1), ('IDENT', 'y', 2, 7), ('EQ', '=', 2, 8),
+            ('NUMBER', 2.5, 2, 9), ('NL', None, 2, 17),
+            ('KEYWORD', 'if', 3, 1), ('IDENT', 'x', 3, 4), ('GT', '>', 3, 6),
+            ('EQ', '=', 3, 7), ('NUMBER', 1, 3, 9), ('IDENT', 'and', 3, 11),
+            ('BOOL', True, 3, 15), ('NL', None, 3, 19),
+            ('KEYWORD', 'print', 4, 3), ('LSHIFT', '<<', 4, 9),
+            ('STRING', 'a\nb"c\\q', 4, 12), ('LSHIFT', '<<', 4, 24), ('IDENT', 'x', 4, 27),
+            ('LBRACKET', '[', 4, 28), ('NUMBER', 0, 4, 29), ('COLON', ':', 4, 30),
+            ('MINUS', '-', 4, 31), ('NUMBER', 1, 4, 32), ('RBRACKET', ']', 4, 33),
+            ('NL', None, 4, 34),
+            ('KEYWORD', 'end', 5, 1), ('KEYWORD', 'if', 5, 5), ('NL', None, 5, 7),
+            ('IDENT', 's', 6, 1), ('PLUSEQ', '+=', 6, 3), ('STRING', 'two\nlines', 6, 6),
+            ('NOTEQ', '!=', 7, 8), ('IDENT', 'y', 7, 11), ('NL', None, 7, 12),
+            ('EOF', None, 8, 1),
+        ])
+
+    def test_positions(self):
+        # Every name and operator of the sample program is where its
+        # line and col say
+        with open(os.path.join(ROOT, 'flux_code.fx')) as f:
+            source = f.read()
+        lines = source.split('\n')
+        for typ, value, line, col in tokens(source):
+            if typ in ('IDENT', 'KEYWORD', 'TYPE') or typ in FLUX.OPERATORS.values():
+                self.assertEqual(lines[line - 1][col - 1:col - 1 + len(value)], value)
+
+
+class StreamTest(unittest.TestCase):
+    def test_lazy(self):
+        # Nothing past the tokens taken is lexed, so a bad character late in
+        # the source is only reported when the stream gets there
+        stream = FLUX.Lexer('int x = 1\nx = @\n').tokens()
+        self.assertEqual([next(stream).value for _ in range(4)], ['int', 'x', '=', 1])
+        with self.assertRaisesRegex(Exception, "Unexpected character: @"):
+            list(stream)
+
+    def test_shared(self):
+        # Each distinct name and constant is made once
+        source = 'string long_name = "abc"\nlong_name = "abc" + long_name\nint n = 123456\nn = 123456\n'
+        toks = FLUX.Lexer(source).tokenize()
+        values = {}
+        for t in toks:
+            if t.type in ('IDENT', 'STRING', 'NUMBER'):
+                self.assertIs(values.setdefault((t.type, t.value), t.value), t.value)
+        self.assertEqual(len(values), 4)
+
+
+class ErrorTest(unittest.TestCase):
+    def test_errors(self):
+        cases = [('int x = 1.2.3\n', "Invalid number", 1, 9),
+                 ('print << "abc\n', "Unterminated string", 1, 10),
+                 ('int x = 1\nx = @\n', "Unexpected character: @", 2, 5)]
+        for source, message, line, col in cases:
+            with self.subTest(source=source):
+                with self.assertRaisesRegex(FLUX.SourceError, message) as cm:
+                    tokens(source)
+                self.assertEqual((cm.exception.line, cm.exception.col), (line, col))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Maps: literals, m[k], in, len() and for x in ..., on every backend.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, *args):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, *args, path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+class MapTest(unittest.TestCase):
+    PROGRAM = '''map m = {"a": 1, 2: "two", true: 3}
+m["b"] = 4
+m["a"] += 10
+m[1.0] += 1
+print << len(m) << " " << m["a"] << " " << m[1] << " " << m[2] << "\\n"
+print << "b" in m << " " << "z" in m << " " << "ell" in "hello" << "\\n"
+int[] xs = [3, 4]
+print << 4 in xs << " " << 5 in xs << "\\n"
+for k in m
+    m["n" + k] = 0
+    print << k << ","
+end for
+print << " " << len(m) << "\\n"
+for c in "hé"
+    print << c << "|"
+end for
+for x in xs
+    print << x * 2 << "|"
+end for
+print << "\\n"
+function count(map c, string s)
+    for ch in s
+        if ch in c
+            c[ch] += 1
+        else
+            c[ch] = 1
+        end if
+    end for
+    return c
+end function
+map c = count({}, "abca")
+print << c["a"] << c["b"] << len(c) << " " << {1: "x", "k": true} << "\\n"
+'''
+
+    def test_same_results(self):
+        # 1, 1.0 and true are one key, and a loop over a map takes the keys
+        # it has when it starts
+        expected = ("4 11 4 two\nTrue False True\nTrue False\na,2,True,b, 8\nh|é|6|8|\n"
+                    '213 {1: "x", "k": True}\n', '')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(self.PROGRAM, backend), expected)
+        self.assertEqual(run(self.PROGRAM, 'tree', '--tier-threshold', '1'), expected)
+
+    def test_missing_key(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, err = run('map m = {1: 2}\nprint << m[1]\nprint << m["zz"]\n', backend)
+                self.assertEqual(out, "2")
+                self.assertIn('Key "zz" not in map', err)
+
+    def test_parallel_for(self):
+        source = 'map m = {1: 2}\nparallel for k in m\n    print << k\nend for\n'
+        with self.assertRaisesRegex(FLUX.SourceError, "parallel for needs a range") as cm:
+            FLUX.parse_source(source)
+        self.assertEqual((cm.exception.line, cm.exception.col), (2, 16))
+
+    def test_embedded(self):
+        # A dict given as a global is a map
+        program = FLUX.compile('print << len(d) << d["x"] << "y" in d\n', globals=['d'])
+        self.assertEqual(program.run(globals={'d': {'x': 5}}), "15False")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Memoized pure functions: what counts as pure, hits and misses.
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, memo_size=FLUX.MEMO_SIZE):
+    # Print output, and the interpreter that ran source
+    stream = io.StringIO()
+    interp = FLUX.BACKENDS[backend](FLUX.Output(stream, 0), memo_size)
+    interp.eval(FLUX.parse_source(source))
+    return stream.getvalue(), interp
+
+
+class PurityTest(unittest.TestCase):
+    PROGRAM = '''
+int g = 1
+function sq(int x)
+    return x * x
+end function
+function sum_sq(int n)
+    int s = 0
+    for i = 0 in n
+        s += sq(i)
+    end for
+    return s
+end function
+function loud(int x)
+    print << x
+    return x
+end function
+function calls_loud(int x)
+    return loud(x) + 1
+end function
+function reads_global(int x)
+    return x + g
+end function
+function asks(int x)
+    string s = input << ""
+    return x
+end function
+function twice(int x)
+    return x
+end function
+function twice(int x)
+    return x + x
+end function
+'''
+
+    def test_pure(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                _, interp = run(self.PROGRAM, backend)
+                self.assertEqual(interp.pure, {'sq', 'sum_sq'})
+
+    def test_global_read(self):
+        # Not memoized: the global changes between the calls, and loud prints
+        # (while the print statement that calls it evaluates its parts)
+        source = self.PROGRAM + ('print << reads_global(1) << " "\ng = 5\n'
+                                 'print << reads_global(1) << " " << calls_loud(3) << calls_loud(3)\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend)[0], "2 336 44")
+
+
+class MemoTest(unittest.TestCase):
+    FIB = ('function fib(int n)\n    if n < 2\n        return n\n    end if\n'
+           '    return fib(n - 1) + fib(n - 2)\nend function\n')
+
+    def test_hits(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, interp = run(self.FIB + 'print << fib(80)\n', backend)
+                self.assertEqual(out, "23416728348467685")
+                memo = interp.memo
+                self.assertEqual((memo.misses, memo.hits, memo.evictions), (81, 78, 0))
+
+    def test_evictions(self):
+        source = self.FIB + 'print << fib(3) << fib(6)\n'
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, interp = run(source, backend, 2)
+                self.assertEqual(out, "28")
+                self.assertEqual(len(interp.memo.cache), 2)
+                self.assertGreater(interp.memo.evictions, 0)
+
+    def test_off(self):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, interp = run(self.FIB + 'print << fib(15)\n', backend, 0)
+                self.assertEqual(out, "610")
+                self.assertIsNone(interp.memo)
+
+    def test_argument_types(self):
+        # 1, 1.0 and true, and 0.0 and -0.0, are cached apart
+        source = ('function show(float x)\n    return "v=" + x\nend function\n'
+                  'print << show(1) << " " << show(1.0) << " " << show(true) << " "\n'
+                  'print << show(0.0) << " " << show(-0.0) << " " << show(0.0)\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, interp = run(source, backend)
+                self.assertEqual(out, "v=1 v=1.0 v=True v=0.0 v=-0.0 v=0.0")
+                self.assertEqual(interp.memo.hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
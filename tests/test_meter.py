@@ -0,0 +1,115 @@
+"""Metered runs: every limit stops a run, on every backend, and no sooner.
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, **limits):
+    # Print output of a run under a Meter with limits
+    stream = io.StringIO()
+    out = FLUX.Output(stream, 0)
+    interp = FLUX.BACKENDS[backend](out)
+    interp.workers = 1
+    interp.meter = FLUX.Meter(**limits)
+    try:
+        interp.eval(FLUX.parse_source(source))
+    finally:
+        out.flush()
+    return stream.getvalue()
+
+
+DOWN = ('function down(int n)\n    if n == 0\n        return 0\n    end if\n'
+        '    return down(n - 1) + 1\nend function\n')
+
+
+class LimitTest(unittest.TestCase):
+    def limited(self, source, message, **limits):
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                with self.assertRaises(FLUX.LimitExceeded) as cm:
+                    run(source, backend, **limits)
+                self.assertEqual(str(cm.exception), message)
+
+    def test_steps(self):
+        source = 'int t = 0\nwhile true\n    t += 1\nend while\n'
+        self.limited(source, "Step limit of 5000 exceeded at line 2", max_steps=5000)
+        self.limited(source, "Time limit of 0.05s exceeded at line 2", timeout=0.05)
+
+    def test_calls(self):
+        # Calls are steps too (down is not memoized: it prints)
+        source = (DOWN.replace('return 0', 'print << ""\n        return 0') +
+                  'int t = 0\nfor i = 0 in 300\n    t += down(20)\nend for\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                with self.assertRaisesRegex(FLUX.LimitExceeded, "^Step limit of 5000 exceeded"):
+                    run(source, backend, max_steps=5000, max_depth=30)
+
+    def test_depth(self):
+        # down(49) is 50 levels deep
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(DOWN + 'print << down(49)\n', backend, max_depth=50), "49")
+        self.limited(DOWN + 'print << down(50)\n', "Call depth limit of 50 exceeded at line 5",
+                     max_depth=50)
+
+    def test_loop_at_depth_limit(self):
+        # The loop runs 9 levels deep, calling leaf at the 10th
+        source = ('function leaf(int n)\n    return n\nend function\n'
+                  'function deep(int n)\n    if n > 1\n        return deep(n - 1)\n    end if\n'
+                  '    int t = 0\n    for i = 0 in 5000\n        t += leaf(1)\n    end for\n'
+                  '    return t\nend function\nprint << deep(9)\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(source, backend, max_depth=10), "5000")
+        self.limited(source, "Call depth limit of 9 exceeded at line 10", max_depth=9)
+
+    def test_output_and_strings(self):
+        self.limited('int i = 0\nwhile i < 100\n    print << i\n    i += 1\nend while\n',
+                     "Output limit of 20 characters exceeded", max_output=20)
+        self.limited('string s = "ab"\nfor i = 0 in 6\n    s = s + s\nend for\n',
+                     "String length limit of 100 exceeded", max_string=100)
+        self.limited('string s = ""\nfor i = 0 in 200\n    s += "ab"\nend for\nprint << len(s)\n',
+                     "String length limit of 100 exceeded", max_string=100)
+
+    def test_parallel_for(self):
+        # A parallel for with one worker spends the steps of every range
+        source = ('int s = 0\nfor j = 0 in 10\n'
+                  '    parallel for i = 0 in 800\n        if i > 10\n'
+                  '            s += i * 2\n        end if\n    end for\nend for\n')
+        self.limited(source, "Step limit of 5000 exceeded at line 3", max_steps=5000)
+
+
+class ProgramTest(unittest.TestCase):
+    def test_runs(self):
+        # Every run starts counting again, whatever the last one did
+        source = DOWN + 'print << down(n)\n'
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                program = FLUX.compile(source, backend, globals=('n',))
+                with self.assertRaises(FLUX.LimitExceeded):
+                    program.run({'n': 40}, max_depth=30)
+                for _ in range(3):
+                    self.assertEqual(program.run({'n': 29}, max_depth=30, max_steps=100), "29")
+
+    def test_string_limit(self):
+        # Runs with and without a string limit share nothing
+        source = 'string s = "ab"\nfor i = 0 in 6\n    s = s + s\nend for\nprint << len(s)\n'
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                program = FLUX.compile(source, backend)
+                self.assertEqual(program.run(max_steps=100), "128")
+                with self.assertRaises(FLUX.LimitExceeded):
+                    program.run(max_steps=100, max_string=100)
+                self.assertEqual(program.run(max_string=1000), "128")
+
+
+if __name__ == '__main__':
+    unittest.main()
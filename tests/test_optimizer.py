@@ -0,0 +1,143 @@
+"""What the optimizer makes of programs, and that it changes no output.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def optimize(source, level=1):
+    ast = FLUX.Parser(FLUX.Lexer(source).tokenize()).parse_program()
+    return FLUX.Optimizer(level).optimize(ast)
+
+
+def tags(node, found=None):
+    # Every node tag in an AST
+    found = set() if found is None else found
+    if isinstance(node, tuple) and node and isinstance(node[0], str):
+        found.add(node[0])
+    if isinstance(node, (tuple, list)):
+        for c in node:
+            tags(c, found)
+    return found
+
+
+def loop_ops(node, found=None, in_loop=False):
+    # Operators of the BINOPs inside FOR loops of an AST
+    found = set() if found is None else found
+    if isinstance(node, tuple) and node and isinstance(node[0], str):
+        if node[0] == 'BINOP' and in_loop:
+            found.add(node[1])
+        in_loop = in_loop or node[0] == 'FOR'
+    if isinstance(node, (tuple, list)):
+        for c in node:
+            loop_ops(c, found, in_loop)
+    return found
+
+
+def run(source, backend, level):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, f'-O{level}', path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+class FoldTest(unittest.TestCase):
+    def test_constants(self):
+        _, (node,) = optimize('print << 2 * 3 + 1 << 6 / 3 << 7 / 2 << "a" + 1 << -(4)\n')
+        self.assertEqual([p[:2] for p in node[1]],
+                         [('NUMBER', 7), ('NUMBER', 2), ('NUMBER', 3.5),
+                          ('STRING', 'a1'), ('NUMBER', -4)])
+        self.assertIs(type(node[1][1][1]), int)
+
+    def test_level_0(self):
+        self.assertIn('BINOP', tags(optimize('print << 2 * 3\n', 0)))
+
+    def test_errors_left(self):
+        # 1 / 0 is the runtime's to report
+        self.assertIn('BINOP', tags(optimize('print << 1 / 0\n')))
+
+
+class BranchTest(unittest.TestCase):
+    def test_constant_if(self):
+        ast = optimize('if 1 == 2\n    print << "no"\nelif 2 > 1\n    print << 2 * 3\n'
+                       'else\n    print << "else"\nend if\n')
+        self.assertEqual(tags(ast), {'PROGRAM', 'PRINT', 'NUMBER'})
+
+    def test_true_elif_becomes_else(self):
+        # The elif branch that always runs is the else, optimized too
+        ast = optimize('int x = 0\nif x > 0\n    print << 1\nelif 1\n    print << 2 * 3\n'
+                       'else\n    print << 4\nend if\n')
+        node = ast[1][1]
+        self.assertEqual(node[0], 'IF')
+        self.assertEqual(len(node[1]), 1)
+        self.assertEqual([s[:2] for s in node[2]], [('PRINT', [('NUMBER', 6)])])
+
+    def test_dead_loops(self):
+        ast = optimize('while false\n    print << 1\nend while\n'
+                       'for i = 5 in 2\n    print << 2\nend for\nprint << 3\n')
+        self.assertEqual(tags(ast), {'PROGRAM', 'PRINT', 'NUMBER'})
+
+
+class HoistTest(unittest.TestCase):
+    LOOP = ('int n = 5\nint k = 3\nint s = 0\nfor i = 0 in n\n    s += k * k + i\n'
+            'KEEP\nend for\nprint << s << "\\n"\n')
+
+    def test_invariant(self):
+        source = self.LOOP.replace('KEEP', '')
+        self.assertEqual(loop_ops(optimize(source, 2)), {'+'})
+        self.assertEqual(loop_ops(optimize(source, 1)), {'+', '*'})
+
+    def test_written_in_loop(self):
+        self.assertEqual(loop_ops(optimize(self.LOOP.replace('KEEP', '    k = 2'), 2)),
+                         {'+', '*'})
+
+
+class OutputTest(unittest.TestCase):
+    PROGRAM = '''
+int n = 5
+int k = 3
+int z = 0
+int s = 0
+for i = 0 in n
+    s += k * k + i
+end for
+int m = 0
+for i = 0 in m
+    s += 10 / z
+end for
+int j = 0
+while j < n * 2
+    j += 1
+    if k > 10
+        print << "big"
+    elif 1
+        print << j << " "
+    end if
+end while
+string t = "ab" + "cd"
+print << s << " " << t[1:3] << " " << 7 / 2 << "\\n"
+'''
+
+    def test_levels(self):
+        # Same output at every level; the never-run loop raises nothing
+        expected = "1 2 3 4 5 6 7 8 9 10 55 bc 3.5\n", ''
+        for backend in FLUX.BACKENDS:
+            for level in (0, 1, 2):
+                with self.subTest(backend=backend, level=level):
+                    self.assertEqual(run(self.PROGRAM, backend, level), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
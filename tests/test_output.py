@@ -0,0 +1,83 @@
+"""Batched print output: when it is written, and in what order.
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, stdin='', *args):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, *args, path],
+                           input=stdin, capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+class CountingBytes(io.BytesIO):
+    writes = 0
+    def write(self, b):
+        self.writes += 1
+        return io.BytesIO.write(self, b)
+
+
+class OutputTest(unittest.TestCase):
+    def test_batches(self):
+        raw = CountingBytes()
+        stream = io.TextIOWrapper(raw, encoding='utf-8')
+        out = FLUX.Output(stream, 10)
+        out.write("héllo")
+        self.assertEqual(raw.writes, 0)
+        out.write(" world")
+        self.assertEqual(raw.writes, 1)
+        out.write("!")
+        out.flush()
+        self.assertEqual(raw.writes, 2)
+        self.assertEqual(raw.getvalue().decode('utf-8'), "héllo world!")
+
+    def test_write_through(self):
+        stream = io.StringIO()
+        out = FLUX.Output(stream, 0)
+        out.write("a")
+        self.assertEqual(stream.getvalue(), "a")
+
+
+class OrderTest(unittest.TestCase):
+    def test_prompt(self):
+        # Pending output comes before the prompt
+        source = 'print << "a "\nstring n = input << "name> "\nprint << n << "\\n"\n'
+        for backend in FLUX.BACKENDS:
+            for args in ((), ('--unbuffered',), ('--buffer-size', '1')):
+                with self.subTest(backend=backend, args=args):
+                    self.assertEqual(run(source, backend, 'ada\n', *args), ("a name> ada\n", ''))
+
+    def test_error(self):
+        # ... and before the traceback of an error
+        source = 'print << "before\\n"\nint z = 0\nprint << 1 / z\n'
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, err = run(source, backend)
+                self.assertEqual(out, "before\n")
+                self.assertIn("ZeroDivisionError", err)
+
+    def test_output_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'out.txt')
+            self.assertEqual(run('print << "é\\n"\n', 'tree', '', '--output', path), ('', ''))
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), "é\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""parallel for: the same results as a for loop, and what it rejects.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, *args):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, *args, path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+def errors(source):
+    try:
+        FLUX.Resolver().resolve_program(FLUX.parse_source(source))
+    except Exception as e:
+        return str(e).splitlines()
+    return []
+
+
+class ParallelTest(unittest.TestCase):
+    # int, float and string reductions, output, and the values declared
+    # in the body, which are kept as after a for loop
+    PROGRAM = '''function sq(int x)
+    return x * x
+end function
+int total = 0
+float half = 0
+string marks = ""
+parallel for i = 1 in 40
+    int s = sq(i)
+    total += s
+    half += i / 4
+    if s > 1000
+        marks += i
+        marks += " "
+        print << "at " << i << "\\n"
+    end if
+end for
+print << total << " " << half << " " << marks << i << " " << s << "\\n"
+'''
+
+    def test_same_as_for(self):
+        expected, err = run(self.PROGRAM.replace('parallel for', 'for'), 'tree')
+        self.assertEqual(err, '')
+        self.assertTrue(expected.endswith("at 39\n20540 195.0 32 33 34 35 36 37 38 39 39 1521\n"))
+        for backend in FLUX.BACKENDS:
+            for workers in ('1', '3'):
+                with self.subTest(backend=backend, workers=workers):
+                    self.assertEqual(run(self.PROGRAM, backend, '--workers', workers), (expected, ''))
+
+    def test_dependent(self):
+        where = "parallel for at line 2: "
+        self.assertEqual(errors('int t = 0\nparallel for i = 0 in 4\n    t = i\nend for\n'),
+                         [where + "outer variable 't' can only be grown with += (in top level)"])
+        self.assertEqual(errors('int t = 0\nparallel for i = 0 in 4\n    t += i\n'
+                                '    print << t\n    return 1\nend for\n'),
+                         [where + "return is not allowed (in top level)",
+                          where + "accumulator 't' is read in the loop (in top level)"])
+        self.assertEqual(errors('int t = 0\nparallel for i = 0 in 4\n    int y = x\n    int x = i\nend for\n'),
+                         [where + "'x' may be used before this iteration declares it (in top level)"])
+
+    def test_writing_call(self):
+        source = ('int t = 0\nfunction f(int x)\n    t += x\n    return x\nend function\n'
+                  'parallel for i = 0 in 4\n    int y = f(i)\nend for\n')
+        self.assertEqual(errors(source),
+                         ["parallel for at line 6: 'f' may write globals or arrays or read input (in top level)"])
+
+
+if __name__ == '__main__':
+    unittest.main()
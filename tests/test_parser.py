@@ -0,0 +1,45 @@
+"""The parser: shared leaves, streamed tokens, and syntax errors.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+class LeafTest(unittest.TestCase):
+    def test_shared(self):
+        source = 'int x = 1\nint y = x + 1.0 + 1 + true\nprint << "s" << "s" << x << 1\n'
+        (_, stmts) = FLUX.parse_source(source, 0)
+        one = stmts[0][3]
+        sum3 = stmts[1][3]
+        sum2 = sum3[2]
+        sum1 = sum2[2]
+        parts = stmts[2][1]
+        self.assertEqual(sum1, ('BINOP', '+', ('VAR', 'x'), ('NUMBER', 1.0)))
+        self.assertIs(parts[0], parts[1])
+        self.assertIs(parts[2], sum1[2])
+        self.assertIs(parts[3], one)
+        self.assertIs(sum2[3], one)
+        # 1, 1.0 and true are equal, but not the same leaf
+        self.assertIs(type(sum1[3][1]), float)
+        self.assertIsNot(sum1[3], one)
+        self.assertEqual(sum3[3], ('BOOL', True))
+
+    def test_stream(self):
+        # The parser takes the tokens as they come, so a syntax error is
+        # reported before a bad character after it
+        tokens = FLUX.Lexer('int x = (1\nx = @\n').tokens()
+        with self.assertRaisesRegex(FLUX.SourceError, "^Expected RPAREN") as cm:
+            FLUX.Parser(tokens).parse_program()
+        self.assertEqual((cm.exception.line, cm.exception.col), (1, 11))
+        self.assertEqual(FLUX.Parser(FLUX.Lexer('print << 1\n').tokens()).parse_program(),
+                         FLUX.Parser(FLUX.Lexer('print << 1\n').tokenize()).parse_program())
+
+
+if __name__ == '__main__':
+    unittest.main()
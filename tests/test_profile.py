@@ -0,0 +1,84 @@
+"""Source lines in the AST, and what --profile reports.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+PROGRAM = '''function leaf(int x)
+    return x * 2
+end function
+function mid(int n)
+    int s = 0
+    for i = 0 in n
+        s += leaf(i)
+    end for
+    print << s << "\\n"
+    return s
+end function
+mid(3)
+mid(4)
+'''
+
+
+def run(source, backend, *args):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, *args, path],
+                           capture_output=True, text=True)
+    return p.returncode, p.stdout, p.stderr
+
+
+class LineTest(unittest.TestCase):
+    def test_statements(self):
+        # Every statement, and every call, ends with its line
+        _, stmts = FLUX.parse_source(PROGRAM)
+        self.assertEqual([s[-1] for s in stmts], [1, 4, 12, 13])
+        body = stmts[1][3]
+        self.assertEqual([s[-1] for s in body], [5, 6, 9, 10])
+        self.assertEqual(body[1][4][0][-1], 7)
+        call = body[1][4][0][3]
+        self.assertEqual((call[0], call[-1]), ('CALL', 7))
+
+
+class ProfileTest(unittest.TestCase):
+    def test_tables(self):
+        for backend in ('tree', 'closure'):
+            with self.subTest(backend=backend):
+                code, out, err = run(PROGRAM, backend, '--profile', '--memo-size', '0')
+                self.assertEqual((code, out), (0, "6\n12\n"))
+                functions, lines = err.split('\n\n')
+                calls = {row.split()[0]: int(row.split()[1])
+                         for row in functions.splitlines()[1:]}
+                self.assertEqual(calls, {'<program>': 1, 'mid': 2, 'leaf': 7})
+                hits = {int(row.split()[0]): int(row.split()[2])
+                        for row in lines.splitlines()[1:]}
+                self.assertEqual((hits[7], hits[2], hits[12]), (7, 7, 1))
+
+    def test_stacks(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'stacks.txt')
+            run(PROGRAM, 'tree', '--profile', '--profile-stacks', path)
+            with open(path) as f:
+                stacks = [line.rsplit(' ', 1)[0] for line in f.read().splitlines()]
+        self.assertEqual(stacks, ['<program>', '<program>;mid', '<program>;mid;leaf'])
+
+    def test_vm(self):
+        code, _, err = run(PROGRAM, 'vm', '--profile')
+        self.assertEqual(code, 2)
+        self.assertIn("--profile needs the tree or closure backend", err)
+
+
+if __name__ == '__main__':
+    unittest.main()
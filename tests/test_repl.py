@@ -0,0 +1,83 @@
+"""The interactive session: state kept between statements, errors, limits.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def session(lines, backend, *args):
+    # A session fed on a pipe: no prompts
+    p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                        '--backend', backend, *args],
+                       input=lines, capture_output=True, text=True)
+    return p.stdout, p.stderr, p.returncode
+
+
+class SessionTest(unittest.TestCase):
+    LINES = '''int g = 2
+function f(int x)
+    return x * g
+end function
+print << f(3) << "\\n"
+print << 1 / 0 << "\\n"
+print << nope << "\\n"
+return 1
+g = 5
+string s = "a
+b"
+if g > 3
+    print << s << f(1) << "\\n"
+end if
+function f(int x)
+    return x + g
+end function
+print << f(3) << "\\n"
+'''
+
+    def test_errors_go_on(self):
+        errors = ("error: division by zero\n"
+                  "error: Variable 'nope' not defined at line 7 (in top level)\n"
+                  "error: return outside a function\n")
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(session(self.LINES, backend), ("6\na\nb5\n8\n", errors, 0))
+
+    def test_memo_after_redefinition(self):
+        # A pure redefinition is memoized again; one that prints is not
+        lines = ('function sq(int x)\n    return x * x\nend function\n'
+                 'print << sq(4) << sq(4) << "\\n"\n'
+                 'function sq(int x)\n    return x + x\nend function\n'
+                 'print << sq(4) << sq(4) << "\\n"\n'
+                 'function sq(int x)\n    print << "!"\n    return x\nend function\n'
+                 'print << sq(4) << sq(4) << "\\n"\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, err, _ = session(lines, backend, '--memo-stats')
+                self.assertEqual(out, "1616\n88\n!!44\n")
+                self.assertTrue(err.startswith("memo: 2 hits, 2 misses"))
+
+    def test_limits_per_statement(self):
+        # Each statement has the whole budget; a cut-off call leaves no scopes
+        lines = ('int t = 0\n' + 'for i = 0 in 200\n    t += i\nend for\n' * 2
+                 + 'function down(int n)\n    return down(n + 1)\nend function\n'
+                 'print << down(0)\nprint << t << "\\n"\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(session(lines, backend, '--max-steps', '300', '--max-depth', '20'),
+                                 ("39800\n", "error: Call depth limit of 20 exceeded at line 9\n", 0))
+
+    def test_no_stream(self):
+        _, err, code = session('', 'tree', '--stream')
+        self.assertEqual(code, 2)
+        self.assertIn("--stream needs a program", err)
+
+
+if __name__ == '__main__':
+    unittest.main()
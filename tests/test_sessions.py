@@ -0,0 +1,89 @@
+"""Async VM sessions: input from a reader, fair turns, and the demo server.
+
+    python -m pytest -q tests
+"""
+import asyncio
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+ECHO = '''string line = input << "> "
+while line != "quit"
+    print << "echo " << line << "\\n"
+    line = input << "> "
+end while
+print << "bye\\n"
+'''
+
+SPIN = 'int n = 0\nfor i = 0 in 5000\n    n += i\nend for\nprint << n << "\\n"\n'
+
+
+def session(source, lines, ticks=FLUX.ASYNC_TICKS, done=None, name=None):
+    # Runs source as a session reading `lines`; returns what it wrote
+    vm = FLUX.VirtualMachine(FLUX.Output(io.StringIO(), sys.maxsize))
+    code = vm.compile_code(FLUX.parse_source(source))
+    lines = iter(lines)
+    written = []
+    async def reader():
+        return next(lines, None)
+    async def writer(text):
+        written.append(text)
+    async def go():
+        await vm.run_async(code, reader, writer, ticks)
+        if done is not None:
+            done.append(name)
+        return ''.join(written)
+    return go()
+
+
+class SessionTest(unittest.TestCase):
+    def test_input(self):
+        out = asyncio.run(session(ECHO, ['a', 'b c', 'quit']))
+        self.assertEqual(out, "> echo a\n> echo b c\n> bye\n")
+
+    def test_eof(self):
+        with self.assertRaises(EOFError):
+            asyncio.run(session(ECHO, ['a']))
+
+    def test_turns(self):
+        # A spinning session gives the others a turn every `ticks` ticks
+        done = []
+        async def both():
+            return await asyncio.gather(session(SPIN, [], 100, done, 'spin'),
+                                        session(ECHO, ['x', 'quit'], 100, done, 'echo'))
+        self.assertEqual(asyncio.run(both()), ["12497500\n", "> echo x\n> bye\n"])
+        self.assertEqual(done, ['echo', 'spin'])
+
+    def test_same_as_run(self):
+        # Stopping and resuming changes nothing
+        stream = io.StringIO()
+        FLUX.VirtualMachine(FLUX.Output(stream, 0)).eval(FLUX.parse_source(SPIN))
+        self.assertEqual(asyncio.run(session(SPIN, [], 1)), stream.getvalue())
+
+
+class ServeTest(unittest.TestCase):
+    def test_sessions(self):
+        async def client(port, lines):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(''.join(line + '\n' for line in lines).encode('utf-8'))
+            reply = await reader.read()
+            writer.close()
+            return reply.decode('utf-8')
+        async def go():
+            server = await FLUX.serve(FLUX.parse_source(ECHO))
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await asyncio.gather(client(port, ['one', 'quit']),
+                                            client(port, ['two', 'three', 'quit']))
+        self.assertEqual(asyncio.run(go()),
+                         ["> echo one\n> bye\n", "> echo two\n> echo three\n> bye\n"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""Streamed runs: statements run as they are parsed, with whole-program results.
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import select
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend, *args, stdin=None):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        if stdin is None:
+            args += (path,)
+        else:
+            stdin = source
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, *args],
+                           input=stdin, capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+def stream(source, backend, meter=None):
+    out = io.StringIO()
+    interp = FLUX.BACKENDS[backend](FLUX.Output(out, 0), FLUX.MEMO_SIZE)
+    interp.meter = meter
+    interp.stream(FLUX.Parser(FLUX.Lexer(source).tokens()).statements())
+    return out.getvalue(), interp
+
+
+class SameTest(unittest.TestCase):
+    # Functions may use globals declared after them, and a redefinition
+    # takes over from where it runs
+    PROGRAM = '''int n = 3
+function f(int x)
+    return x + g
+end function
+int g = 10
+print << f(n) << "\\n"
+function f(int x)
+    return x * g
+end function
+print << f(n) << "\\n"
+string s = "ab
+cd"
+for i = 0 in 3
+    print << i
+end for
+print << " " << s << "\\n"
+'''
+
+    def test_same_as_batch(self):
+        expected = "13\n30\n012 ab\ncd\n", ''
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(self.PROGRAM, backend), expected)
+                self.assertEqual(run(self.PROGRAM, backend, '--stream'), expected)
+                self.assertEqual(run(self.PROGRAM, backend, '-', stdin=True), expected)
+
+    def test_not_defined_yet(self):
+        source = 'print << "a"\nprint << f(1)\nfunction f(int x)\n    return x\nend function\n'
+        out, err = run(source, 'tree', '--stream')
+        self.assertEqual(out, "a")
+        self.assertIn("Function 'f' not defined", err)
+
+    def test_redefined_callee(self):
+        # f stops being memoized once the g it calls prints
+        source = ('function g(int x)\n    return x * 2\nend function\n'
+                  'function f(int x)\n    return g(x) + 1\nend function\n'
+                  'print << f(1) << " " << f(1) << "\\n"\n'
+                  'function g(int x)\n    print << "g"\n    return x\nend function\n'
+                  'print << f(1) << f(1) << "\\n"\n')
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                out, interp = stream(source, backend)
+                self.assertEqual(out, "3 3\ngg22\n")
+                self.assertEqual(interp.pure, set())
+
+    def test_limits(self):
+        # The meter covers the statements together, not each on its own
+        source = 'int t = 0\n' + 'for i = 0 in 500\n    t += i\nend for\n' * 36
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                with self.assertRaisesRegex(FLUX.LimitExceeded, "Step limit of 5000"):
+                    stream(source, backend, FLUX.Meter(max_steps=5000))
+
+
+class PipeTest(unittest.TestCase):
+    def test_output_before_end(self):
+        # Output of the first statement comes while stdin is still open
+        p = subprocess.Popen([sys.executable, os.path.join(ROOT, 'FLUX.py'), '-'],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            p.stdin.write('print << "first\\n"\n')
+            p.stdin.flush()
+            ready, _, _ = select.select([p.stdout], [], [], 30)
+            self.assertTrue(ready)
+            self.assertEqual(p.stdout.readline(), "first\n")
+            p.stdin.write('print << "second\\n"\n')
+            p.stdin.close()
+            self.assertEqual(p.stdout.read(), "second\n")
+        finally:
+            p.stdout.close()
+            p.wait()
+        self.assertEqual(p.returncode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""String += through StringBuilder: no aliasing, and the same results.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, backend):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+class BuilderTest(unittest.TestCase):
+    def test_join_once(self):
+        b = FLUX.StringBuilder('ab')
+        b.parts += ['c', 'd']
+        self.assertEqual(str(b), 'abcd')
+        self.assertEqual(b.parts, ['abcd'])
+
+
+class AliasTest(unittest.TestCase):
+    # A copy taken from a variable being grown with += never changes
+    PROGRAM = '''
+string g = "g"
+string kept = g
+g += 1
+string mid = g
+g += "2"
+print << kept << " " << mid << " " << g << "\\n"
+function grow(string s)
+    string before = s
+    for i = 0 in 3
+        s += i
+        before += "."
+    end for
+    return s + "|" + before
+end function
+string arg = "x"
+arg += "y"
+print << grow(arg) << " " << arg << "\\n"
+function build(int n)
+    string s = ""
+    string first = ""
+    for i = 0 in n
+        s += i
+        if i == 1
+            first = s
+        end if
+    end for
+    return first + " " + s[1:4] + " " + s
+end function
+print << build(6) << "\\n"
+string t = "a"
+t += "b"
+t = t + t
+t += "c"
+print << t << " " << t == "ababc" << "\\n"
+'''
+
+    def test_aliasing(self):
+        expected = "g g1 g12\nxy012|xy... xy\n01 123 012345\nababc True\n", ''
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(self.PROGRAM, backend), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
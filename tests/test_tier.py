@@ -0,0 +1,98 @@
+"""Tiered tree walker: hot functions and loops compiled to Python run the same.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def run(source, *args):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--memo-size', '0', *args, path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+# A while loop that gets hot half way, returns from inside loops, string
+# and array writes, globals written by compiled functions, and a call used
+# as a statement that returns the number of the VM's return opcode
+PROGRAM = '''int g = 0
+function fib(int n)
+    if n < 2
+        return n
+    end if
+    return fib(n - 1) + fib(n - 2)
+end function
+function find(int n)
+    for i = 0 in 100
+        if i * i > n
+            return i
+        end if
+    end for
+    return -1
+end function
+function bump(int k)
+    g += k
+    return RET
+end function
+function grow(int n)
+    string s = ""
+    int[] a = zeros(n)
+    for i = 0 in n
+        s += i
+        a[i] = i * i
+    end for
+    return s + " " + sum(a)
+end function
+function early(int x)
+    bump(x)
+    return x / 2
+end function
+int j = 0
+float acc = 0
+while j < 250
+    j += 1
+    acc += j / 4
+    if j == 120
+        print << "mid " << acc << "\\n"
+    end if
+end while
+print << fib(15) << " " << find(50) << " " << find(99999) << " " << grow(5) << "\\n"
+for k = 0 in 5
+    bump(k)
+    print << early(k) << " "
+end for
+print << g << " " << acc << " " << j << "\\n"
+'''.replace('RET', str(FLUX.OPNAMES.index('RETURN_VALUE')))
+
+
+class TierTest(unittest.TestCase):
+    def test_thresholds(self):
+        expected = ("mid 1815.0\n610 8 -1 01234 30\n"
+                    "0 0.5 1 1.5 2 20 7843.75 250\n", '')
+        for threshold in (0, 1, 2, 100):
+            with self.subTest(threshold=threshold):
+                self.assertEqual(run(PROGRAM, '--tier-threshold', str(threshold)), expected)
+
+    def test_dump(self):
+        _, err = run(PROGRAM, '--tier-threshold', '100', '--tier-dump')
+        self.assertIn("# tier: function fib\n", err)
+        self.assertIn("# tier: while loop at line 35\n", err)
+        self.assertNotIn("# tier: function grow\n", err)
+        _, err = run(PROGRAM, '--tier-threshold', '0', '--tier-dump')
+        self.assertEqual(err, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Typed + and /: where they are chosen, and that they change no result.
+
+    python -m pytest -q tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import FLUX  # noqa: E402
+
+
+def ops(source):
+    # Operators of the BINOPs and ASSIGNs of the specialized program, in order
+    found = []
+    def walk(node):
+        if isinstance(node, tuple) and node and node[0] in ('BINOP', 'ASSIGN'):
+            found.append(node[1] if node[0] == 'BINOP' else node[2])
+        if isinstance(node, (tuple, list)):
+            for c in node:
+                walk(c)
+    walk(FLUX.TypeSpecializer().specialize_program(
+        FLUX.Resolver().resolve_program(FLUX.parse_source(source))))
+    return found
+
+
+def run(source, backend):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'prog.fx')
+        with open(path, 'w') as f:
+            f.write(source)
+        p = subprocess.run([sys.executable, os.path.join(ROOT, 'FLUX.py'),
+                            '--backend', backend, path],
+                           capture_output=True, text=True)
+    return p.stdout, p.stderr
+
+
+class SpecializeTest(unittest.TestCase):
+    def test_known(self):
+        source = ('int a = 1\nfloat f = 2\nstring s = "x"\n'
+                  'print << a + a << f + a << s + s << a / a << f / a\n')
+        self.assertEqual(ops(source), ['add', 'add', 'concat', 'idiv', 'fdiv'])
+
+    def test_unproven(self):
+        # Parameters are not converted, and plain = stores anything
+        source = ('function p(int x)\n    return x + 1\nend function\n'
+                  'int v = 1\nv = "str"\nprint << v + 1 << v / 2 << p(1)\n')
+        self.assertEqual(ops(source), ['+', '=', '+', '/'])
+
+    def test_augmented(self):
+        source = ('float t = 0\nstring u = ""\nfor i = 0 in 3\n    t += i\n'
+                  '    u += "a"\nend for\n')
+        self.assertEqual(ops(source), ['add=', '+='])
+
+
+class ResultTest(unittest.TestCase):
+    PROGRAM = '''
+int a = 7
+int b = 2
+float f = 0.5
+int big = 100000000000000000000
+int odd = 100000000000000000010
+string s = "n"
+print << a / b << " " << 6 / b << " " << a / f << " " << big / 10 << " " << odd / 10 << "\\n"
+print << a + f << " " << s + a << " " << a + b << " " << f + f << "\\n"
+float t = 0
+for i = 0 in 4
+    t += i / 2
+    s += i
+end for
+int v = 1
+v = "str"
+print << t << " " << s << " " << v + 1 << "\\n"
+'''
+
+    def test_same_results(self):
+        expected, err = run(self.PROGRAM, 'tree')
+        self.assertEqual(err, '')
+        self.assertTrue(expected.startswith("3.5 3 14.0 10000000000000000000 "))
+        for backend in FLUX.BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(run(self.PROGRAM, backend), (expected, ''))
+
+
+if __name__ == '__main__':
+    unittest.main()